@@ -0,0 +1,131 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data.adress import ADRESS_DIR, CHAT_DERIVED_LABELS, clean_CHAT_series, clean_CHAT_text, label_CHAT_series
+
+# Per-label scans that label_CHAT_series replaces
+REFERENCE_LABEL_PATTERNS = {
+    "Filler": r"&(?!=)",
+    "Repetition": r"\[/\]",
+    "Revision": r"\[//\]",
+    "Short pause": r"\(\.\)",
+    "Medium pause": r"\(\.\.\)",
+    "Long pause": r"\(\.\.\.\)",
+    "Vague": r"\[\+ (?:es|cir)\]",
+    "Phonological Error": r"\[\*\s+p[^\]]*\]",
+    "Semantic Error": r"\[\*\s+s[^\]]*\]",
+    "Neologistic Error": r"\[\*\s+n[^\]]*\]",
+    "Morphological Error": r"\[\*\s+m[^\]]*\]",
+    "Dysfluency": r"\[\*\s+d[^\]]*\]",
+}
+
+# Representative ADReSS main tier utterances
+CHAT_SAMPLES = [
+    "well there's a mother standing there &uh washing the dishes and the sink is overflowing .",
+    "and the &uh little boy is on a stool that's falling over <and he's> [/] and he's reaching for a cookie jar .",
+    "&=laughs the water's &uh running over (.) onto the floor .",
+    "she's drying a dish (..) and &uh &um the boy's gonna fall off the stool .",
+    "the girl is saying shh [+ es] .",
+    "and she's <got her> [//] has her hand out (...) for a cookie .",
+    "the curtains are <blowing> [* s:r] in the &=clears:throat breeze .",
+    "xxx the mother's wa:ter is dripping +...",
+    "I don't know what else [+ cir] .",
+    "there's a cookie_jar up on the shelf and the kids are stealing (th)em .",
+    "+< yeah .",
+    "a stool [* p:w] is tipping ‡ over .",
+    "the wom@u is washing dishes [* m:+ed] .",
+    "&-um the boy [* d] has a cookie .",
+    "<the &uh> [/] the cupboard door is open .",
+]
+
+# Fragments of CHAT markup combined into fuzzed utterances
+CHAT_FRAGMENTS = [
+    "the", "boy", "cookie", "jar", ".", "?", "  ", "\t", "&um", "&uh", "&+fr", "&-um", "&=laughs", "&=clears:throat",
+    "[/]", "[//]", "[+ es]", "[+ cir]", "[* p:w]", "[* s:r]", "[* n]", "[* m:+ed]", "[* d]", "[*\tn ]", "[*  d:x]", "[* p",
+    "[: cookie]", "[>]", "[<]", "<", ">", "the jar>", "<sto:ol> [/]", "+<", "(.)", "(..)", "(...)", "(be)cause",
+    "xxx", "xxxx", "xx", "+/.", "+//.", "+...", "ice@l", "cookie_jar", "a_b_c", "a__b", "_a_b", "ab_", "‡", "wa:ter",
+    "a:b:c", "a:", ":", "]", ")", "(", "&", "@", "+", "_", "[* p: &um]", "&um[/]", "[* p(..)]", "a_b:c", "x:y_z",
+]
+
+
+def load_chat_texts(chat_dir):
+    '''
+    Load the raw main tier utterances of every CHAT file in a directory, like data.adress._build_transcripts.
+    '''
+    import pylangacq
+
+    reader = pylangacq.read_chat(os.path.join(chat_dir, ""))
+    return [u.tiers[u.participant].split("\x15", maxsplit=1)[0].strip() for u in reader.utterances()]
+
+
+def fuzz_texts(n, seed):
+    '''
+    Generate utterances from random CHAT fragments, both space separated and glued together.
+    '''
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choice(CHAT_FRAGMENTS) for _ in range(rng.randint(0, 12))) for _ in range(n // 2)]
+    texts += ["".join(rng.choice(CHAT_FRAGMENTS) for _ in range(rng.randint(0, 8))) for _ in range(n - n // 2)]
+    return texts
+
+
+def reference_labels(texts):
+    labels = pd.DataFrame({name: texts.str.contains(pattern).astype(int) for name, pattern in REFERENCE_LABEL_PATTERNS.items()})
+    for name, parts in CHAT_DERIVED_LABELS.items():
+        labels[name] = labels[parts].max(axis=1).astype(int)
+    return labels
+
+
+def count_mismatches(name, texts, expected, actual):
+    mismatches = expected != actual
+    for text, e, a in list(zip(texts[mismatches], expected[mismatches], actual[mismatches]))[:10]:
+        print(f"{name} mismatch on {text!r}:\n  reference {e!r}\n  batch     {a!r}")
+    return int(mismatches.sum())
+
+
+def verify(name, texts):
+    texts = pd.Series(texts, dtype=object)
+
+    t0 = time.perf_counter()
+    expected_clean = texts.apply(clean_CHAT_text)
+    expected_filler = texts.apply(clean_CHAT_text, keep_filler=True)
+    expected_labels = reference_labels(texts)
+    t_reference = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    clean, clean_w_filler = clean_CHAT_series(texts)
+    labels = label_CHAT_series(texts)
+    t_batch = time.perf_counter() - t0
+
+    n_mismatches = count_mismatches("clean", texts, expected_clean, clean)
+    n_mismatches += count_mismatches("clean_w_filler", texts, expected_filler, clean_w_filler)
+    n_mismatches += count_mismatches("clean keep_filler=False", texts, expected_clean, clean_CHAT_series(texts, keep_filler=False))
+    n_mismatches += count_mismatches("clean keep_filler=True", texts, expected_filler, clean_CHAT_series(texts, keep_filler=True))
+    for label in expected_labels.columns:
+        n_mismatches += count_mismatches(label, texts, expected_labels[label], labels[label])
+
+    print(f"{name}: {n_mismatches} mismatches on {len(texts)} utterances, reference {t_reference:.2f}s, batch {t_batch:.2f}s")
+    return n_mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat_dir", type=str, help="Directory of CHAT files to verify on.", default=ADRESS_DIR, required=False)
+    parser.add_argument("--n_fuzz", type=int, help="Number of fuzzed utterances.", default=40000, required=False)
+    parser.add_argument("--seed", type=int, help="Random seed of the fuzzed utterances.", default=0, required=False)
+    args = parser.parse_args()
+
+    n_mismatches = verify("samples", CHAT_SAMPLES)
+    if os.path.isdir(args.chat_dir):
+        n_mismatches += verify(f"CHAT files in {args.chat_dir}", load_chat_texts(args.chat_dir))
+    else:
+        print(f"Skipping CHAT files: {args.chat_dir} not found")
+    n_mismatches += verify("fuzzed", fuzz_texts(args.n_fuzz, args.seed))
+    n_mismatches += verify("fuzzed with separators", [text.replace("_", "\x00") for text in fuzz_texts(1000, args.seed + 1)])
+    sys.exit(1 if n_mismatches else 0)
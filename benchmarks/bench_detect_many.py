@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import create_custom_nlp
+from detectors.filler_speech.keyword_search import FillerKeywordDetector
+from detectors.repetitive_speech.unigram_analysis import UnigramAnalysisDetector
+
+
+def load_texts(texts_file):
+    '''
+    Load utterances from a text file (one per line) or from the ADReSS patient utterances.
+    '''
+    if texts_file is not None:
+        with open(texts_file, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from data.adress import load_transcripts
+    trans = load_transcripts()
+    return trans.loc[trans["Speaker"] == "Patient", "Transcript_clean"].tolist()
+
+
+def benchmark(name, detector, texts, batch_size, n_process):
+    # current per-row path used by the notebooks
+    t0 = time.perf_counter()
+    per_row = pd.Series(texts).apply(detector.detect).tolist()
+    t_per_row = time.perf_counter() - t0
+
+    # batched path
+    t0 = time.perf_counter()
+    batched = list(detector.detect_many(texts, batch_size=batch_size, n_process=n_process))
+    t_batched = time.perf_counter() - t0
+
+    assert per_row == batched, f"{name}: detect_many output differs from detect"
+    print(f"{name}: per-row {t_per_row:.2f}s, detect_many {t_batched:.2f}s ({t_per_row / t_batched:.1f}x) on {len(texts)} utterances")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=str, help="Text file with one utterance per line. Defaults to ADReSS patient utterances.", required=False)
+    parser.add_argument("--model", type=str, help="spaCy model name.", default="en_core_web_md", required=False)
+    parser.add_argument("--batch_size", type=int, help="nlp.pipe batch size.", default=1000, required=False)
+    parser.add_argument("--n_process", type=int, help="Number of nlp.pipe worker processes.", default=1, required=False)
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    nlp = create_custom_nlp(args.model, components=FillerKeywordDetector.required_components() + UnigramAnalysisDetector.required_components())
+
+    benchmark("FillerKeywordDetector", FillerKeywordDetector(nlp), texts, args.batch_size, args.n_process)
+    benchmark("UnigramAnalysisDetector", UnigramAnalysisDetector(nlp), texts, args.batch_size, args.n_process)
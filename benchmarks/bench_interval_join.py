@@ -0,0 +1,89 @@
+import argparse
+import ast
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectors.speech_delays.interval_join import SilenceIntervals, join_silences
+
+
+def make_data(n_visits, nan_rate, seed):
+    '''
+    Generate start-ordered, possibly overlapping utterances, some without timestamps, and stringified silence lists like notebook 06.
+    '''
+    rng = np.random.default_rng(seed)
+    rows, silences = [], {}
+    for v in range(n_visits):
+        visit = ("train", f"S{v:03d}")
+        t = 0
+        for u in range(rng.integers(0, 30)):
+            t += rng.integers(0, 3000)
+            start, end = float(t), float(t + rng.integers(0, 4000))
+            if rng.random() < nan_rate:
+                start, end = np.nan, np.nan
+            rows.append((*visit, u, start, end, rng.choice(["Patient", "Investigator"])))
+        starts = np.sort(rng.integers(0, t + 5000, rng.integers(0, 40)))
+        silences[visit] = str([[int(s), int(s + rng.integers(1, 4000))] for s in starts])
+    transcripts = pd.DataFrame(rows, columns=["split", "ID", "utt", "T_start_ms", "T_end_ms", "Speaker"]).set_index(["split", "ID", "utt"])
+    return transcripts, silences
+
+
+def loop_join(transcripts, silences, thresholds):
+    '''
+    Reference join of notebook 06: every silence counts for the first utterance it overlaps.
+    '''
+    counts = np.zeros((len(transcripts), len(thresholds)))
+    totals = np.zeros_like(counts)
+    pos = 0
+    for visit, group in transcripts.groupby(level=["split", "ID"], sort=False):
+        visit_silences = ast.literal_eval(silences.get(visit, "[]"))
+        used = set()
+        for k, (start, end) in enumerate(zip(group["T_start_ms"], group["T_end_ms"])):
+            for j, silence in enumerate(visit_silences):
+                if j not in used and silence[0] <= end and silence[1] >= start:
+                    used.add(j)
+                    duration = silence[1] - silence[0]
+                    for t, threshold in enumerate(thresholds):
+                        if duration >= threshold:
+                            counts[pos + k, t] += 1
+                            totals[pos + k, t] += duration
+        pos += len(group)
+    return counts, totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_visits", type=int, help="Number of generated visits.", default=300, required=False)
+    parser.add_argument("--nan_rate", type=float, help="Fraction of utterances without timestamps.", default=0.05, required=False)
+    parser.add_argument("--seed", type=int, help="Random seed.", default=0, required=False)
+    args = parser.parse_args()
+
+    transcripts, silence_lists = make_data(args.n_visits, args.nan_rate, args.seed)
+    thresholds = list(range(0, 4001, 20))
+
+    t0 = time.perf_counter()
+    silences = SilenceIntervals.from_lists(silence_lists)
+    t_convert = time.perf_counter() - t0
+
+    n_mismatches = 0
+    for speaker in [None, "Patient"]:
+        t0 = time.perf_counter()
+        counts, totals = join_silences(transcripts, silences, thresholds, speaker=speaker)
+        t_join = time.perf_counter() - t0
+
+        subset = transcripts if speaker is None else transcripts[transcripts["Speaker"] == speaker]
+        t0 = time.perf_counter()
+        expected_counts, expected_totals = loop_join(subset, silence_lists, thresholds)
+        t_loop = time.perf_counter() - t0
+
+        mismatches = int((counts.to_numpy() != expected_counts).any(axis=1).sum() + (~np.isclose(totals.to_numpy(), expected_totals)).any(axis=1).sum())
+        n_mismatches += mismatches
+        print(f"speaker={speaker}: {mismatches} mismatches on {len(subset)} utterances x {len(thresholds)} thresholds, join {t_join:.3f}s, loop {t_loop:.2f}s")
+
+    print(f"Converted {len(silences)} silences in {t_convert:.3f}s")
+    sys.exit(1 if n_mismatches else 0)
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tiktoken
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectors.common_detectors.llm_detector import AsyncLLMDetector, LLMDetector
+
+DEV_PROMPT = "You are a speech pathologist. Repeat the utterance back."
+USER_PROMPT = "Utterance: {}"
+TEXTS = [
+    "well there's a mother standing there washing the dishes",
+    "the little boy is on a stool that's falling over",
+    "and he's reaching for a cookie jar",
+    "the water's running over onto the floor",
+]
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    '''
+    Chat completions endpoint of a local stub of the OpenAI API. It echoes the last message,
+    optionally failing the first requests with 429 or answering with no content.
+    '''
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(body)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = server.n_failures > 0
+            server.n_failures -= int(fail)
+        try:
+            time.sleep(server.delay)
+            if fail:
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after": "0"})
+                return
+
+            last = body["messages"][-1]["content"]
+            content = None if server.null_marker in last else f"echo: {last}"
+            usage = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+            self._send(200, {
+                "id": f"mock-{len(server.requests)}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            with server.lock:
+                server.tokens_reported += usage["total_tokens"]
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(delay=0.0, null_marker="<no content>"):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.n_failures = 0
+    server.tokens_reported = 0
+    server.delay = delay
+    server.null_marker = null_marker
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_server(server, n_failures=0):
+    with server.lock:
+        server.requests = []
+        server.max_in_flight = 0
+        server.n_failures = n_failures
+        server.tokens_reported = 0
+
+
+def reference_tokens(encoding, messages):
+    '''
+    Count message tokens from scratch: 3 per message plus the encoded values, excluding the reply priming.
+    '''
+    return sum(3 + sum(len(encoding.encode(value)) for value in message.values()) for message in messages)
+
+
+class Checker:
+    def __init__(self):
+        self.n_failures = 0
+
+    def check(self, name, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}" + (f": {detail}" if detail and not ok else ""))
+        self.n_failures += int(not ok)
+
+
+def check_history(checker, server, base_url, model, encoding):
+    reset_server(server)
+    detector = LLMDetector(model, "mock-token", base_url, None, None, DEV_PROMPT, USER_PROMPT, 0.0, 1.0, maintain_history=True)
+    for i, text in enumerate(TEXTS):
+        sent = detector.get_messages() + [{"role": "user", "content": USER_PROMPT.format(text)}]
+        response = detector.detect(text)
+        checker.check(f"history turn {i}: response", response == f"echo: {USER_PROMPT.format(text)}", repr(response))
+        checker.check(f"history turn {i}: request sends the whole history", server.requests[-1]["messages"] == sent)
+        expected = reference_tokens(encoding, detector.get_messages())
+        checker.check(f"history turn {i}: running token count", detector.history_tokens == expected, f"{detector.history_tokens} != {expected}")
+        checker.check(f"history turn {i}: priming tokens", detector._count_messages_tokens() == expected + 3)
+
+    detector.reset_messages()
+    checker.check("reset keeps only the developer prompt", detector.get_messages() == [{"role": "developer", "content": DEV_PROMPT}])
+    checker.check("reset token count", detector.history_tokens == reference_tokens(encoding, detector.get_messages()))
+    checker.check("tokens used are the reported usage", detector.tokens_used == server.tokens_reported, f"{detector.tokens_used} != {server.tokens_reported}")
+    checker.check("requests made", detector.requests_made == len(TEXTS))
+
+
+def check_trimming(checker, server, base_url, model, encoding):
+    reset_server(server)
+    detector = LLMDetector(model, "mock-token", base_url, None, None, DEV_PROMPT, USER_PROMPT, 0.0, 1.0, maintain_history=False)
+    for i, text in enumerate(TEXTS):
+        detector.detect(text)
+        sent = server.requests[-1]["messages"]
+        checker.check(f"trimmed turn {i}: request sends only the prompts", sent == [{"role": "developer", "content": DEV_PROMPT}, {"role": "user", "content": USER_PROMPT.format(text)}])
+        checker.check(f"trimmed turn {i}: history trimmed", detector.get_messages() == [{"role": "developer", "content": DEV_PROMPT}])
+        checker.check(f"trimmed turn {i}: running token count", detector.history_tokens == reference_tokens(encoding, detector.get_messages()))
+        checker.check(f"trimmed turn {i}: request token count", detector._count_messages_tokens(sent) == reference_tokens(encoding, sent) + 3)
+
+
+def check_no_content(checker, server, base_url, model, encoding):
+    reset_server(server)
+    detector = LLMDetector(model, "mock-token", base_url, None, None, DEV_PROMPT, USER_PROMPT, 0.0, 1.0, maintain_history=True)
+    detector.detect(TEXTS[0])
+    history = list(detector.get_messages())
+
+    # A refusal or tool call has no content, it leaves no assistant message in the history
+    response = detector.detect(f"{server.null_marker} {TEXTS[1]}")
+    checker.check("no content: response", response is None, repr(response))
+    checker.check("no content: no assistant message", detector.get_messages()[-1]["role"] == "user" and all(m["content"] is not None for m in detector.get_messages()))
+    checker.check("no content: running token count", detector.history_tokens == reference_tokens(encoding, detector.get_messages()))
+
+    response = detector.detect(TEXTS[2])
+    checker.check("no content: next request", response == f"echo: {USER_PROMPT.format(TEXTS[2])}", repr(response))
+    checker.check("no content: history continues", detector.get_messages()[:len(history)] == history)
+
+def check_async(checker, server, base_url, model, n_texts, max_concurrency):
+    reset_server(server, n_failures=2)
+    detector = AsyncLLMDetector(model, "mock-token", base_url, None, None, DEV_PROMPT, USER_PROMPT, 0.0, 1.0, max_concurrency=max_concurrency, backoff_base=0.01)
+    texts = [f"{TEXTS[i % len(TEXTS)]} {i}" for i in range(n_texts)]
+
+    t0 = time.perf_counter()
+    responses = detector.detect_many(texts)
+    elapsed = time.perf_counter() - t0
+
+    checker.check("async responses in input order", responses == [f"echo: {USER_PROMPT.format(text)}" for text in texts])
+    checker.check("async retries the 429 responses", len(server.requests) == n_texts + 2, f"{len(server.requests)} requests")
+    checker.check("async requests are independent", all(len(request["messages"]) == 2 for request in server.requests))
+    checker.check("async in-flight requests bounded", server.max_in_flight <= max_concurrency, f"{server.max_in_flight} in flight")
+    print(f"async: {n_texts} requests in {elapsed:.2f}s, at most {server.max_in_flight} in flight")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, help="Model name sent to the mock server.", default="gpt-4o", required=False)
+    parser.add_argument("--n_texts", type=int, help="Number of concurrent requests of the async check.", default=64, required=False)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum in-flight requests of the async check.", default=8, required=False)
+    parser.add_argument("--delay", type=float, help="Mock server latency in seconds.", default=0.02, required=False)
+    args = parser.parse_args()
+
+    server = start_server(delay=args.delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    encoding = tiktoken.encoding_for_model(args.model)
+
+    checker = Checker()
+    check_history(checker, server, base_url, args.model, encoding)
+    check_trimming(checker, server, base_url, args.model, encoding)
+    check_no_content(checker, server, base_url, args.model, encoding)
+    check_async(checker, server, base_url, args.model, args.n_texts, args.max_concurrency)
+    server.shutdown()
+
+    print(f"{checker.n_failures} failed checks")
+    sys.exit(1 if checker.n_failures else 0)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import create_custom_nlp, doc_word_mask
+from detectors.repetitive_speech.unigram_analysis import UnigramAnalysisDetector
+
+
+def load_visit_texts(texts_file):
+    '''
+    Load one long text per visit from a text file (one visit per line) or from the
+    patient utterances of the OBSERVER visit transcripts.
+    '''
+    if texts_file is not None:
+        with open(texts_file, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from data.observer import load_penn_transcripts
+    trans = load_penn_transcripts()
+    trans = trans.loc[trans["Speaker"] == "Patient"]
+    return trans.groupby(level=["provider_id", "patient_id", "date"])["Transcript"].apply(lambda x: " ".join(x.astype(str))).tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=str, help="Text file with one visit transcript per line. Defaults to OBSERVER patient speech.", required=False)
+    parser.add_argument("--model", type=str, help="spaCy model name.", default="en_core_web_md", required=False)
+    parser.add_argument("--comparator", type=str, help="Comparator. Options are [\"exact\", \"lemma_exact\"]", default="exact", required=False)
+    parser.add_argument("--max_N", type=int, nargs="+", help="Maximum n-gram sizes to benchmark.", default=[1, 3], required=False)
+    parser.add_argument("--window_size", type=int, nargs="+", help="Window sizes to benchmark.", default=[2, 10, 50], required=False)
+    args = parser.parse_args()
+
+    texts = load_visit_texts(args.texts)
+    nlp = create_custom_nlp(args.model, components=UnigramAnalysisDetector.required_components(comparator=args.comparator))
+    docs = list(nlp.pipe(texts))
+    n_words = sum(int(doc_word_mask(doc).sum()) for doc in docs)
+    print(f"{len(docs)} visits, {n_words} words")
+
+    for max_N in args.max_N:
+        for window_size in args.window_size:
+            detector = UnigramAnalysisDetector(nlp, window_size=window_size, comparator=args.comparator)
+            detector.max_N = max_N
+            key_attr = detector._ngram_key_attr()
+
+            t_pairwise, t_hashed = 0.0, 0.0
+            for doc in docs:
+                word_idxs = np.flatnonzero(doc_word_mask(doc))
+
+                t0 = time.perf_counter()
+                pairwise = detector._find_repeats_pairwise([doc[i] for i in word_idxs], doc)
+                t_pairwise += time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                hashed = detector._find_repeats_hashed(doc.to_array(key_attr)[word_idxs])
+                t_hashed += time.perf_counter() - t0
+
+                assert pairwise == hashed, "hashed repeats differ from pairwise comparison"
+
+            print(f"max_N={max_N} window_size={window_size}: pairwise {t_pairwise:.2f}s, hashed {t_hashed:.2f}s ({t_pairwise / max(t_hashed, 1e-9):.1f}x)")
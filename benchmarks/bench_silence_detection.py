@@ -0,0 +1,138 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import detect_silence as pydub_detect_silence
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from preprocess.annotate_silences import EnergyProfile, SilenceScanner, audio_segment_samples, detect_silence, load_energy_profile, stream_silences, sweep_silences
+
+MIN_SILENCE_LENS = [20, 300, 1000, 2000]
+SILENCE_THRESHS = [-60, -45, -30, -16]
+SEEK_STEPS = [1, 1, 3, 10]
+
+
+def random_segment(rng):
+    '''
+    Generate audio alternating stretches of silence and noise at random levels, widths, rates and channel counts.
+    '''
+    sample_width = int(rng.choice([1, 2, 2, 4]))
+    frame_rate = int(rng.choice([8000, 16000, 44100, 48000]))
+    channels = int(rng.integers(1, 3))
+    n_frames = int(rng.integers(frame_rate // 2, frame_rate * 8))
+    full = 2 ** (8 * sample_width - 1)
+
+    samples = np.zeros((n_frames, channels))
+    t = 0
+    while t < n_frames:
+        n = min(int(rng.integers(1, frame_rate * 2)), n_frames - t)
+        samples[t:t + n] = rng.normal(0, full * rng.choice([0, 1e-4, 1e-3, 1e-2, 0.1, 0.5]), (n, channels))
+        t += n
+    samples = np.clip(np.round(samples), -full, full - 1).astype({1: "i1", 2: "<i2", 4: "<i4"}[sample_width])
+    return AudioSegment(samples.tobytes(), frame_rate=frame_rate, sample_width=sample_width, channels=channels)
+
+
+def scan_in_chunks(segment, min_silence_len, silence_thresh, seek_step, rng):
+    '''
+    Feed the samples to a SilenceScanner in random whole-frame chunks, like stream_silences does.
+    '''
+    samples = audio_segment_samples(segment)
+    scanner = SilenceScanner(segment.frame_rate, segment.channels, segment.max_possible_amplitude, min_silence_len, silence_thresh, seek_step)
+    silences = []
+    n_frames = len(samples) // segment.channels
+    bounds = np.sort(rng.integers(0, n_frames + 1, int(rng.integers(0, 20))))
+    for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [n_frames]])):
+        silences += scanner.feed(samples[lo * segment.channels:hi * segment.channels])
+    return silences + scanner.finish()
+
+
+class Checker:
+    def __init__(self):
+        self.n_checks = 0
+        self.mismatches = {}
+
+    def check(self, name, expected, actual, detail):
+        self.n_checks += 1
+        if expected != actual:
+            self.mismatches[name] = self.mismatches.get(name, 0) + 1
+            if self.mismatches[name] <= 3:
+                print(f"{name} mismatch on {detail}:\n  pydub      {expected}\n  vectorized {actual}")
+
+
+def verify_segment(checker, segment, rng, tmp_dir, use_ffmpeg):
+    min_silence_len = int(rng.choice(MIN_SILENCE_LENS))
+    silence_thresh = float(rng.choice(SILENCE_THRESHS))
+    seek_step = int(rng.choice(SEEK_STEPS))
+    params = (min_silence_len, silence_thresh, seek_step)
+    detail = f"{segment.sample_width * 8}-bit {segment.frame_rate}Hz x{segment.channels} {len(segment)}ms, params {params}"
+
+    expected = pydub_detect_silence(segment, *params)
+    checker.check("detect_silence", expected, detect_silence(segment, *params), detail)
+    checker.check("SilenceScanner chunks", expected, scan_in_chunks(segment, *params, rng), detail)
+
+    profile = EnergyProfile.from_audio_segment(segment)
+    checker.check("EnergyProfile.detect_silence", expected, profile.detect_silence(*params), detail)
+    path = os.path.join(tmp_dir, "profile.npz")
+    profile.save(path)
+    checker.check("EnergyProfile.load", expected, EnergyProfile.load(path).detect_silence(*params), detail)
+
+    # A sweep shares window RMS between thresholds, check a whole threshold row against pydub
+    sweep = profile.sweep([min_silence_len], SILENCE_THRESHS, seek_step)
+    for thresh in SILENCE_THRESHS:
+        checker.check("EnergyProfile.sweep", pydub_detect_silence(segment, min_silence_len, thresh, seek_step), sweep[(min_silence_len, thresh)], f"{detail}, sweep threshold {thresh}")
+
+    # ffmpeg decodes 16-bit PCM at the source rate losslessly
+    if use_ffmpeg and segment.sample_width == 2:
+        wav_file = os.path.join(tmp_dir, "signal.wav")
+        segment.export(wav_file, format="wav")
+        chunk_ms = int(rng.choice([7, 250, 10000]))
+        checker.check("stream_silences", expected, list(stream_silences(wav_file, *params, chunk_ms=chunk_ms)), f"{detail}, chunk_ms {chunk_ms}")
+        checker.check("load_energy_profile", expected, load_energy_profile(wav_file, chunk_ms=chunk_ms).detect_silence(*params), detail)
+        checker.check("sweep_silences", [[start / 1000, end / 1000] for start, end in expected], sweep_silences(wav_file, [min_silence_len], [silence_thresh], seek_step)[(min_silence_len, silence_thresh)], detail)
+
+
+def time_detection(rng, minutes):
+    samples = (rng.normal(0, 300, 16000 * 60 * minutes) * (rng.random(16000 * 60 * minutes) > 0.5)).astype("<i2")
+    segment = AudioSegment(samples.tobytes(), frame_rate=16000, sample_width=2, channels=1)
+
+    t0 = time.perf_counter()
+    vectorized = detect_silence(segment, 500, -40)
+    t_vectorized = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    expected = pydub_detect_silence(segment, 500, -40)
+    t_pydub = time.perf_counter() - t0
+
+    print(f"{minutes} min of 16kHz audio: pydub {t_pydub:.2f}s, vectorized {t_vectorized:.3f}s")
+    return vectorized == expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_signals", type=int, help="Number of random test signals.", default=150, required=False)
+    parser.add_argument("--seed", type=int, help="Random seed.", default=0, required=False)
+    parser.add_argument("--minutes", type=int, help="Length of the timed signal (minutes).", default=10, required=False)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    use_ffmpeg = shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+    if not use_ffmpeg:
+        print("Skipping stream_silences, load_energy_profile and sweep_silences: ffmpeg not found")
+
+    checker = Checker()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(args.n_signals):
+            verify_segment(checker, random_segment(rng), rng, tmp_dir, use_ffmpeg)
+    n_mismatches = sum(checker.mismatches.values())
+    print(f"{n_mismatches} mismatches in {checker.n_checks} checks on {args.n_signals} signals {checker.mismatches or ''}".rstrip())
+
+    if not time_detection(rng, args.minutes):
+        print("Timed signal mismatch")
+        n_mismatches += 1
+    sys.exit(1 if n_mismatches else 0)
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import create_custom_nlp, create_tokenizer_nlp
+from detectors.filler_speech.keyword_search import FillerKeywordDetector
+from detectors.vague_speech.keyword_search import VagueKeywordDetector
+
+
+def load_texts(texts_file):
+    '''
+    Load utterances from a text file (one per line) or from the ADReSS patient utterances.
+    '''
+    if texts_file is not None:
+        with open(texts_file, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from data.adress import load_transcripts
+    trans = load_transcripts()
+    return trans.loc[trans["Speaker"] == "Patient", "Transcript_clean"].tolist()
+
+
+def timed_load(create):
+    t0 = time.perf_counter()
+    nlp = create()
+    return nlp, time.perf_counter() - t0
+
+
+def verify(name, model_detector, fast_detector, texts, batch_size):
+    t0 = time.perf_counter()
+    expected = list(model_detector.detect_many(texts, batch_size=batch_size))
+    t_model = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fast = list(fast_detector.detect_many(texts, batch_size=batch_size))
+    t_fast = time.perf_counter() - t0
+
+    mismatches = [(text, e, f) for text, e, f in zip(texts, expected, fast) if e != f]
+    for text, e, f in mismatches[:10]:
+        print(f"{name} mismatch on {text!r}:\n  model     {e['detections']}\n  tokenizer {f['detections']}")
+    print(f"{name}: {len(mismatches)} mismatches on {len(texts)} utterances, model {t_model:.2f}s, tokenizer {t_fast:.2f}s")
+    return len(mismatches)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=str, help="Text file with one utterance per line. Defaults to ADReSS patient utterances.", required=False)
+    parser.add_argument("--model", type=str, help="spaCy model name.", default="en_core_web_md", required=False)
+    parser.add_argument("--batch_size", type=int, help="nlp.pipe batch size.", default=1000, required=False)
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+
+    components = FillerKeywordDetector.required_components() + VagueKeywordDetector.required_components()
+    model_nlp, t_model_load = timed_load(lambda: create_custom_nlp(args.model, components=components))
+    fast_nlp, t_fast_load = timed_load(create_tokenizer_nlp)
+    print(f"Load: {args.model} {t_model_load:.2f}s, tokenizer only {t_fast_load * 1000:.1f}ms")
+
+    n_mismatches = verify("FillerKeywordDetector", FillerKeywordDetector(model_nlp), FillerKeywordDetector(fast_nlp), texts, args.batch_size)
+    n_mismatches += verify("VagueKeywordDetector", VagueKeywordDetector(model_nlp), VagueKeywordDetector(fast_nlp), texts, args.batch_size)
+    sys.exit(1 if n_mismatches else 0)
@@ -1,57 +1,119 @@
+import hashlib
+import json
 import numpy as np
+import os
 import pandas as pd
 import pylangacq
 import re
+from glob import glob
 from sklearn.model_selection import train_test_split
+from data.store import ParquetStore, source_fingerprint
 
-def split_train_into_train_dev(dev_size=0.3, num_seeds=100):
-    np.random.seed(1234567)
+ADRESS_DIR = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020"
+ADRESS_STORE_DIR = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020_store"
+META_FILES = {"cc": "train/cc_meta_data.txt", "cd": "train/cd_meta_data.txt", "test": "test/meta_data.txt"}
 
-    trn_ids, dev_ids = [], []
-    
-    cn_trn_ocs = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/train/cc_meta_data.txt", delimiter=";", index_col="ID   ")
+# Bump when the parsing, cleaning or labeling logic changes so stores are rebuilt
+STORE_VERSION = "1"
+
+TRANSCRIPT_COLUMNS = ["T_start_ms", "T_end_ms", "Timestamp", "Speaker", "Transcript", "Transcript_clean", "Filler", "Repetition", "Revision", "Short pause", "Medium pause", "Long pause", "Speech delays", "Vague", "Phonological Error", "Semantic Error", "Neologistic Error", "Morphological Error", "Dysfluency", "Substitution Error"]
+
+# Splits already searched in this process, keyed like the persisted ones
+_SPLIT_CACHE = {}
+
+def _read_train_meta():
+    cn_trn_ocs = pd.read_csv(os.path.join(ADRESS_DIR, META_FILES["cc"]), delimiter=";", index_col="ID   ")
     cn_trn_ocs.index = cn_trn_ocs.index.str.strip()
     cn_trn_ocs["AD_dx"] = 0
-    ad_trn_ocs = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/train/cd_meta_data.txt", delimiter=";", index_col="ID   ")
+    ad_trn_ocs = pd.read_csv(os.path.join(ADRESS_DIR, META_FILES["cd"]), delimiter=";", index_col="ID   ")
     ad_trn_ocs.index = ad_trn_ocs.index.str.strip()
     ad_trn_ocs["AD_dx"] = 1
 
     trn_ocs = pd.concat([cn_trn_ocs, ad_trn_ocs], axis=0)
     trn_ocs.columns = trn_ocs.columns.str.strip()
-    
-    metric_scores = []
-    seeds = np.random.randint(0, 10000, size=num_seeds)
-    for seed in seeds:
-        trn_ids, dev_ids = train_test_split(trn_ocs.index.values, test_size=dev_size, stratify=trn_ocs.loc[:, ["AD_dx", "gender"]], random_state=seed)
-        age_dist_trn = trn_ocs.loc[trn_ids, "age"].mean()
-        age_dist_dev = trn_ocs.loc[dev_ids, "age"].mean()
-        metric_scores.append(abs(age_dist_trn - age_dist_dev))
+    return trn_ocs
+
+def _search_split(trn_ocs, dev_size, num_seeds, seed):
+    ids = trn_ocs.index.values
+    stratify = trn_ocs.loc[:, ["AD_dx", "gender"]]
+    seeds = np.random.RandomState(seed).randint(0, 10000, size=num_seeds)
+    candidates = [train_test_split(ids, test_size=dev_size, stratify=stratify, random_state=s) for s in seeds]
+
+    # Score all candidates at once: age gap between the train and dev means, ignoring missing ages like pd.Series.mean
+    pos = pd.Index(ids).get_indexer
+    is_dev = np.zeros((num_seeds, len(ids)), dtype=bool)
+    for i, (_, dev_ids) in enumerate(candidates):
+        is_dev[i, pos(dev_ids)] = True
+    age = trn_ocs["age"].to_numpy(dtype=float)
+    known = ~np.isnan(age)
+    age = np.where(known, age, 0.0)
+    dev_mean = (is_dev * age).sum(axis=1) / (is_dev & known).sum(axis=1)
+    trn_mean = (~is_dev * age).sum(axis=1) / (~is_dev & known).sum(axis=1)
+
+    return candidates[np.argmin(np.abs(trn_mean - dev_mean))]
 
-    opt_seed = seeds[np.argmin(metric_scores)]
+def split_train_into_train_dev(dev_size=0.3, num_seeds=100, seed=1234567, cache_dir=ADRESS_STORE_DIR):
+    '''
+    Split the ADReSS train set into train and dev, stratified by diagnosis and gender, picking
+    among num_seeds candidate splits the one with the closest mean age. The result is memoized
+    and persisted, keyed by the search parameters and the metadata content.
 
-    return train_test_split(trn_ocs.index.values, test_size=dev_size, stratify=trn_ocs.loc[:, ["AD_dx", "gender"]], random_state=opt_seed)
+    args:
+        dev_size (float) - dev fraction (default = 0.3)
+        num_seeds (int) - number of candidate splits (default = 100)
+        seed (int) - seed drawing the candidate split seeds (default = 1234567)
+        cache_dir (str or None) - directory of persisted splits, disabled if None (default = ADRESS_STORE_DIR)
 
-def load_outcomes():
+    return:
+        (tuple<np.ndarray>) train IDs, dev IDs
+    '''
+    fingerprint = source_fingerprint([os.path.join(ADRESS_DIR, META_FILES[k]) for k in ("cc", "cd")], use_hash=True)
+    key = hashlib.sha1(json.dumps({"dev_size": dev_size, "num_seeds": num_seeds, "seed": seed, "meta": list(fingerprint.values())}).encode("utf-8")).hexdigest()
+    if key in _SPLIT_CACHE:
+        return tuple(ids.copy() for ids in _SPLIT_CACHE[key])
+
+    path = None if cache_dir is None else os.path.join(cache_dir, "splits", f"{key}.json")
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            split = json.load(f)
+        trn_ids, dev_ids = np.array(split["train"], dtype=object), np.array(split["dev"], dtype=object)
+    else:
+        trn_ids, dev_ids = _search_split(_read_train_meta(), dev_size, num_seeds, seed)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"train": trn_ids.tolist(), "dev": dev_ids.tolist()}, f)
+
+    _SPLIT_CACHE[key] = (trn_ids, dev_ids)
+    return trn_ids.copy(), dev_ids.copy()
+
+def _assign_split(ids, trn_ids, dev_ids):
+    '''
+    Map IDs to their split, IDs in neither train nor dev are test.
+    '''
+    ids = np.asarray(ids)
+    return np.where(np.isin(ids, trn_ids), "train", np.where(np.isin(ids, dev_ids), "dev", "test")).astype(object)
+
+def _build_outcomes(trn_ids):
     # control train
-    temp1 = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/train/cc_meta_data.txt", delimiter=";", index_col="ID   ")
+    temp1 = pd.read_csv(os.path.join(ADRESS_DIR, META_FILES["cc"]), delimiter=";", index_col="ID   ")
     temp1.index = temp1.index.str.strip()
     temp1.columns = temp1.columns.str.strip()
     temp1["gender"] = temp1["gender"].map({" male ": 0, " female ": 1})
     temp1["AD_dx"] = 0
     # dementia train
-    temp2 = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/train/cd_meta_data.txt", delimiter=";", index_col="ID   ")
+    temp2 = pd.read_csv(os.path.join(ADRESS_DIR, META_FILES["cd"]), delimiter=";", index_col="ID   ")
     temp2.index = temp2.index.str.strip()
     temp2.columns = temp2.columns.str.strip()
     temp2["gender"] = temp2["gender"].map({" male ": 0, " female ": 1})
     temp2["AD_dx"] = 1
     # separate train and dev
-    trn_ids, dev_ids = split_train_into_train_dev()
     trn_dev = pd.concat([temp1, temp2], axis=0)
-    split_idx = ["train" if pt_id in trn_ids else "dev" for pt_id in trn_dev.index.values]
+    split_idx = np.where(np.isin(trn_dev.index.values, trn_ids), "train", "dev").astype(object)
     trn_dev.index = pd.MultiIndex.from_arrays([split_idx, trn_dev.index], names=["split", "ID"])
 
     # test
-    temp3 = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/test/meta_data.txt", delimiter=";", index_col="ID   ")
+    temp3 = pd.read_csv(os.path.join(ADRESS_DIR, META_FILES["test"]), delimiter=";", index_col="ID   ")
     temp3.index = temp3.index.str.strip()
     temp3.columns = temp3.columns.str.strip()
     temp3 = temp3.rename(columns={"Label": "AD_dx"})
@@ -81,8 +143,121 @@ def clean_CHAT_text(text, keep_filler=False):
     text = re.sub(r"(\w+):(\w+)", r"\1\2", text)                                            # remove prolongation markers
     return text
 
-def load_transcripts(annotate_filler=False):
-    reader = pylangacq.read_chat("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/dementia_bank/ADReSS-IS2020/")
+# Each pass runs once over the utterances containing its trigger, joined with a separator that none
+# of the patterns can match across, with the same result as clean_CHAT_text on every utterance
+CHAT_SEP = "\x00"
+CHAT_CLEAN_PASSES = [
+    ("[", re.compile(r"\[[^\n\x00]*?\]\s*"), ""),
+    ("+<", re.compile(r"\+<"), ""),
+    ("<", re.compile(r"<\s*([^\n\x00]*?)\s*>"), r"\1"),
+    ("(", re.compile(r"\(\.{1,3}\)"), "[silence]"),
+    ("(", re.compile(r"\([^)\x00]*\)"), ""),
+    ("xxx", re.compile(r"xxx"), "[inaudible]"),
+    ("&=", re.compile(r"&=([\w:]+)"), lambda m: f"[{m.group(1).replace(':', ' ')}]"),
+]
+CHAT_FILLER_PASS = ("&", re.compile(r"&(\w+)"), r"\1")
+CHAT_FINAL_PASSES = [
+    ("+", re.compile(r"\+[^\s\x00]+"), ""),
+    ("@", re.compile(r"@[^\s\x00]+"), ""),
+    ("_", re.compile(r"([^\s_\x00]+(?:_[^\s_\x00]+)+)"), lambda m: m.group(1).replace("_", " ")),
+    ("‡", re.compile(r"‡"), ""),
+    (":", re.compile(r"(\w+):(\w+)"), r"\1\2"),
+]
+
+# At most one label can start at any position and no label can start inside the consumed part of
+# another (error tags only consume their opening and look ahead for the closing bracket), so a
+# single scan finds all of them
+CHAT_LABEL_PATTERNS = {
+    "Filler": r"&(?!=)",
+    "Repetition": r"\[/\]",
+    "Revision": r"\[//\]",
+    "Short pause": r"\(\.\)",
+    "Medium pause": r"\(\.\.\)",
+    "Long pause": r"\(\.\.\.\)",
+    "Vague": r"\[\+ (?:es|cir)\]",
+    "Phonological Error": r"\[\*\s+p(?=[^\]\x00]*\])",
+    "Semantic Error": r"\[\*\s+s(?=[^\]\x00]*\])",
+    "Neologistic Error": r"\[\*\s+n(?=[^\]\x00]*\])",
+    "Morphological Error": r"\[\*\s+m(?=[^\]\x00]*\])",
+    "Dysfluency": r"\[\*\s+d(?=[^\]\x00]*\])",
+}
+CHAT_LABEL_REGEX = re.compile(r"(?=[&\[(])(?:" + "|".join(f"(?P<l{i}>{p})" for i, p in enumerate(CHAT_LABEL_PATTERNS.values())) + ")")
+CHAT_DERIVED_LABELS = {
+    "Speech delays": ["Short pause", "Medium pause", "Long pause"],
+    "Substitution Error": ["Phonological Error", "Semantic Error", "Neologistic Error", "Morphological Error", "Dysfluency"],
+}
+
+def _apply_passes(texts, passes):
+    texts = list(texts)
+    for trigger, pattern, repl in passes:
+        idxs = [i for i, text in enumerate(texts) if trigger in text]
+        if not idxs:
+            continue
+        cleaned = pattern.sub(repl, CHAT_SEP.join([texts[i] for i in idxs])).split(CHAT_SEP)
+        for i, text in zip(idxs, cleaned):
+            texts[i] = text
+    return texts
+
+def label_CHAT_series(texts):
+    '''
+    Extract the CHAT annotation labels of many utterances in a single regex scan.
+
+    args:
+        texts (pd.Series) - raw CHAT utterances
+
+    return:
+        (pd.DataFrame) 0/1 label columns, indexed like texts
+    '''
+    texts = texts.astype(str)
+
+    # Separators inside an utterance become \x01, which every label pattern treats like the separator
+    # except inside error tags, where both are ordinary characters
+    corpus = CHAT_SEP.join(texts.str.replace(CHAT_SEP, "\x01", regex=False))
+
+    # Utterance of each match position
+    starts = np.cumsum([0] + [len(text) + len(CHAT_SEP) for text in texts.iloc[:-1]])
+    names = list(CHAT_LABEL_PATTERNS)
+    positions, cols = [], []
+    for m in CHAT_LABEL_REGEX.finditer(corpus):
+        positions.append(m.start())
+        cols.append(int(m.lastgroup[1:]))
+
+    labels = np.zeros((len(texts), len(names)), dtype=int)
+    if positions:
+        labels[np.searchsorted(starts, positions, side="right") - 1, cols] = 1
+    labels = pd.DataFrame(labels, index=texts.index, columns=names)
+    for name, parts in CHAT_DERIVED_LABELS.items():
+        labels[name] = labels[parts].max(axis=1)
+    return labels
+
+def clean_CHAT_series(texts, keep_filler=None):
+    '''
+    Clean many CHAT utterances, equivalent to clean_CHAT_text on each of them. Every cleaning
+    pass runs once over the corpus, and the passes before the filler one are shared by both outputs.
+
+    args:
+        texts (pd.Series) - raw CHAT utterances
+        keep_filler (bool or None) - keep the & prefix of fillers, both outputs are returned if None (default = None)
+
+    return:
+        (pd.Series or tuple<pd.Series>) cleaned utterances, (without filler markers, with filler markers) if keep_filler is None
+    '''
+    texts = texts.astype(str)
+    if texts.str.contains(CHAT_SEP, regex=False).any():
+        if keep_filler is None:
+            return texts.apply(clean_CHAT_text), texts.apply(clean_CHAT_text, keep_filler=True)
+        return texts.apply(clean_CHAT_text, keep_filler=keep_filler)
+
+    cleaned = _apply_passes(texts, CHAT_CLEAN_PASSES)
+    if keep_filler is None:
+        cleaned = _apply_passes(cleaned + _apply_passes(cleaned, [CHAT_FILLER_PASS]), CHAT_FINAL_PASSES)
+        return pd.Series(cleaned[len(texts):], index=texts.index), pd.Series(cleaned[:len(texts)], index=texts.index)
+    if not keep_filler:
+        cleaned = _apply_passes(cleaned, [CHAT_FILLER_PASS])
+    return pd.Series(_apply_passes(cleaned, CHAT_FINAL_PASSES), index=texts.index)
+
+def _build_transcripts(trn_ids, dev_ids, annotate_filler=False):
+    reader = pylangacq.read_chat(os.path.join(ADRESS_DIR, ""))
 
     idxs, transcripts = [], []
     for file, f_utterances in zip(reader.file_paths(), reader.utterances(by_files=True)):
@@ -102,34 +277,93 @@ def load_transcripts(annotate_filler=False):
     transcripts["Timestamp"] = transcripts["T_start_ms"].apply(lambda x: f"{int((x / 1000) // 3600):02}:{int(((x / 1000) % 3600) // 60):02}:{int((x / 1000) % 60):02}")
     transcripts["Speaker"] = transcripts["Speaker"].map({"PAR": "Patient", "INV": "Provider"})
     transcripts["Transcript"] = transcripts["Transcript"].str.strip()
-    transcripts["Transcript_clean"] = transcripts["Transcript"].apply(clean_CHAT_text).str.strip()
     if annotate_filler:
-        transcripts["Transcript_clean_w_filler"] = transcripts["Transcript"].apply(clean_CHAT_text, keep_filler=True).str.strip()
+        clean, clean_w_filler = clean_CHAT_series(transcripts["Transcript"])
+        transcripts["Transcript_clean"] = clean.str.strip()
+        transcripts["Transcript_clean_w_filler"] = clean_w_filler.str.strip()
+    else:
+        transcripts["Transcript_clean"] = clean_CHAT_series(transcripts["Transcript"], keep_filler=False).str.strip()
 
     # separate train and dev
-    trn_ids, dev_ids = split_train_into_train_dev()
-    new_split_idx = ["train" if pt_id in trn_ids else "dev" if pt_id in dev_ids else "test" for pt_id in transcripts.index.get_level_values("ID")]
+    new_split_idx = _assign_split(transcripts.index.get_level_values("ID"), trn_ids, dev_ids)
     transcripts.index = pd.MultiIndex.from_arrays([new_split_idx, transcripts.index.get_level_values("ID"), transcripts.index.get_level_values("utt_num")], names=["split", "ID", "utt_num"])
 
     # labeling
-    transcripts["Filler"] = transcripts["Transcript"].str.contains(r"&(?!=)").astype(int)
-    transcripts["Repetition"] = transcripts["Transcript"].str.contains(r"\[/\]").astype(int)
-    transcripts["Revision"] = transcripts["Transcript"].str.contains(r"\[//\]").astype(int)
-    transcripts["Short pause"] = transcripts["Transcript"].str.contains(r"\(\.\)").astype(int)
-    transcripts["Medium pause"] = transcripts["Transcript"].str.contains(r"\(\.\.\)").astype(int)
-    transcripts["Long pause"] = transcripts["Transcript"].str.contains(r"\(\.\.\.\)").astype(int)
-    transcripts["Speech delays"] = (transcripts["Short pause"] | transcripts["Medium pause"] | transcripts["Long pause"]).astype(int)
-    transcripts["Vague"] = transcripts["Transcript"].str.contains(r"\[\+ (?:es|cir)\]").astype(int)
-    transcripts["Phonological Error"] = transcripts["Transcript"].str.contains(r"\[\*\s+p[^\]]*\]").astype(int)
-    transcripts["Semantic Error"] = transcripts["Transcript"].str.contains(r"\[\*\s+s[^\]]*\]").astype(int)
-    transcripts["Neologistic Error"] = transcripts["Transcript"].str.contains(r"\[\*\s+n[^\]]*\]").astype(int)
-    transcripts["Morphological Error"] = transcripts["Transcript"].str.contains(r"\[\*\s+m[^\]]*\]").astype(int)
-    transcripts["Dysfluency"] = transcripts["Transcript"].str.contains(r"\[\*\s+d[^\]]*\]").astype(int)
-    transcripts["Substitution Error"] = (transcripts["Phonological Error"] | transcripts["Semantic Error"] | transcripts["Neologistic Error"] | transcripts["Morphological Error"] | transcripts["Dysfluency"]).astype(int)
-
-    columns = ["T_start_ms", "T_end_ms", "Timestamp", "Speaker", "Transcript", "Transcript_clean", "Filler", "Repetition", "Revision", "Short pause", "Medium pause", "Long pause", "Speech delays", "Vague", "Phonological Error", "Semantic Error", "Neologistic Error", "Morphological Error", "Dysfluency", "Substitution Error"]
-    
+    transcripts = transcripts.join(label_CHAT_series(transcripts["Transcript"]))
+
+    columns = list(TRANSCRIPT_COLUMNS)
     if annotate_filler:
         columns += ["Transcript_clean_w_filler"]
 
     return transcripts[columns].sort_index()
+
+
+def _source_fingerprint(use_hash=False):
+    paths = [os.path.join(ADRESS_DIR, f) for f in META_FILES.values()]
+    paths += glob(os.path.join(ADRESS_DIR, "*", "transcription", "**", "*.cha"), recursive=True)
+    return source_fingerprint(paths, use_hash=use_hash)
+
+def build_store(store_dir=ADRESS_STORE_DIR, use_hash=False, force=False):
+    '''
+    Build the columnar ADReSS store: outcomes and transcripts with cleaned text and labels
+    precomputed, transcripts partitioned by split. Datasets are only rebuilt when the source
+    files or the build logic changed.
+
+    args:
+        store_dir (str) - store directory (default = ADRESS_STORE_DIR)
+        use_hash (bool) - detect source changes by content hash instead of mtime and size (default = False)
+        force (bool) - rebuild even if the store is up to date (default = False)
+
+    return:
+        (ParquetStore) store
+    '''
+    store = ParquetStore(store_dir)
+    fingerprint = _source_fingerprint(use_hash=use_hash)
+    if not force and store.is_valid("outcomes", fingerprint, STORE_VERSION) and store.is_valid("transcripts", fingerprint, STORE_VERSION):
+        return store
+
+    trn_ids, dev_ids = split_train_into_train_dev()
+    store.write("outcomes", _build_outcomes(trn_ids), fingerprint, STORE_VERSION)
+    store.write("transcripts", _build_transcripts(trn_ids, dev_ids, annotate_filler=True), fingerprint, STORE_VERSION, partition_cols=["split"])
+    return store
+
+def load_outcomes(store_dir=ADRESS_STORE_DIR, filters=None):
+    '''
+    Load the ADReSS outcomes.
+
+    args:
+        store_dir (str or None) - columnar store directory, the metadata files are parsed directly if None (default = ADRESS_STORE_DIR)
+        filters (list or None) - pyarrow filters pushed down to the store, e.g. [("split", "=", "test")] (default = None)
+
+    return:
+        (pd.DataFrame) outcomes indexed by (split, ID)
+    '''
+    if store_dir is None:
+        trn_ids, dev_ids = split_train_into_train_dev()
+        lbls = _build_outcomes(trn_ids)
+    else:
+        lbls = build_store(store_dir).read("outcomes", index=["split", "ID"], filters=filters)
+    return lbls.sort_index()
+
+def load_transcripts(annotate_filler=False, store_dir=ADRESS_STORE_DIR, filters=None, columns=None):
+    '''
+    Load the ADReSS transcripts.
+
+    args:
+        annotate_filler (bool) - include the cleaned text that keeps filler markers (default = False)
+        store_dir (str or None) - columnar store directory, the CHAT files are parsed directly if None (default = ADRESS_STORE_DIR)
+        filters (list or None) - pyarrow filters pushed down to the store, e.g. [("Speaker", "=", "Patient")] (default = None)
+        columns (list<str> or None) - columns to load, defaults to all (default = None)
+
+    return:
+        (pd.DataFrame) transcripts indexed by (split, ID, utt_num)
+    '''
+    if columns is None:
+        columns = TRANSCRIPT_COLUMNS + (["Transcript_clean_w_filler"] if annotate_filler else [])
+
+    if store_dir is None:
+        trn_ids, dev_ids = split_train_into_train_dev()
+        transcripts = _build_transcripts(trn_ids, dev_ids, annotate_filler=annotate_filler)
+    else:
+        transcripts = build_store(store_dir).read("transcripts", index=["split", "ID", "utt_num"], columns=columns, filters=filters)
+    return transcripts[columns].sort_index()
@@ -1,7 +1,23 @@
+import hashlib
+import numpy as np
 import os
 import pandas as pd
 import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
+from data.store import ParquetStore, source_fingerprint
+
+CLINIC_DATA_DIR = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/clinic"
+OBSERVER_STORE_DIR = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/swimcap/Penn OBSERVER/transcript_store"
+WORKBOOK_CACHE_DIR = os.path.join(OBSERVER_STORE_DIR, "workbooks")
+MANIFEST_PATH = os.path.join(OBSERVER_STORE_DIR, "visit_manifest.sqlite")
+VISIT_FILE_PATTERN = re.compile(r"(PR\d+)_(PT\d+)_(\d{2}\.\d{2}\.\d{4})")
+TRANSCRIPT_COLUMNS = ["Timestamp", "Speaker", "Transcript"]
+
+# Bump when the parsing logic changes so stores are rebuilt
+STORE_VERSION = "1"
 
 def load_visits():
     visits = pd.read_csv("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/swimcap/Penn OBSERVER/note_visit_mapping.csv", header=None)
@@ -12,65 +28,282 @@ def load_visits():
     visits["date"] = pd.to_datetime(visits["visit"].apply(lambda x: re.search(r"(\d{2}\.\d{2}\.\d{4})", x).group(1)))
     return visits
 
-def load_transcripts_from_visits(visits):
-    trans_dir_fmt = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/clinic/{}/transcript/"
+def _workbook_cache_path(cache_dir, file, mtime_ns):
+    return os.path.join(cache_dir, f"{hashlib.sha1(file.encode('utf-8')).hexdigest()}_{mtime_ns}.parquet")
+
+def _read_transcript_file(file):
+    '''
+    Read a Datagain transcript workbook.
+
+    args:
+        file (str) - path to the .xlsx file
+
+    return:
+        (pd.DataFrame) Timestamp, Speaker, Transcript and Utterance columns
+    '''
+    t = pd.read_excel(file, engine="openpyxl", usecols=TRANSCRIPT_COLUMNS)[TRANSCRIPT_COLUMNS]
+
+    # Cells of text columns can hold numbers or times, they are read as strings so workbooks can be cached
+    for col in TRANSCRIPT_COLUMNS:
+        if t[col].dtype == object:
+            t[col] = t[col].where(t[col].isna(), t[col].astype(str))
+    timestamp, speaker, transcript = (t[col].astype(str).fillna("nan") for col in TRANSCRIPT_COLUMNS)
+    t["Utterance"] = timestamp + " " + speaker + ": " + transcript
+    return t
+
+def _read_and_cache_transcript_file(file, cache_path):
+    t = _read_transcript_file(file)
+    if cache_path is not None:
+        # Drop the entries of older versions of the workbook
+        for stale in glob(cache_path.rsplit("_", 1)[0] + "_*.parquet"):
+            os.remove(stale)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        t.to_parquet(tmp_path, engine="pyarrow", index=False)
+        os.replace(tmp_path, cache_path)
+    return t
+
+def read_transcript_files(files, cache_dir=WORKBOOK_CACHE_DIR, n_workers=None):
+    '''
+    Read Datagain transcript workbooks. Workbooks are cached as Parquet keyed by path and
+    mtime, and only new or modified ones are parsed, concurrently in a process pool.
+
+    args:
+        files (list<str>) - paths to the .xlsx files
+        cache_dir (str or None) - workbook cache directory, disabled if None (default = WORKBOOK_CACHE_DIR)
+        n_workers (int or None) - number of worker processes, defaults to the number of CPUs (default = None)
+
+    return:
+        (list<pd.DataFrame>) transcripts in the order of files
+    '''
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    transcripts = [None] * len(files)
+    stale = []
+    for i, file in enumerate(files):
+        cache_path = None if cache_dir is None else _workbook_cache_path(cache_dir, file, os.stat(file).st_mtime_ns)
+        if cache_path is not None and os.path.exists(cache_path):
+            transcripts[i] = pd.read_parquet(cache_path, engine="pyarrow")
+        else:
+            stale.append((i, file, cache_path))
+
+    if stale:
+        if n_workers == 1 or len(stale) == 1:
+            results = [_read_and_cache_transcript_file(file, cache_path) for _, file, cache_path in stale]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(_read_and_cache_transcript_file, [file for _, file, _ in stale], [cache_path for _, _, cache_path in stale]))
+        for (i, _, _), t in zip(stale, results):
+            transcripts[i] = t
 
-    idxs, transcripts = [], []
-    for i, row in visits.iterrows():
+    return transcripts
+
+def load_transcripts_from_visits(visits, cache_dir=WORKBOOK_CACHE_DIR, n_workers=None):
+    trans_dir_fmt = os.path.join(CLINIC_DATA_DIR, "{}", "transcript")
+
+    files = []
+    for visit in visits["visit"]:
         try:
-            transcript_files = os.listdir(trans_dir_fmt.format(row.visit))
+            transcript_files = os.listdir(trans_dir_fmt.format(visit))
         except FileNotFoundError as e:
-            print(f"No transcript directory found for visit {row.visit}")
+            print(f"No transcript directory found for visit {visit}")
             continue         
 
         for f in transcript_files:
             if f.endswith(".xlsx"):  # Datagain transcripts are excel files
-                t = pd.read_excel(os.path.join(trans_dir_fmt.format(row.visit), f), engine="openpyxl")
-                t["Utterance"] = t.apply(lambda x: f"{x.Timestamp} {x.Speaker}: {x.Transcript}", axis=1)
-                transcripts.append( t[["Timestamp", "Speaker", "Transcript", "Utterance"]] )
-                idxs.append( f )
+                files.append(os.path.join(trans_dir_fmt.format(visit), f))
 
-    transcripts = pd.concat(transcripts, keys=idxs, names=["visit_file", "line_num"])
+    transcripts = read_transcript_files(files, cache_dir=cache_dir, n_workers=n_workers)
+    transcripts = pd.concat(transcripts, keys=[os.path.basename(f) for f in files], names=["visit_file", "line_num"])
     return transcripts
 
-def load_visit_transcript(provider_id, patient_id, date):
-    t_files = glob(f"/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/clinic/PR{provider_id}_PT{patient_id}_{date}/transcript/*.xlsx")
-
-    trans = []
-    for file in t_files:
-        t = pd.read_excel(
-            file, 
-            engine="openpyxl",
-            usecols=["Timestamp", "Speaker", "Transcript"]
-        )
-    transcript["Text"] = transcript.apply(lambda x: f"{x.Timestamp} {x.Speaker}: {x.Transcript}", axis=1)
-    return transcript
-
-def load_penn_transcripts():
-    clinic_data_dir = "/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/clinic"
-
-    idxs, transcripts = [], []
-    for root, dirs, files in os.walk(clinic_data_dir):
-        for f in files:
+def load_visit_transcript(provider_id, patient_id, date, cache_dir=WORKBOOK_CACHE_DIR):
+    if not isinstance(date, str):
+        date = pd.Timestamp(date).strftime("%m.%d.%Y")
+    t_files = sorted(glob(os.path.join(CLINIC_DATA_DIR, f"PR{provider_id}_PT{patient_id}_{date}", "transcript", "*.xlsx")))
+    if not t_files:
+        raise FileNotFoundError(f"No transcript found for visit PR{provider_id}_PT{patient_id}_{date}")
+
+    transcript = pd.concat(read_transcript_files(t_files, cache_dir=cache_dir), ignore_index=True)
+    transcript["Text"] = transcript["Utterance"]
+    return transcript.drop(columns="Utterance")
+
+def _penn_transcript_files():
+    files = []
+    for root, dirs, fs in os.walk(CLINIC_DATA_DIR):
+        for f in fs:
             if f.endswith(".xlsx"):
-                t = pd.read_excel(os.path.join(root, f), engine="openpyxl")
-                t["Utterance"] = t.apply(lambda x: f"{x.Timestamp} {x.Speaker}: {x.Transcript}", axis=1)
-                transcripts.append( t[["Timestamp", "Speaker", "Transcript", "Utterance"]] )
-                idxs.append( f )
-
-    transcripts = pd.concat(transcripts, keys=idxs, names=["visit_file", "line_num"])
-
-    # new index
-    pattern = r'(PR\d+)_(PT\d+)_(\d{2}\.\d{2}\.\d{4})'
-    new_idx = transcripts.index.get_level_values("visit_file").str.extract(pattern)
-    new_idx.columns = ["provider_id", "patient_id", "date"]
-    new_idx["date"] = pd.to_datetime(new_idx["date"])
-    new_idx["line_num"] = transcripts.index.get_level_values("line_num")
-    new_idx = pd.MultiIndex.from_frame(new_idx)
-    transcripts.index = new_idx
+                files.append(os.path.join(root, f))
+    return files
+
+def _parse_visit_file(file):
+    '''
+    Parse the visit of a transcript file from its name, or from its visit directory.
 
+    return:
+        (tuple) provider_id, patient_id and date strings, None for each if the path does not match
+    '''
+    m = VISIT_FILE_PATTERN.search(os.path.basename(file)) or VISIT_FILE_PATTERN.search(file)
+    return m.groups() if m is not None else (None, None, None)
+
+def _concat_visit_transcripts(transcripts, visits):
+    '''
+    Concatenate transcripts indexed by (provider_id, patient_id, date, line_num).
+
+    args:
+        transcripts (list<pd.DataFrame>) - transcript of each file
+        visits (list<tuple>) - parsed visit of each file
+
+    return:
+        (pd.DataFrame) transcripts
+    '''
+    lengths = [len(t) for t in transcripts]
+    provider_ids, patient_ids, dates = zip(*visits) if visits else ((), (), ())
+    index = pd.MultiIndex.from_arrays([
+        np.repeat(np.array(provider_ids, dtype=object), lengths),
+        np.repeat(np.array(patient_ids, dtype=object), lengths),
+        pd.to_datetime(np.repeat(np.array(dates, dtype=object), lengths), format="%m.%d.%Y"),
+        np.concatenate([np.arange(n) for n in lengths]) if lengths else np.zeros(0, dtype=int),
+    ], names=["provider_id", "patient_id", "date", "line_num"])
+
+    transcripts = pd.concat(transcripts, ignore_index=True) if transcripts else pd.DataFrame(columns=TRANSCRIPT_COLUMNS + ["Utterance"])
+    transcripts.index = index
     return transcripts
 
+def _build_penn_transcripts(files, cache_dir=WORKBOOK_CACHE_DIR, n_workers=None):
+    transcripts = read_transcript_files(files, cache_dir=cache_dir, n_workers=n_workers)
+    return _concat_visit_transcripts(transcripts, [_parse_visit_file(f) for f in files])
+
+def load_penn_transcripts(store_dir=OBSERVER_STORE_DIR, use_hash=False, filters=None, columns=None, cache_dir=WORKBOOK_CACHE_DIR, n_workers=None):
+    '''
+    Load the Penn OBSERVER transcripts, building the columnar store from the Datagain Excel
+    files only when they changed since it was last built.
+
+    args:
+        store_dir (str or None) - columnar store directory, the Excel files are parsed directly if None (default = OBSERVER_STORE_DIR)
+        use_hash (bool) - detect source changes by content hash instead of mtime and size (default = False)
+        filters (list or None) - pyarrow filters pushed down to the store, e.g. [("Speaker", "=", "Patient")] (default = None)
+        columns (list<str> or None) - columns to load, defaults to all (default = None)
+        cache_dir (str or None) - workbook cache directory, disabled if None (default = WORKBOOK_CACHE_DIR)
+        n_workers (int or None) - number of worker processes reading workbooks, defaults to the number of CPUs (default = None)
+
+    return:
+        (pd.DataFrame) transcripts indexed by (provider_id, patient_id, date, line_num)
+    '''
+    files = _penn_transcript_files()
+    if store_dir is None:
+        return _build_penn_transcripts(files, cache_dir=cache_dir, n_workers=n_workers)
+
+    store = ParquetStore(store_dir)
+    fingerprint = source_fingerprint(files, use_hash=use_hash)
+    if not store.is_valid("transcripts", fingerprint, STORE_VERSION):
+        store.write("transcripts", _build_penn_transcripts(files, cache_dir=cache_dir, n_workers=n_workers), fingerprint, STORE_VERSION)
+    return store.read("transcripts", index=["provider_id", "patient_id", "date", "line_num"], columns=columns, filters=filters)
+
+class VisitManifest:
+    def __init__(self, path=MANIFEST_PATH, root=CLINIC_DATA_DIR, cache_dir=WORKBOOK_CACHE_DIR, n_workers=None):
+        '''
+        Persistent SQLite manifest of the visit transcript files, used to ingest only new or changed visits.
+
+        args:
+            path (str) - SQLite database file (default = MANIFEST_PATH)
+            root (str) - clinic data directory scanned for Datagain transcripts (default = CLINIC_DATA_DIR)
+            cache_dir (str or None) - workbook cache directory, disabled if None (default = WORKBOOK_CACHE_DIR)
+            n_workers (int or None) - number of worker processes reading workbooks, defaults to the number of CPUs (default = None)
+        '''
+        self.path = path
+        self.root = root
+        self.cache_dir = cache_dir
+        self.n_workers = n_workers
+
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, provider_id TEXT, patient_id TEXT, date TEXT, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha1 TEXT NOT NULL, ingested REAL NOT NULL)")
+        self.conn.commit()
+
+    def _scan(self):
+        files = []
+        for root, dirs, fs in os.walk(self.root):
+            for f in fs:
+                if f.endswith(".xlsx"):
+                    files.append(os.path.join(root, f))
+        return sorted(files)
+
+    @staticmethod
+    def _hash(file):
+        h = hashlib.sha1()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def files(self):
+        '''
+        Get the manifest.
+
+        return:
+            (pd.DataFrame) one row per ingested transcript file
+        '''
+        return pd.read_sql_query("SELECT * FROM files ORDER BY path", self.conn)
+
+    def refresh(self):
+        '''
+        Scan the clinic directory and ingest the transcript files that are new or whose content
+        changed. Files whose size and mtime are unchanged are not read, and files that were only
+        touched are detected by their content hash.
+
+        return:
+            (dict) "added", "changed" and "removed" file paths, and the "transcripts" of the added
+                and changed files indexed by (provider_id, patient_id, date, line_num)
+        '''
+        known = {row[0]: row[1:] for row in self.conn.execute("SELECT path, size, mtime_ns, sha1 FROM files")}
+
+        added, changed, touched, rows = [], [], [], []
+        for file in self._scan():
+            stat = os.stat(file)
+            prev = known.pop(file, None)
+            if prev is not None and prev[0] == stat.st_size and prev[1] == stat.st_mtime_ns:
+                continue
+
+            sha1 = self._hash(file)
+            if prev is not None and prev[2] == sha1:
+                touched.append((stat.st_size, stat.st_mtime_ns, file))
+                continue
+
+            (added if prev is None else changed).append(file)
+            rows.append((file, *_parse_visit_file(file), stat.st_size, stat.st_mtime_ns, sha1))
+        removed = sorted(known)
+
+        # Read before updating the manifest, so a failed read is retried on the next refresh
+        files = added + changed
+        transcripts = read_transcript_files(files, cache_dir=self.cache_dir, n_workers=self.n_workers)
+
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO files (path, provider_id, patient_id, date, size, mtime_ns, sha1, ingested) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [row + (now,) for row in rows])
+        self.conn.executemany("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?", touched)
+        self.conn.executemany("DELETE FROM files WHERE path = ?", [(file,) for file in removed])
+        self.conn.commit()
+
+        return {
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+            "transcripts": _concat_visit_transcripts(transcripts, [row[1:4] for row in rows]),
+        }
+
+    def load(self):
+        '''
+        Load the transcripts of every file in the manifest, from the workbook cache where possible.
+
+        return:
+            (pd.DataFrame) transcripts indexed by (provider_id, patient_id, date, line_num)
+        '''
+        rows = self.conn.execute("SELECT path, provider_id, patient_id, date FROM files ORDER BY path").fetchall()
+        transcripts = read_transcript_files([row[0] for row in rows], cache_dir=self.cache_dir, n_workers=self.n_workers)
+        return _concat_visit_transcripts(transcripts, [row[1:] for row in rows])
+
+    def close(self):
+        self.conn.close()
+
 def load_penn_cogtst_scores():
     lbls = pd.read_excel("/Volumes/biomedicalinformatics_analytics/dev_lab_johnson/swimcap/Penn OBSERVER/cognitive_test_scores.xlsx")
     return lbls
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+
+def source_fingerprint(paths, use_hash=False):
+    '''
+    Fingerprint source files so derived datasets can be invalidated when they change.
+
+    args:
+        paths (iterable<str>) - source file paths
+        use_hash (bool) - hash file contents instead of using mtime and size (default = False)
+
+    return:
+        (dict) fingerprint of each source file
+    '''
+    fingerprint = {}
+    for path in sorted(paths):
+        if use_hash:
+            with open(path, "rb") as f:
+                fingerprint[path] = hashlib.sha1(f.read()).hexdigest()
+        else:
+            stat = os.stat(path)
+            fingerprint[path] = [stat.st_mtime_ns, stat.st_size]
+    return fingerprint
+
+class ParquetStore:
+    def __init__(self, root):
+        '''
+        Initialize the columnar store, a directory of Parquet datasets that each record
+        the fingerprint of the source files they were built from.
+
+        args:
+            root (str) - store directory
+        '''
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _manifest_path(self, name):
+        return os.path.join(self.root, f"{name}.manifest.json")
+
+    def is_valid(self, name, fingerprint, version=None):
+        '''
+        Check whether a dataset exists and was built from the current sources.
+
+        args:
+            name (str) - dataset name
+            fingerprint (dict) - current source fingerprint
+            version (str or None) - version of the build logic, so changes to it invalidate the dataset (default = None)
+
+        return:
+            (bool) whether the dataset can be read
+        '''
+        try:
+            with open(self._manifest_path(name)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return os.path.exists(self._path(name)) and manifest.get("version") == version and manifest.get("sources") == fingerprint
+
+    def write(self, name, df, fingerprint, version=None, partition_cols=None):
+        '''
+        Write a dataset, replacing any previous version.
+
+        args:
+            df (pd.DataFrame) - data, the index is stored as columns
+            fingerprint (dict) - source fingerprint
+            version (str or None) - version of the build logic (default = None)
+            partition_cols (list<str> or None) - columns to partition the dataset by (default = None)
+        '''
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(name)
+        manifest_path = self._manifest_path(name)
+
+        # Drop the manifest first so that a failed write leaves the dataset invalid
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+        df = df.reset_index()
+        if partition_cols:
+            df.to_parquet(path, engine="pyarrow", partition_cols=partition_cols, index=False)
+        else:
+            df.to_parquet(path, engine="pyarrow", index=False)
+
+        manifest = {"version": version, "sources": fingerprint}
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    def read(self, name, index=None, columns=None, filters=None):
+        '''
+        Read a dataset, memory mapping the files and pushing filters down to the Parquet reader.
+
+        args:
+            name (str) - dataset name
+            index (list<str> or None) - columns to restore as the index (default = None)
+            columns (list<str> or None) - value columns to load, all if None (default = None)
+            filters (list or None) - pyarrow filters, e.g. [("split", "=", "test"), ("Speaker", "=", "Patient")] (default = None)
+
+        return:
+            (pd.DataFrame) data
+        '''
+        if columns is not None and index is not None:
+            columns = list(index) + [col for col in columns if col not in index]
+        df = pd.read_parquet(self._path(name), engine="pyarrow", columns=columns, filters=filters, memory_map=True)
+
+        # Partition columns are read back as categoricals
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(df[col].cat.categories.dtype)
+
+        if index is not None:
+            df = df.set_index(index)
+        return df
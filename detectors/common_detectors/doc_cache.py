@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from spacy.tokens import DocBin
+
+class DocCache:
+    def __init__(self, nlp, max_size=10000, cache_dir=None):
+        '''
+        Initialize the parse cache shared by the detectors.
+
+        args:
+            nlp (spacy.lang) - spaCy language model
+            max_size (int) - maximum number of docs kept in memory (default = 10000)
+            cache_dir (str) - directory for the on-disk DocBin store, disabled if None (default = None)
+        '''
+        self.nlp = nlp
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.docs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # Docs are only reusable by the same pipeline, so the pipeline config is part of every key
+        pipeline_cfg = {
+            "lang": self.nlp.lang,
+            "name": self.nlp.meta.get("name"),
+            "version": self.nlp.meta.get("version"),
+            "pipeline": self.nlp.pipe_names,
+        }
+        self.pipeline_key = hashlib.sha1(json.dumps(pipeline_cfg, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __call__(self, text):
+        return self.get(text)
+
+    def key(self, text):
+        '''
+        Get the cache key for a text.
+
+        args:
+            text (str) - input text
+
+        return:
+            (str) hash of the text and pipeline config
+        '''
+        return hashlib.sha1(f"{self.pipeline_key}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.spacy")
+
+    def _load_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        doc_bin = DocBin().from_disk(path)
+        return next(doc_bin.get_docs(self.nlp.vocab))
+
+    def _save_to_disk(self, key, doc):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        DocBin(docs=[doc], store_user_data=True).to_disk(path)
+
+    def _insert(self, key, doc):
+        self.docs[key] = doc
+        self.docs.move_to_end(key)
+        while len(self.docs) > self.max_size:
+            self.docs.popitem(last=False)
+
+    def _lookup(self, key):
+        '''
+        Look up a doc in memory, then on disk.
+
+        return:
+            (spacy.Doc or None) cached doc
+        '''
+        doc = self.docs.get(key)
+        if doc is not None:
+            self.docs.move_to_end(key)
+            return doc
+
+        doc = self._load_from_disk(key)
+        if doc is not None:
+            self._insert(key, doc)
+        return doc
+
+    def get(self, text):
+        '''
+        Get the parsed doc for a text, parsing it only on a cache miss.
+
+        args:
+            text (str) - input text
+
+        return:
+            (spacy.Doc) parsed doc
+        '''
+        key = self.key(text)
+        doc = self._lookup(key)
+        if doc is not None:
+            self.hits += 1
+            return doc
+
+        self.misses += 1
+        doc = self.nlp(text)
+        self._insert(key, doc)
+        self._save_to_disk(key, doc)
+        return doc
+
+    def pipe(self, texts, batch_size=1000, n_process=1, chunk_size=10000):
+        '''
+        Get the parsed docs for many texts, parsing cache misses with nlp.pipe.
+
+        args:
+            texts (iterable<str>) - input texts
+            batch_size (int) - nlp.pipe batch size (default = 1000)
+            n_process (int) - number of nlp.pipe worker processes (default = 1)
+            chunk_size (int) - number of texts looked up per nlp.pipe call, bounds memory (default = 10000)
+
+        return:
+            (generator<spacy.Doc>) parsed docs in input order
+        '''
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) >= chunk_size:
+                yield from self._pipe_chunk(chunk, batch_size, n_process)
+                chunk = []
+        if chunk:
+            yield from self._pipe_chunk(chunk, batch_size, n_process)
+
+    def _pipe_chunk(self, texts, batch_size, n_process):
+        keys = [self.key(text) for text in texts]
+
+        # Docs are held locally so that LRU eviction within the chunk cannot drop them
+        docs = {}
+        for key in keys:
+            if key not in docs:
+                doc = self._lookup(key)
+                if doc is not None:
+                    docs[key] = doc
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in docs:
+                misses.setdefault(key, text)
+        self.hits += len(keys) - len(misses)
+        self.misses += len(misses)
+
+        for key, doc in zip(misses.keys(), self.nlp.pipe(misses.values(), batch_size=batch_size, n_process=n_process)):
+            docs[key] = doc
+            self._insert(key, doc)
+            self._save_to_disk(key, doc)
+
+        for key in keys:
+            yield docs[key]
+
+    def clear(self):
+        '''
+        Clear the in-memory cache. The on-disk store is left untouched.
+        '''
+        self.docs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        '''
+        Get the fraction of lookups served from the cache.
+
+        return:
+            (float) cache hit rate
+        '''
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
@@ -0,0 +1,114 @@
+import numpy as np
+from collections import OrderedDict
+
+class EmbeddingBackend:
+    def __init__(self, cache_size=100000):
+        '''
+        Initialize the embedding backend.
+
+        args:
+            cache_size (int) - maximum number of text embeddings kept in the LRU cache (default = 100000)
+        '''
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(self, texts):
+        '''
+        Embed texts that are not in the cache.
+
+        args:
+            texts (list<str>) - texts to embed
+
+        return:
+            (np.ndarray) embeddings, one row per text
+        '''
+        raise NotImplementedError
+
+    def encode(self, texts):
+        '''
+        Embed texts, encoding all cache misses in one batch.
+
+        args:
+            texts (list<str>) - texts to embed
+
+        return:
+            (np.ndarray) L2-normalized embeddings, one row per text (zero rows stay zero)
+        '''
+        rows = {}
+        misses = []
+        for text in texts:
+            if text in rows:
+                continue
+            emb = self.cache.get(text)
+            if emb is not None:
+                self.cache.move_to_end(text)
+                rows[text] = emb
+                self.hits += 1
+            else:
+                rows[text] = None
+                misses.append(text)
+                self.misses += 1
+
+        if misses:
+            embs = np.asarray(self._encode(misses), dtype=np.float32)
+            norms = np.linalg.norm(embs, axis=1, keepdims=True)
+            embs = np.divide(embs, norms, out=np.zeros_like(embs), where=norms > 0)
+            for text, emb in zip(misses, embs):
+                rows[text] = emb
+                self.cache[text] = emb
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return np.stack([rows[text] for text in texts]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+    def hit_rate(self):
+        '''
+        Get the fraction of embedding lookups served from the cache.
+
+        return:
+            (float) cache hit rate
+        '''
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class SBERTEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model="all-MiniLM-L6-v2", batch_size=256, cache_size=100000):
+        '''
+        Initialize the Sentence BERT embedding backend.
+
+        args:
+            model (str or SentenceTransformer) - Sentence BERT model or model name (default = "all-MiniLM-L6-v2")
+            batch_size (int) - encoding batch size (default = 256)
+            cache_size (int) - maximum number of cached embeddings (default = 100000)
+        '''
+        super().__init__(cache_size=cache_size)
+        if isinstance(model, str):
+            # Imported here so that only the Sentence BERT backend pays for loading sentence-transformers
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model)
+        self.sbert = model
+        self.batch_size = batch_size
+
+    def _encode(self, texts):
+        return self.sbert.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+
+class SpacyEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, nlp, cache_size=100000):
+        '''
+        Initialize the spaCy static vector embedding backend. A text is embedded as the
+        mean of the vectors of its whitespace separated tokens.
+
+        args:
+            nlp (spacy.lang) - spaCy language model with static vectors
+            cache_size (int) - maximum number of cached embeddings (default = 100000)
+        '''
+        super().__init__(cache_size=cache_size)
+        self.nlp = nlp
+
+    def _encode(self, texts):
+        vocab = self.nlp.vocab
+        return np.stack([np.mean([vocab.get_vector(word) for word in text.split(" ")], axis=0) for text in texts])
@@ -1,21 +1,45 @@
-from spacy.matcher import Matcher
+from utils import check_components
+from .keyword_engine import KeywordEngine
 
 class KeywordDetector:
-    def __init__(self, nlp, keywords):
+    # Trained spaCy components needed on top of the tokenizer and custom transcript components
+    nlp_components = []
+
+    # Category of the detector's keywords in a shared KeywordEngine
+    category = "keywords"
+
+    def __init__(self, nlp, keywords, doc_cache=None, engine=None):
         '''
         Initialize the keyword detector.
 
         args:
             nlp (spacy.lang) - spaCy language model
             keywords (list) - list of keywords to detect
+            doc_cache (DocCache) - shared parse cache, parses every text if None (default = None)
+            engine (KeywordEngine) - keyword engine shared with other keyword detectors, so a doc is
+                matched once for all of them. Uses a private engine if None (default = None)
         '''
         self.nlp = nlp
         self.keywords = keywords
+        self.doc_cache = doc_cache
+        check_components(self.nlp, self.required_components(), type(self).__name__)
+
+        # Register the keywords with the engine, the detector is a view on its category
+        self.engine = engine if engine is not None else KeywordEngine(self.nlp)
+        self.engine.add(self.category, self.keywords)
+
+    @classmethod
+    def required_components(cls, **kwargs):
+        '''
+        Get the trained spaCy components the detector needs, for create_custom_nlp.
+
+        args:
+            kwargs - detector config that changes the required components
 
-        # Create spaCy matcher
-        self.matcher = Matcher(self.nlp.vocab)
-        patterns = [[{"LOWER": tok.text} for tok in self.nlp(kw)] for kw in self.keywords]
-        self.matcher.add("keywords", patterns)
+        return:
+            (list) component names
+        '''
+        return list(cls.nlp_components)
 
     def get_keywords(self):
         '''
@@ -23,6 +47,14 @@ class KeywordDetector:
         '''
         return self.keywords
 
+    def _parse(self, text):
+        '''
+        Parse text, drawing from the shared parse cache if available.
+        '''
+        if self.doc_cache is not None:
+            return self.doc_cache(text)
+        return self.nlp(text)
+
     def detect(self, text, return_doc=False):
         '''
         Detect keywords in text.
@@ -38,18 +70,43 @@ class KeywordDetector:
                 - "span" : character span of detected filler
         '''
         # Tokenize the input text
-        doc = self.nlp(text)
-
-        # Run spacy matcher
-        matches = self.matcher(doc)
+        doc = self._parse(text)
 
-        output = {"detections": []}
-        for match_id, start_token, end_token in matches:
-            span = doc[start_token:end_token]
-            output["detections"].append({"text": span.text, "span": [span.start_char, span.end_char]})
+        output = self.detect_doc(doc)
 
         if return_doc:
             return output, doc
         
         return output
-    
\ No newline at end of file
+
+    def detect_many(self, texts, batch_size=1000, n_process=1):
+        '''
+        Detect keywords in many texts, parsing them in batches with nlp.pipe.
+
+        args:
+            texts (iterable<str>) - input texts
+            batch_size (int) - number of texts per nlp.pipe batch (default is 1000)
+            n_process (int) - number of nlp.pipe worker processes (default is 1)
+
+        return:
+            (generator<dict>) : detect output for each text, in input order
+        '''
+        if self.doc_cache is not None:
+            docs = self.doc_cache.pipe(texts, batch_size=batch_size, n_process=n_process)
+        else:
+            docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+        for doc in docs:
+            yield self.detect_doc(doc)
+
+    def detect_doc(self, doc):
+        '''
+        Detect keywords in an already parsed doc.
+
+        args:
+            doc (spacy.Doc) - parsed input text
+
+        return:
+            (dict) : JSON object with key "detections", same format as detect
+        '''
+        return self.engine.detect_doc(doc, [self.category])[self.category]
@@ -0,0 +1,93 @@
+from spacy.matcher import PhraseMatcher
+
+class KeywordEngine:
+    def __init__(self, nlp, keyword_sets=None):
+        '''
+        Initialize the keyword engine, which compiles every keyword category into one PhraseMatcher
+        on lowercase token text, so a doc is scanned once for all categories.
+
+        args:
+            nlp (spacy.lang) - spaCy language model
+            keyword_sets (dict<str, list> or None) - keywords of each category (default = None)
+        '''
+        self.nlp = nlp
+        self.keyword_sets = {}
+        self.matcher = PhraseMatcher(self.nlp.vocab, attr="LOWER")
+
+        # Matches of the last scanned doc, shared by the detectors viewing the engine
+        self.last_doc = None
+        self.last_matches = None
+
+        for category, keywords in (keyword_sets or {}).items():
+            self.add(category, keywords)
+
+    def _make_pattern(self, keyword):
+        '''
+        Tokenize a keyword with the tokenizer only, merging transcript special tokens like the custom pipeline.
+        '''
+        doc = self.nlp.make_doc(keyword)
+        if "merge_custom_tokens" in self.nlp.pipe_names:
+            doc = self.nlp.get_pipe("merge_custom_tokens")(doc)
+        return doc
+
+    def add(self, category, keywords):
+        '''
+        Add a keyword category. Adding a category that already exists with the same keywords does nothing.
+
+        args:
+            category (str) - category label of the matches
+            keywords (list) - keywords of the category
+        '''
+        keywords = list(keywords)
+        if category in self.keyword_sets:
+            if self.keyword_sets[category] != keywords:
+                raise ValueError(f"Keyword category {category} already exists with different keywords")
+            return
+
+        self.keyword_sets[category] = keywords
+        self.matcher.add(category, [self._make_pattern(kw) for kw in keywords])
+        self.last_doc = None
+        self.last_matches = None
+
+    def categories(self):
+        '''
+        Get the keyword categories.
+        '''
+        return list(self.keyword_sets)
+
+    def match(self, doc):
+        '''
+        Match every keyword category in a doc. Consecutive calls with the same doc reuse the scan.
+
+        args:
+            doc (spacy.Doc) - parsed input text
+
+        return:
+            (list<tuple>) (category, start_token, end_token) of each match, in doc order
+        '''
+        if doc is not self.last_doc:
+            strings = self.nlp.vocab.strings
+            self.last_matches = [(strings[match_id], start, end) for match_id, start, end in self.matcher(doc)]
+            self.last_doc = doc
+        return self.last_matches
+
+    def detect_doc(self, doc, categories=None):
+        '''
+        Detect the keywords of each category in an already parsed doc.
+
+        args:
+            doc (spacy.Doc) - parsed input text
+            categories (list<str> or None) - categories to report, all if None (default = None)
+
+        return:
+            (dict) : detect output of each category, a JSON object with key "detections" that is
+            a list of keyword objects, each having the following keys:
+                - "text" : the detected keyword
+                - "span" : character span of detected keyword
+        '''
+        outputs = {category: {"detections": []} for category in (categories or self.keyword_sets)}
+        for category, start_token, end_token in self.match(doc):
+            if category in outputs:
+                span = doc[start_token:end_token]
+                outputs[category]["detections"].append({"text": span.text, "span": [span.start_char, span.end_char]})
+        return outputs
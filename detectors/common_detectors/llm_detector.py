@@ -1,11 +1,70 @@
+import asyncio
+import json
+import random
 import time
 import mlflow
 import tiktoken
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from functools import lru_cache
+from .rate_limiter import SlidingWindowRateLimiter
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    '''
+    Get the tiktoken encoding of a model, loaded once per model.
+
+    args:
+        model (str) - OpenAI model name
+
+    return:
+        (tiktoken.Encoding) encoding
+    '''
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print("Warning: model not found. Using o200k_base encoding.")
+        return tiktoken.get_encoding("o200k_base")
+
+def resolve_token_counting(model):
+    '''
+    Resolve the model snapshot and per-message token overheads used to count tokens. Models
+    other than OpenAI's fall back to the default overheads and the o200k_base encoding.
+
+    args:
+        model (str) - model name
+
+    return:
+        (tuple<str, int, int>) model snapshot, tokens per message, tokens per name
+    '''
+    if model in {
+        "gpt-3.5-turbo-0125",
+        "gpt-4-0314",
+        "gpt-4-32k-0314",
+        "gpt-4-0613",
+        "gpt-4-32k-0613",
+        "gpt-4o-mini-2024-07-18",
+        "gpt-4o-2024-08-06"
+        }:
+        return model, 3, 1
+    elif "gpt-3.5-turbo" in model:
+        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0125.")
+        return "gpt-3.5-turbo-0125", 3, 1
+    elif "gpt-4o-mini" in model:
+        print("Warning: gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-mini-2024-07-18.")
+        return "gpt-4o-mini-2024-07-18", 3, 1
+    elif "gpt-4o" in model:
+        print("Warning: gpt-4o and gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-2024-08-06.")
+        return "gpt-4o-2024-08-06", 3, 1
+    elif "gpt-4" in model:
+        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
+        return "gpt-4-0613", 3, 1
+    else:
+        print(f"Warning: token counting is not implemented for model {model}. Returning num tokens assuming the default message overheads.")
+        return model, 3, 1
 
 class LLMDetector:
-    def __init__(self, model, api_token, host_url, rpm, tpm, dev_prompt, user_prompt, temperature, top_p, max_output_toks=None, maintain_history=True):
+    def __init__(self, model, api_token, host_url, rpm, tpm, dev_prompt, user_prompt, temperature, top_p, max_output_toks=None, maintain_history=True, cache=None, tokenizer_model=None):
         '''
         Initialize detector.
 
@@ -20,6 +79,8 @@ class LLMDetector:
             dev_prompt (str) - system prompt to use for LLM
             user_prompt (str) - user prompt to use for LLM
             maintain_history (bool) - whether to maintain message history between calls, defaults to True
+            cache (LLMResponseCache) - persistent response cache, defaults to None
+            tokenizer_model (str) - OpenAI model name used for token counting, defaults to model
         '''
         self.model = model
         self.rpm = rpm
@@ -30,10 +91,15 @@ class LLMDetector:
         self.top_p = top_p
         self.max_output_toks = max_output_toks
         self.maintain_history = maintain_history
+        self.cache = cache
 
         # Initialize OpenAI API client
         self.client = OpenAI(api_key=api_token, base_url=host_url)
 
+        # Resolve token counting for the model family once
+        self.tokenizer_model, self.tokens_per_message, self.tokens_per_name = resolve_token_counting(model if tokenizer_model is None else tokenizer_model)
+        self.encoding = get_encoding(self.tokenizer_model)
+
         # Initialize message history
         self.reset_messages()
 
@@ -56,62 +122,63 @@ class LLMDetector:
         Clear message history, preserving the developer prompt if it was provided.
         '''
         self.messages = []
+        self.history_tokens = 0
         if self.dev_prompt is not None:
-            self.messages.append({"role": "developer", "content": self.dev_prompt})
+            self._append_message({"role": "developer", "content": self.dev_prompt})
+
+    def _append_message(self, message):
+        '''
+        Append a message to the history, updating the running token count.
+
+        args:
+            message (dict) - message to append
+        '''
+        self.messages.append(message)
+        self.history_tokens += self._count_message_tokens(message)
+
+    def _count_message_tokens(self, message):
+        '''
+        Count tokens in a single message, excluding the reply priming tokens.
+
+        args:
+            message (dict) - message to count
+
+        return:
+            (int) number of tokens
+        '''
+        num_tokens = self.tokens_per_message
+        for key, value in message.items():
+            if value is None:
+                continue
+            num_tokens += len(self.encoding.encode(value))
+            if key == "name":
+                num_tokens += self.tokens_per_name
+        return num_tokens
 
-    def _count_messages_tokens():
+    def _count_messages_tokens(self, messages=None):
         '''
         Count tokens in message history.
         Source: 
 
+        args:
+            messages (list or None) - messages to count, defaults to the message history whose count is kept up to date incrementally
+
         return:
             (int) number of tokens
         '''
-        try:
-            encoding = tiktoken.encoding_for_model(self.model)
-        except KeyError:
-            print("Warning: model not found. Using o200k_base encoding.")
-            encoding = tiktoken.get_encoding("o200k_base")
-        if model in {
-            "gpt-3.5-turbo-0125",
-            "gpt-4-0314",
-            "gpt-4-32k-0314",
-            "gpt-4-0613",
-            "gpt-4-32k-0613",
-            "gpt-4o-mini-2024-07-18",
-            "gpt-4o-2024-08-06"
-            }:
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif "gpt-3.5-turbo" in model:
-            print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0125.")
-            return self._count_messages_tokens(self.messages, model="gpt-3.5-turbo-0125")
-        elif "gpt-4o-mini" in model:
-            print("Warning: gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-mini-2024-07-18.")
-            return self._count_messages_tokens(self.messages, model="gpt-4o-mini-2024-07-18")
-        elif "gpt-4o" in model:
-            print("Warning: gpt-4o and gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-2024-08-06.")
-            return self._count_messages_tokens(self.messages, model="gpt-4o-2024-08-06")
-        elif "gpt-4" in model:
-            print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-            return self._count_messages_tokens(self.messages, model="gpt-4-0613")
+        if messages is None:
+            num_tokens = self.history_tokens
         else:
-            raise NotImplementedError(
-                f"""self._count_messages_tokens() is not implemented for model {model}."""
-            )
-        num_tokens = 0
-        for message in self.messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
+            num_tokens = sum(self._count_message_tokens(message) for message in messages)
         num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
 
-    def _enforce_rate_limits(self):
+    def _enforce_rate_limits(self, input_tokens=None):
         '''
         Enforce rate limits with sleep.
+
+        args:
+            input_tokens (int or None) - input tokens of the request, defaults to the message history count
         '''
         # Reset token count if rate limit period has passed
         if self.t_last_request and time.time() - self.t_last_request > 60:
@@ -119,33 +186,72 @@ class LLMDetector:
             self.tokens_used = 0
         
         # Check if rate limit will be exceeded
-        input_tokens = self._count_messages_tokens()
-        if self.requests_made + 1 >= self.rpm or self.tokens_used + input_tokens + self.max_output_toks >= self.tpm:
-            retry_after = self.t_last_request + 60 - time.time()
-            print("Rate limit exceeded. Waiting for {retry_after} seconds...")
+        if input_tokens is None:
+            input_tokens = self._count_messages_tokens()
+        rpm_exceeded = self.rpm is not None and self.requests_made + 1 >= self.rpm
+        tpm_exceeded = self.tpm is not None and self.tokens_used + input_tokens + (self.max_output_toks or 0) >= self.tpm
+        if (rpm_exceeded or tpm_exceeded) and self.t_last_request is not None:
+            retry_after = max(self.t_last_request + 60 - time.time(), 0)
+            print(f"Rate limit exceeded. Waiting for {retry_after} seconds...")
             time.sleep(retry_after)
             self.requests_made = 0
             self.tokens_used = 0
 
-    def _call_llm(self):
+    def _cache_key(self, messages, response_format=None):
+        '''
+        Get the response cache key for a request, or None if the cache is bypassed.
+
+        args:
+            messages (list) - request messages
+            response_format (dict or None) - requested response format
+
+        return:
+            (str or None) cache key
+        '''
+        if self.cache is None or not self.cache.is_cacheable(self.temperature):
+            return None
+        return self.cache.make_key(self.model, messages, response_fmt=response_format, temperature=self.temperature, top_p=self.top_p, max_tokens=self.max_output_toks)
+
+    def _call_llm(self, messages=None, response_format=None, validate=None):
         '''
         Query LLM using OpenAI API
 
+        args:
+            messages (list or None) - messages of a standalone request, defaults to the message history,
+                which is then extended with the response
+            response_format (dict or None) - requested response format
+            validate (callable or None) - check a response must pass to be cached or served from the cache, defaults to None
+
         return:
             (str or None) LLM response
         '''
-        self._enforce_rate_limits()
+        use_history = messages is None
+        messages = self.messages if use_history else messages
+
+        cache_key = self._cache_key(messages, response_format)
+        if cache_key is not None:
+            response = self.cache.get(cache_key)
+            if response is not None and (validate is None or validate(response)):
+                if use_history:
+                    self._append_message({"role": "assistant", "content": response})
+                return response
+
+        self._enforce_rate_limits(None if use_history else self._count_messages_tokens(messages))
         try:
-            output = client.chat.completions.create(
+            output = self.client.chat.completions.create(
                 model=self.model,
-                messages=self.messages,
+                messages=messages,
                 temperature=self.temperature,
                 top_p=self.top_p,
-                max_completion_tokens=self.max_output_toks
+                max_completion_tokens=self.max_output_toks,
+                response_format=openai.NOT_GIVEN if response_format is None else response_format
             )
 
             response = output.choices[0].message.content
-            self.messages.append({"role": "assistant", "content": response})
+            if use_history and response is not None:
+                self._append_message({"role": "assistant", "content": response})
+            if cache_key is not None and response is not None and (validate is None or validate(response)):
+                self.cache.put(cache_key, response)
 
             # Update rate limiting metrics
             self.t_last_request = time.time()
@@ -153,7 +259,7 @@ class LLMDetector:
             self.tokens_used += output.usage.total_tokens
 
             return response
-        except openai.error.OpenAIError as e:
+        except openai.OpenAIError as e:
             print(f"Error calling LLM: {e}")
             return None
 
@@ -169,11 +275,299 @@ class LLMDetector:
             (str) LLM response
         '''
         content = text if self.user_prompt is None else self.user_prompt.format(text)
-        self.messages.append({"role": "user", "content": content})
+        self._append_message({"role": "user", "content": content})
 
         output = self._call_llm()
 
         if not self.maintain_history:
             self.reset_messages()
 
-        return output
\ No newline at end of file
+        return output
+
+    def _batch_messages(self, items):
+        '''
+        Build the messages of a batched request.
+
+        args:
+            items (list<dict>) - utterances as {"id": ..., "text": ...} objects
+
+        return:
+            (list) request messages
+        '''
+        payload = json.dumps({"utterances": items})
+        messages = []
+        if self.dev_prompt is not None:
+            messages.append({"role": "developer", "content": self.dev_prompt})
+        messages.append({"role": "user", "content": payload if self.user_prompt is None else self.user_prompt.format(payload)})
+        return messages
+
+    def _batch_response_format(self, ids, detection_schema):
+        '''
+        Build a JSON schema response format with one required key per utterance ID.
+
+        args:
+            ids (list<str>) - utterance IDs in the batch
+            detection_schema (dict) - JSON schema of a single detection
+
+        return:
+            (dict) response format
+        '''
+        utterance_schema = {
+            "type": "object",
+            "properties": {"detections": {"type": "array", "items": detection_schema}},
+            "required": ["detections"],
+            "additionalProperties": False
+        }
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "detections_by_utterance",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {utt_id: utterance_schema for utt_id in ids},
+                    "required": list(ids),
+                    "additionalProperties": False
+                }
+            }
+        }
+
+    def _pack_batches(self, items, max_batch_tokens, max_batch_size):
+        '''
+        Pack utterances into batches whose request fits the token budget.
+
+        args:
+            items (list<dict>) - utterances as {"id": ..., "text": ...} objects
+            max_batch_tokens (int) - maximum input tokens per request
+            max_batch_size (int) - maximum utterances per request
+
+        return:
+            (list<list<dict>>) batches
+        '''
+        base_tokens = self._count_messages_tokens(self._batch_messages([]))
+
+        batches, batch, batch_tokens = [], [], base_tokens
+        for item in items:
+            # Each item adds its JSON encoding plus a separator
+            item_tokens = len(self.encoding.encode(json.dumps(item))) + 1
+            if batch and (batch_tokens + item_tokens > max_batch_tokens or len(batch) >= max_batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], base_tokens
+            batch.append(item)
+            batch_tokens += item_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _parse_batch_response(self, response, batch_ids, verbose=True):
+        '''
+        Parse a batched response into the detections of each utterance it answers.
+
+        args:
+            response (str or None) - LLM response
+            batch_ids (list<str>) - utterance IDs in the batch
+            verbose (bool) - whether to print parsing errors, defaults to True
+
+        return:
+            (dict) {"detections": [...]} of each answered utterance ID
+        '''
+        try:
+            output = json.loads(response) if response is not None else {}
+        except json.JSONDecodeError as e:
+            if verbose:
+                print(f"Error parsing LLM response: {e}")
+            output = {}
+
+        results = {}
+        for utt_id in batch_ids:
+            utt_output = output.get(utt_id) if isinstance(output, dict) else None
+            if isinstance(utt_output, dict) and isinstance(utt_output.get("detections"), list):
+                results[utt_id] = {"detections": utt_output["detections"]}
+        return results
+
+    @mlflow.trace
+    def detect_batch(self, texts, ids=None, max_batch_tokens=8000, max_batch_size=50, max_resubmits=2, detection_schema=None):
+        '''
+        Run detection on many utterances, packing them into as few requests as the token
+        budget allows. The prompts must instruct the LLM to return, for each utterance ID in the
+        input JSON {"utterances": [{"id": ..., "text": ...}, ...]}, an object {"detections": [...]}.
+
+        args:
+            texts (list<str>) - inputs for detector
+            ids (list or None) - utterance IDs, defaults to the input positions
+            max_batch_tokens (int) - maximum input tokens per request, defaults to 8000
+            max_batch_size (int) - maximum utterances per request, defaults to 50
+            max_resubmits (int) - number of times IDs missing from the responses are re-submitted, defaults to 2
+            detection_schema (dict or None) - JSON schema of a single detection, defaults to {"text": str, "span": [int, int]}
+
+        return:
+            (list<dict or None>) {"detections": [...]} for each input in order, None if the utterance never got a response
+        '''
+        if detection_schema is None:
+            detection_schema = {
+                "type": "object",
+                "properties": {"text": {"type": "string"}, "span": {"type": "array", "items": {"type": "integer"}}},
+                "required": ["text", "span"],
+                "additionalProperties": False
+            }
+
+        ids = [str(i) for i in (range(len(texts)) if ids is None else ids)]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Utterance IDs must be unique.")
+
+        results = {}
+        pending = [{"id": utt_id, "text": text} for utt_id, text in zip(ids, texts)]
+        for attempt in range(max_resubmits + 1):
+            for batch in self._pack_batches(pending, max_batch_tokens, max_batch_size):
+                batch_ids = [item["id"] for item in batch]
+
+                # Only cache complete responses, so a re-submitted batch is not answered by the same cached bad response
+                is_complete = lambda response: len(self._parse_batch_response(response, batch_ids, verbose=False)) == len(batch_ids)
+                response = self._call_llm(self._batch_messages(batch), self._batch_response_format(batch_ids, detection_schema), validate=is_complete)
+
+                # Scatter the response back to the utterances
+                results.update(self._parse_batch_response(response, batch_ids))
+
+            pending = [item for item in pending if item["id"] not in results]
+            if not pending:
+                break
+            print(f"Re-submitting {len(pending)} utterances missing from the LLM responses...")
+
+        return [results.get(utt_id) for utt_id in ids]
+
+
+class AsyncLLMDetector(LLMDetector):
+    def __init__(self, model, api_token, host_url, rpm, tpm, dev_prompt, user_prompt, temperature, top_p, max_output_toks=None, max_concurrency=16, max_retries=5, backoff_base=1.0, backoff_max=60.0, cache=None, tokenizer_model=None):
+        '''
+        Initialize detector that runs many requests concurrently. Requests are independent,
+        so no message history is kept between them.
+
+        args:
+            model (str) - LLM to use
+            api_token (str) - OpenAI API token
+            host_url (str) - host url for the OpenAI-compatible endpoint (e.g. a Databricks serving endpoint or a local mock server)
+            rpm (int or None) - requests per minute, unlimited if None
+            tpm (int or None) - tokens per minute, unlimited if None
+            dev_prompt (str) - system prompt to use for LLM
+            user_prompt (str) - user prompt to use for LLM
+            temperature (float) - temperature to use for LLM
+            top_p (float) - top_p to use for LLM
+            max_output_toks (int) - maximum output tokens per request, reserved against tpm
+            max_concurrency (int) - maximum number of requests in flight, defaults to 16
+            max_retries (int) - retries on 429/5xx and connection errors, defaults to 5
+            backoff_base (float) - base delay in seconds of the exponential backoff, defaults to 1.0
+            backoff_max (float) - maximum backoff delay in seconds, defaults to 60.0
+            cache (LLMResponseCache) - persistent response cache, defaults to None
+            tokenizer_model (str) - OpenAI model name used for token counting, defaults to model
+        '''
+        super().__init__(model, api_token, host_url, rpm, tpm, dev_prompt, user_prompt, temperature, top_p, max_output_toks=max_output_toks, maintain_history=False, cache=cache, tokenizer_model=tokenizer_model)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Retries are handled here so that every attempt goes through the rate limiter
+        self.async_client = AsyncOpenAI(api_key=api_token, base_url=host_url, max_retries=0)
+        self.rate_limiter = SlidingWindowRateLimiter(rpm=rpm, tpm=tpm)
+
+    def _backoff_delay(self, attempt, error):
+        '''
+        Get the delay before retrying, honoring the server's Retry-After header if present.
+
+        args:
+            attempt (int) - number of the failed attempt, starting at 0
+            error (openai.OpenAIError) - error raised by the failed attempt
+
+        return:
+            (float) delay in seconds
+        '''
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                return min(float(response.headers.get("retry-after")), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        # Full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _is_retryable(self, error):
+        if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    @mlflow.trace
+    async def adetect(self, text, semaphore=None):
+        '''
+        Run detection asynchronously.
+
+        args:
+            text (str) - input for detector
+            semaphore (asyncio.Semaphore or None) - bounds the requests in flight
+
+        return:
+            (str or None) LLM response, None if all attempts failed
+        '''
+        messages = []
+        if self.dev_prompt is not None:
+            messages.append({"role": "developer", "content": self.dev_prompt})
+        messages.append({"role": "user", "content": text if self.user_prompt is None else self.user_prompt.format(text)})
+
+        cache_key = self._cache_key(messages)
+        if cache_key is not None:
+            response = self.cache.get(cache_key)
+            if response is not None:
+                return response
+
+        est_tokens = self._count_messages_tokens(messages) + (self.max_output_toks or 0)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency) if semaphore is None else semaphore
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                reservation = await self.rate_limiter.acquire(est_tokens)
+                try:
+                    output = await self.async_client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        top_p=self.top_p,
+                        max_completion_tokens=self.max_output_toks
+                    )
+                    if output.usage is not None:
+                        self.rate_limiter.settle(reservation, output.usage.total_tokens)
+                    response = output.choices[0].message.content
+                    if cache_key is not None and response is not None:
+                        self.cache.put(cache_key, response)
+                    return response
+                except openai.OpenAIError as e:
+                    if not self._is_retryable(e) or attempt == self.max_retries:
+                        print(f"Error calling LLM: {e}")
+                        return None
+                    delay = self._backoff_delay(attempt, e)
+
+            # Back off outside the semaphore so other requests can proceed
+            await asyncio.sleep(delay)
+
+    async def adetect_many(self, texts):
+        '''
+        Run detection on many inputs concurrently.
+
+        args:
+            texts (iterable<str>) - inputs for detector
+
+        return:
+            (list<str or None>) LLM responses in input order
+        '''
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*[self.adetect(text, semaphore) for text in texts])
+
+    def detect_many(self, texts):
+        '''
+        Run detection on many inputs concurrently from synchronous code.
+
+        args:
+            texts (iterable<str>) - inputs for detector
+
+        return:
+            (list<str or None>) LLM responses in input order
+        '''
+        return asyncio.run(self.adetect_many(texts))
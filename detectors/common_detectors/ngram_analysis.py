@@ -1,8 +1,16 @@
 import numpy as np
+from collections import deque
 from itertools import islice
+from utils import check_components, doc_word_mask
+
+# Multiplier of the polynomial rolling hash over token attribute IDs (wraps modulo 2**64)
+HASH_BASE = np.uint64(1099511628211)
 
 class NgramAnalysis:
-    def __init__(self, nlp, max_N=1, window_size=5):
+    # Trained spaCy components needed on top of the tokenizer and custom transcript components
+    nlp_components = []
+
+    def __init__(self, nlp, max_N=1, window_size=5, doc_cache=None):
         '''
         Initialize the n-gram analysis detector.
 
@@ -10,10 +18,34 @@ class NgramAnalysis:
             nlp (spacy.lang) - spaCy language model
             max_N (int) : maximum N-gram size (default = 1)
             window_size (int) : search window size for comparing n-grams as number of previous tokens (default = 5)
+            doc_cache (DocCache) : shared parse cache, parses every text if None (default = None)
         '''
         self.nlp = nlp
         self.max_N = max_N
         self.window_size = window_size
+        self.doc_cache = doc_cache
+        check_components(self.nlp, self.required_components(), type(self).__name__)
+
+    @classmethod
+    def required_components(cls, **kwargs):
+        '''
+        Get the trained spaCy components the detector needs, for create_custom_nlp.
+
+        args:
+            kwargs : detector config that changes the required components
+
+        return:
+            (list) component names
+        '''
+        return list(cls.nlp_components)
+
+    def _parse(self, text):
+        '''
+        Parse text, drawing from the shared parse cache if available.
+        '''
+        if self.doc_cache is not None:
+            return self.doc_cache(text)
+        return self.nlp(text)
     
     def _ngrams(self, tokens, n):
         '''
@@ -42,7 +74,98 @@ class NgramAnalysis:
             (bool) : True if similar otherwise False
         '''
         return NotImplementedError
-    
+
+    def _ngram_key_attr(self):
+        '''
+        Get the token attribute whose equality defines matching n-grams. Subclasses
+        with exact comparators return it to enable the hashed search.
+
+        return:
+            (int or None) : spaCy attribute ID, or None to compare n-grams with _compare_ngrams
+        '''
+        return None
+
+    def _find_repeats_pairwise(self, tokens, doc):
+        '''
+        Find repeated n-grams by comparing every n-gram to the n-grams in its window.
+
+        args:
+            tokens (list<spacy.Token>) : filtered tokens
+            doc (spacy.Doc) : spacy document
+
+        return:
+            (list<tuple<int, int, int>>) : (n, j, i) for each repeat of the n-gram starting
+            at token j by the n-gram starting at token i
+        '''
+        repeats = []
+        for n in range(1, self.max_N+1):
+            ngs = self._ngrams(tokens, n)
+
+            for i in range(len(ngs)):
+                # Compare current n-gram to preceeding, non-overlapping n-grams
+                for j in range(max(0, i - self.window_size), i-n+1):
+                    if self._compare_ngrams(ngs[j], ngs[i], doc):
+                        repeats.append((n, j, i))
+
+        return repeats
+
+    def _find_repeats_hashed(self, ids):
+        '''
+        Find repeated n-grams in one linear pass per n, using a rolling hash of the
+        token IDs and an index of the positions where each hash was last seen.
+
+        args:
+            ids (np.ndarray) : token attribute IDs of the filtered tokens
+
+        return:
+            (list<tuple<int, int, int>>) : same as _find_repeats_pairwise
+        '''
+        ids = ids.astype(np.uint64)
+        id_list = ids.tolist()
+        hashes = ids
+
+        repeats = []
+        for n in range(1, self.max_N+1):
+            if n > 1:
+                hashes = hashes[:-1] * HASH_BASE + ids[n-1:]
+
+            seen = {}
+            for i, key in enumerate(hashes.tolist()):
+                positions = seen.get(key)
+                if positions is None:
+                    seen[key] = deque([i])
+                    continue
+
+                # Drop positions that have left the window, then match the non-overlapping ones
+                while positions and positions[0] < i - self.window_size:
+                    positions.popleft()
+                for j in positions:
+                    if j > i - n:
+                        break
+                    # Confirm hash matches to rule out collisions
+                    if n == 1 or id_list[j:j+n] == id_list[i:i+n]:
+                        repeats.append((n, j, i))
+                positions.append(i)
+
+        return repeats
+
+    def _find_repeats(self, doc, word_idxs, tokens):
+        '''
+        Find repeated n-grams with the fastest search the comparator allows.
+
+        args:
+            doc (spacy.Doc) : spacy document
+            word_idxs (np.ndarray) : doc indices of the filtered tokens
+            tokens (list<spacy.Token>) : filtered tokens
+
+        return:
+            (list<tuple<int, int, int>>) : same as _find_repeats_pairwise
+        '''
+        key_attr = self._ngram_key_attr()
+        if key_attr is not None:
+            return self._find_repeats_hashed(doc.to_array(key_attr)[word_idxs])
+        return self._find_repeats_pairwise(tokens, doc)
+
     def detect(self, text):
         '''
         Detect repeated n-grams in the input text.
@@ -59,23 +182,53 @@ class NgramAnalysis:
                 - "span2" : character span list for second occurrence
         '''
         # Tokenize the input text
-        doc = self.nlp(text)
+        doc = self._parse(text)
+        return self.detect_doc(doc)
+
+    def detect_many(self, texts, batch_size=1000, n_process=1):
+        '''
+        Detect repeated n-grams in many texts, parsing them in batches with nlp.pipe.
+
+        args:
+            texts (iterable<str>) : input texts
+            batch_size (int) : number of texts per nlp.pipe batch (default = 1000)
+            n_process (int) : number of nlp.pipe worker processes (default = 1)
+
+        return:
+            (generator<dict>) : detect output for each text, in input order
+        '''
+        if self.doc_cache is not None:
+            docs = self.doc_cache.pipe(texts, batch_size=batch_size, n_process=n_process)
+        else:
+            docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+        for doc in docs:
+            yield self.detect_doc(doc)
+
+    def detect_doc(self, doc):
+        '''
+        Detect repeated n-grams in an already parsed doc.
+
+        args:
+            doc (spacy.Doc) : parsed input text
+
+        return:
+            (dict) : JSON object with key "detections", same format as detect
+        '''
         # Filter out punctuation and whitespace tokens
-        tokens = [token for token in doc if not (token.is_punct or token.is_space or token._.is_silence_tag or token._.is_inaudible_tag or token._.is_event_tag)]
+        word_idxs = np.flatnonzero(doc_word_mask(doc))
+        tokens = [doc[i] for i in word_idxs]
 
-        output = {"detections": []}
-        for n in range(1, self.max_N+1):
-            ngs = self._ngrams(tokens, n)
+        repeats = self._find_repeats(doc, word_idxs, tokens)
 
-            for i in range(len(ngs)):
-                # Compare current n-gram to preceeding, non-overlapping n-grams
-                for j in range(max(0, i - self.window_size), i-n+1):
-                    if self._compare_ngrams(ngs[j], ngs[i], doc):
-                        output["detections"].append({
-                                "text1": doc[ngs[j][0].i:ngs[j][-1].i+1].text, 
-                                "span1": [ngs[j][0].idx, ngs[j][-1].idx + len(ngs[j][-1])], 
-                                "text2": doc[ngs[i][0].i:ngs[i][-1].i+1].text, 
-                                "span2": [ngs[i][0].idx, ngs[i][-1].idx + len(ngs[i][-1])]
-                        })
+        output = {"detections": []}
+        for n, j, i in repeats:
+            ng1, ng2 = tokens[j:j+n], tokens[i:i+n]
+            output["detections"].append({
+                    "text1": doc[ng1[0].i:ng1[-1].i+1].text, 
+                    "span1": [ng1[0].idx, ng1[-1].idx + len(ng1[-1])], 
+                    "text2": doc[ng2[0].i:ng2[-1].i+1].text, 
+                    "span2": [ng2[0].idx, ng2[-1].idx + len(ng2[-1])]
+            })
 
         return output
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections import deque
+
+class SlidingWindowRateLimiter:
+    def __init__(self, rpm=None, tpm=None, window=60.0):
+        '''
+        Initialize the rate limiter, which enforces request and token budgets over a sliding window.
+
+        args:
+            rpm (int or None) - requests per window, unlimited if None (default = None)
+            tpm (int or None) - tokens per window, unlimited if None (default = None)
+            window (float) - window length in seconds (default = 60.0)
+        '''
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+
+        # Each entry is [time, tokens, in_window]
+        self.entries = deque()
+        self.tokens_in_window = 0
+
+        # The lock is bound to the event loop it is first used in, so it is created per loop
+        self.lock = None
+        self.loop = None
+
+    def _purge(self, now):
+        '''
+        Drop requests that have left the window.
+        '''
+        while self.entries and self.entries[0][0] <= now - self.window:
+            entry = self.entries.popleft()
+            entry[2] = False
+            self.tokens_in_window -= entry[1]
+
+    def _fits(self, tokens):
+        if self.rpm is not None and len(self.entries) + 1 > self.rpm:
+            return False
+        if self.tpm is not None and self.entries and self.tokens_in_window + tokens > self.tpm:
+            return False
+        return True
+
+    async def acquire(self, tokens):
+        '''
+        Wait until a request of the given size fits in the window, then reserve it.
+
+        args:
+            tokens (int) - estimated tokens used by the request
+
+        return:
+            (list) reservation to pass to settle once the actual usage is known
+        '''
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.lock = asyncio.Lock()
+            self.loop = loop
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._purge(now)
+                if self._fits(tokens):
+                    entry = [now, tokens, True]
+                    self.entries.append(entry)
+                    self.tokens_in_window += tokens
+                    return entry
+
+                # Wait for the oldest request to leave the window
+                await asyncio.sleep(max(self.entries[0][0] + self.window - now, 0.01))
+
+    def settle(self, entry, tokens):
+        '''
+        Replace the estimated token count of a reservation with the actual usage.
+
+        args:
+            entry (list) - reservation returned by acquire
+            tokens (int) - actual tokens used by the request
+        '''
+        if entry[2]:
+            self.tokens_in_window += tokens - entry[1]
+        entry[1] = tokens
@@ -0,0 +1,273 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Parts of speech of the repetition rate features
+POS = ["ADJ", "ADP", "ADV", "AUX", "CCONJ", "DET", "INTJ", "NOUN", "NUM", "PART", "PRON", "PROPN", "SCONJ", "VERB", "X"]
+
+UTTERANCE_COLUMNS = ["visit", "utt", "speaker", "scored", "n_words", "start_ms", "end_ms"]
+DETECTION_COLUMNS = ["visit", "utt", "start_char", "end_char", "type", "word_pos", "POS"]
+SILENCE_COLUMNS = ["visit", "utt", "start_ms", "end_ms"]
+
+# Span key of the detections of each detector type
+SPAN_KEYS = {"repetition": "span1"}
+
+def _span(det, span_key):
+    '''
+    Get the character span of a detection, NaN if it is missing or malformed (e.g. from an LLM).
+    '''
+    span = det.get(span_key) if isinstance(det, dict) else None
+    if isinstance(span, (list, tuple)) and len(span) == 2 and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in span):
+        return span
+    return (np.nan, np.nan)
+
+def flatten_detections(outputs, visits, utts, det_type, word_pos=None, pos=None):
+    '''
+    Flatten the detect outputs of many utterances into one row per detection.
+
+    args:
+        outputs (iterable<dict or None>) - detect output of each utterance, None or NaN if it was not scored
+        visits (iterable) - visit of each utterance
+        utts (iterable) - utterance key of each utterance
+        det_type (str) - detector type, e.g. "filler", "vague" or "repetition"
+        word_pos (iterable<list or None> or None) - word position of each detection of each utterance (default = None)
+        pos (iterable<list or None> or None) - part of speech of each detection of each utterance (default = None)
+
+    return:
+        (pd.DataFrame) detections with DETECTION_COLUMNS, start_char and end_char NaN where a
+        detection has no well-formed span
+    '''
+    span_key = SPAN_KEYS.get(det_type, "span")
+    word_pos = itertools.repeat(None) if word_pos is None else word_pos
+    pos = itertools.repeat(None) if pos is None else pos
+
+    rows_visit, rows_utt, spans, rows_word_pos, rows_pos = [], [], [], [], []
+    for visit, utt, output, utt_word_pos, utt_pos in zip(visits, utts, outputs, word_pos, pos):
+        if not isinstance(output, dict):
+            continue
+        n_dets = len(output["detections"])
+        rows_visit.extend([visit] * n_dets)
+        rows_utt.extend([utt] * n_dets)
+        spans.extend(_span(det, span_key) for det in output["detections"])
+        rows_word_pos.extend([np.nan] * n_dets if utt_word_pos is None else utt_word_pos)
+        rows_pos.extend([None] * n_dets if utt_pos is None else utt_pos)
+
+    spans = np.array(spans, dtype=float).reshape(-1, 2)
+    dets = pd.DataFrame({
+        "visit": pd.Series(rows_visit, dtype=object),
+        "utt": pd.Series(rows_utt, dtype=object),
+        "start_char": spans[:, 0],
+        "end_char": spans[:, 1],
+        "type": det_type,
+        "word_pos": np.array(rows_word_pos, dtype=float),
+        "POS": pd.Series(rows_pos, dtype=object),
+    })
+    return dets[DETECTION_COLUMNS]
+
+def flatten_results(results, speaker="Patient"):
+    '''
+    Flatten Pipeline utterance results into columnar tables.
+
+    args:
+        results (iterable<dict>) - utterance results from Pipeline.run
+        speaker (str or None) - speaker whose utterances are scored, all if None (default = "Patient")
+
+    return:
+        (tuple<pd.DataFrame>) utterances with UTTERANCE_COLUMNS, detections with DETECTION_COLUMNS and
+        silences with SILENCE_COLUMNS
+    '''
+    results = [dict(result, utt=result.get("utt", i)) for i, result in enumerate(results)]
+    utts = pd.DataFrame({
+        "visit": pd.Series([result["visit"] for result in results], dtype=object),
+        "utt": pd.Series([result["utt"] for result in results], dtype=object),
+        "speaker": pd.Series([result.get("speaker") for result in results], dtype=object),
+        "n_words": np.array([result.get("n_words", 0) for result in results], dtype=np.int64),
+        "start_ms": np.array([result.get("start_ms", np.nan) for result in results], dtype=float),
+        "end_ms": np.array([result.get("end_ms", np.nan) for result in results], dtype=float),
+    })
+    utts["scored"] = True if speaker is None else (utts["speaker"] == speaker).to_numpy()
+    utts = utts[UTTERANCE_COLUMNS]
+
+    dets = []
+    for det_type in ["filler", "vague", "repetition", "llm"]:
+        has_type = [result for result in results if det_type in result]
+        if not has_type:
+            continue
+        dets.append(flatten_detections(
+            [result[det_type] for result in has_type],
+            [result["visit"] for result in has_type],
+            [result["utt"] for result in has_type],
+            det_type,
+            word_pos=[result.get(f"{det_type}_word_pos") for result in has_type],
+            pos=[result.get(f"{det_type}_pos") for result in has_type]
+        ))
+    dets = pd.concat(dets, ignore_index=True) if dets else pd.DataFrame(columns=DETECTION_COLUMNS)
+
+    with_silences = [result for result in results if len(result.get("silences", [])) > 0]
+    silence_spans = np.concatenate([np.asarray(result["silences"], dtype=float).reshape(-1, 2) for result in with_silences] + [np.zeros((0, 2))])
+    silences = pd.DataFrame({
+        "visit": pd.Series([result["visit"] for result in with_silences for _ in result["silences"]], dtype=object),
+        "utt": pd.Series([result["utt"] for result in with_silences for _ in result["silences"]], dtype=object),
+        "start_ms": silence_spans[:, 0],
+        "end_ms": silence_spans[:, 1],
+    })
+    return utts, dets, silences
+
+def threshold_counts(codes, n_groups, durations, thresholds):
+    '''
+    Count and sum the durations of each group that are at least each threshold, with one sort
+    and one vectorized binary search for the whole (group, threshold) grid.
+
+    args:
+        codes (np.ndarray) - group code of each duration, in [0, n_groups)
+        n_groups (int) - number of groups
+        durations (np.ndarray) - non-negative durations
+        thresholds (array-like) - minimum durations
+
+    return:
+        (tuple<np.ndarray>) counts and total durations, each of shape (n_groups, len(thresholds))
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    durations = np.asarray(durations, dtype=float)
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    # Sort by group then duration, a group offset per key keeps the groups apart in one sorted array
+    span = max(durations.max(initial=0), thresholds.max(initial=0)) + 1
+    keys = codes * span + durations
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    cum_durations = np.concatenate([[0], np.cumsum(durations[order])])
+
+    groups = np.arange(n_groups)
+    group_ends = np.searchsorted(keys, (groups + 1) * span, side="left")
+    firsts = np.searchsorted(keys, groups[:, None] * span + thresholds[None, :], side="left")
+
+    counts = group_ends[:, None] - firsts
+    totals = cum_durations[group_ends][:, None] - cum_durations[firsts]
+    return counts, totals
+
+def _rates(num, den, scale=100):
+    num = np.asarray(num, dtype=float)
+    den = np.asarray(den, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den > 0, scale * num / np.where(den > 0, den, 1), np.nan)
+
+def visit_features(utts, dets, silences=None, silence_lens=None, det_types=("filler", "vague", "repetition"), pos=True):
+    '''
+    Compute the features of every visit with grouped array operations.
+
+    args:
+        utts (pd.DataFrame) - utterances with UTTERANCE_COLUMNS
+        dets (pd.DataFrame) - detections with DETECTION_COLUMNS
+        silences (pd.DataFrame or None) - silences assigned to utterances with SILENCE_COLUMNS (default = None)
+        silence_lens (list<int> or None) - minimum silence durations (ms) of the silence features (default = None)
+        det_types (iterable<str>) - detector types to compute features for (default = ("filler", "vague", "repetition"))
+        pos (bool) - compute the part of speech repetition rates (default = True)
+
+    return:
+        (pd.DataFrame) features indexed by visit
+            - "n_utts", "n_words" : number of scored utterances and words
+            - "kw_filler_rate", "kw_mean_IFD", "kw_std_IFD" : filler rate and inter-filler distance stats
+            - "kw_vague_term_rate", "kw_vague_utt_ratio" : vague term rate and ratio of vague utterances
+            - "unia_repetition_rate", "unia_<POS>_rep_rate" : repetition rate overall and by part of speech
+            - "llm_rate" : LLM detection rate
+            - "norm_silence_count_<len>", "norm_sums_<len>" : silence count and duration over speaking time
+    '''
+    scored = utts[utts["scored"].to_numpy(dtype=bool)]
+    visits = pd.Index(pd.unique(utts["visit"]), name="visit")
+    utt_codes = visits.get_indexer(scored["visit"])
+    n_visits = len(visits)
+
+    n_utts = np.bincount(utt_codes, minlength=n_visits)
+    n_words = np.bincount(utt_codes, weights=scored["n_words"].to_numpy(dtype=float), minlength=n_visits)
+    features = {"n_utts": n_utts, "n_words": n_words.astype(np.int64)}
+
+    # Only detections of scored utterances count
+    scored_keys = pd.MultiIndex.from_arrays([scored["visit"], scored["utt"]])
+    dets = dets[pd.MultiIndex.from_arrays([dets["visit"], dets["utt"]]).isin(scored_keys)] if len(dets) else dets
+    det_codes = visits.get_indexer(dets["visit"])
+    det_types_col = dets["type"].to_numpy()
+
+    def type_counts(det_type):
+        return np.bincount(det_codes[det_types_col == det_type], minlength=n_visits)
+
+    if "filler" in det_types:
+        features["kw_filler_rate"] = _rates(type_counts("filler"), n_words)
+
+        # Inter-filler distances between consecutive fillers of the same utterance
+        fillers = dets[det_types_col == "filler"].dropna(subset=["word_pos"])
+        fillers = fillers.assign(code=visits.get_indexer(fillers["visit"]), utt_code=pd.factorize(fillers["utt"])[0])
+        fillers = fillers.sort_values(["code", "utt_code", "word_pos"], kind="stable")
+        code, utt_code, word_pos = (fillers[col].to_numpy() for col in ["code", "utt_code", "word_pos"])
+        same_utt = (code[1:] == code[:-1]) & (utt_code[1:] == utt_code[:-1])
+        ifds = (word_pos[1:] - word_pos[:-1] - 1)[same_utt]
+        ifd_codes = code[1:][same_utt]
+
+        ifd_n = np.bincount(ifd_codes, minlength=n_visits)
+        ifd_sum = np.bincount(ifd_codes, weights=ifds, minlength=n_visits)
+        ifd_sq = np.bincount(ifd_codes, weights=ifds ** 2, minlength=n_visits)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_ifd = np.where(ifd_n > 0, ifd_sum / np.maximum(ifd_n, 1), np.nan)
+            features["kw_mean_IFD"] = mean_ifd
+            features["kw_std_IFD"] = np.sqrt(np.maximum(np.where(ifd_n > 0, ifd_sq / np.maximum(ifd_n, 1), np.nan) - mean_ifd ** 2, 0))
+
+    if "vague" in det_types:
+        features["kw_vague_term_rate"] = _rates(type_counts("vague"), n_words)
+        vague = dets[det_types_col == "vague"].drop_duplicates(subset=["visit", "utt"])
+        features["kw_vague_utt_ratio"] = _rates(np.bincount(visits.get_indexer(vague["visit"]), minlength=n_visits), n_utts)
+
+    if "repetition" in det_types:
+        features["unia_repetition_rate"] = _rates(type_counts("repetition"), n_words)
+        if pos:
+            reps = dets[det_types_col == "repetition"]
+            pos_codes = pd.Index(POS).get_indexer(reps["POS"])
+            known = pos_codes >= 0
+            pos_counts = np.bincount(det_codes[det_types_col == "repetition"][known] * len(POS) + pos_codes[known], minlength=n_visits * len(POS))
+            pos_counts = pos_counts.reshape(n_visits, len(POS))
+            for i, p in enumerate(POS):
+                features[f"unia_{p}_rep_rate"] = _rates(pos_counts[:, i], n_words)
+
+    if "llm" in det_types:
+        features["llm_rate"] = _rates(type_counts("llm"), n_words)
+
+    if silence_lens is not None:
+        # Normalized by the speaking time of the scored speaker
+        speaking_time = np.bincount(utt_codes, weights=(scored["end_ms"] - scored["start_ms"]).to_numpy(dtype=float), minlength=n_visits)
+        if silences is None:
+            silences = pd.DataFrame(columns=SILENCE_COLUMNS)
+        silences = silences[pd.MultiIndex.from_arrays([silences["visit"], silences["utt"]]).isin(scored_keys)] if len(silences) else silences
+        counts, totals = threshold_counts(
+            visits.get_indexer(silences["visit"]),
+            n_visits,
+            (silences["end_ms"] - silences["start_ms"]).to_numpy(dtype=float),
+            silence_lens
+        )
+        for i, silence_len in enumerate(silence_lens):
+            features[f"norm_silence_count_{silence_len}"] = _rates(counts[:, i], speaking_time, scale=1)
+            features[f"norm_sums_{silence_len}"] = _rates(totals[:, i], speaking_time, scale=1)
+
+    return pd.DataFrame(features, index=visits)
+
+def impute_ifd(features, fit_index=None, prefix="kw"):
+    '''
+    Impute the inter-filler distance features of visits with fewer than two fillers in an utterance.
+    The mean distance is min-max scaled, then set to 1 (fillers far apart) where missing, the standard
+    deviation is set to 0 where missing.
+
+    args:
+        features (pd.DataFrame) - features from visit_features
+        fit_index (list or None) - visits the scaling is fit on, e.g. the training visits, all if None (default = None)
+        prefix (str) - feature name prefix (default = "kw")
+
+    return:
+        (pd.DataFrame) features with "<prefix>_mean_IFD_imp" and "<prefix>_std_IFD_imp" added
+    '''
+    features = features.copy()
+    mean_ifd = features[f"{prefix}_mean_IFD"]
+    fit = mean_ifd if fit_index is None else mean_ifd.loc[fit_index]
+    lo, hi = fit.min(), fit.max()
+    scale = hi - lo if hi > lo else 1.0
+
+    features[f"{prefix}_mean_IFD_imp"] = ((mean_ifd - lo) / scale).fillna(1.0)
+    features[f"{prefix}_std_IFD_imp"] = features[f"{prefix}_std_IFD"].fillna(0)
+    return features
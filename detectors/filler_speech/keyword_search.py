@@ -1,26 +1,37 @@
+import numpy as np
+from utils import doc_word_mask
 from ..common_detectors.keyword_detector import KeywordDetector
 from .keywords_config import keywords as default_keywords
 
 class FillerKeywordDetector(KeywordDetector):
-    def __init__(self, nlp, keywords=default_keywords, flag_nonwords=False):
+    category = "filler"
+
+    def __init__(self, nlp, keywords=default_keywords, flag_nonwords=False, doc_cache=None, engine=None):
         '''
         Initializes the FillerKeywordDetector class.
 
         args:
             nlp (spacy.lang) - spaCy language model
             keywords (list) - list of keywords to detect
-            flag_nonwords (bool) - flag nonwords as filler
+            flag_nonwords (bool) - flag nonwords as filler, needs a model with vectors
+            doc_cache (DocCache) - shared parse cache (default = None)
+            engine (KeywordEngine) - keyword engine shared with other keyword detectors (default = None)
         '''
-        super().__init__(nlp, keywords)
+        super().__init__(nlp, keywords, doc_cache=doc_cache, engine=engine)
         self.flag_nonwords = flag_nonwords
 
-    def detect(self, text):
+        # Nonwords are out-of-vocabulary tokens, every token is out of vocabulary without vectors
+        if self.flag_nonwords and len(self.nlp.vocab.vectors) == 0:
+            raise ValueError("flag_nonwords needs a spaCy model with vectors, e.g. en_core_web_md")
+
+    def detect_doc(self, doc):
         '''
-        Extends parent class detect method to also  
+        Extends parent class detect_doc method to also flag nonwords as filler
         '''
-        output, doc = super().detect(text, return_doc=True)
+        output = super().detect_doc(doc)
 
         if self.flag_nonwords:
-            output["detections"].extend([{"text": token.text, "span": [token.idx, token.idx + len(token)]} for token in doc if token.is_oov and not (token.is_punct or token.is_space or token._.is_silence_tag or token._.is_inaudible_tag or token._.is_event_tag)])
+            words = [doc[i] for i in np.flatnonzero(doc_word_mask(doc))]
+            output["detections"].extend([{"text": token.text, "span": [token.idx, token.idx + len(token)]} for token in words if token.is_oov])
 
         return output
@@ -0,0 +1,271 @@
+import itertools
+import numpy as np
+from utils import doc_word_mask
+from . import features as F
+from .common_detectors.keyword_engine import KeywordEngine
+from .filler_speech.keyword_search import FillerKeywordDetector
+from .vague_speech.keyword_search import VagueKeywordDetector
+from .repetitive_speech.unigram_analysis import UnigramAnalysisDetector
+from .speech_delays.interval_join import assign_silences
+
+# Trained spaCy components that tag the parts of speech of repetitions
+POS_COMPONENTS = ["tagger", "attribute_ruler"]
+
+class Pipeline:
+    def __init__(self, nlp, filler_detector=None, vague_detector=None, repetition_detector=None, llm_detector=None, silence_lens=None, speaker="Patient", doc_cache=None, batch_size=1000):
+        '''
+        Initialize the WATCH-SS scoring pipeline. Every utterance is parsed once and the parsed doc is
+        shared by the spaCy based detectors, then the utterances of each visit are fused into a feature vector.
+
+        args:
+            nlp (spacy.lang) - spaCy language model
+            filler_detector (FillerKeywordDetector or None) - filler stage, skipped if None (default = None)
+            vague_detector (VagueKeywordDetector or None) - vague speech stage, skipped if None (default = None)
+            repetition_detector (UnigramAnalysisDetector or None) - repetition stage, skipped if None (default = None)
+            llm_detector (LLMDetector or None) - LLM stage run with detect_batch on the utterances of each visit, skipped if None (default = None)
+            silence_lens (list<int> or None) - minimum silence durations (ms) of the silence features, no silence stage if None (default = None)
+            speaker (str or None) - speaker whose utterances are scored, all if None (default = "Patient")
+            doc_cache (DocCache or None) - shared parse cache, parses every text if None (default = None)
+            batch_size (int) - nlp.pipe batch size (default = 1000)
+        '''
+        self.nlp = nlp
+        self.filler_detector = filler_detector
+        self.vague_detector = vague_detector
+        self.repetition_detector = repetition_detector
+        self.llm_detector = llm_detector
+        self.silence_lens = None if silence_lens is None else sorted(silence_lens)
+        self.speaker = speaker
+        self.doc_cache = doc_cache
+        self.batch_size = batch_size
+
+        # Parts of speech are only available if the pipeline tags them
+        self.tag_pos = all(c in self.nlp.pipe_names for c in POS_COMPONENTS)
+
+    @classmethod
+    def required_components(cls, comparator="exact", pos=True):
+        '''
+        Get the trained spaCy components the default pipeline needs, for create_custom_nlp.
+
+        args:
+            comparator (str) - comparator of the repetition detector (default = "exact")
+            pos (bool) - tag the parts of speech of repetitions (default = True)
+
+        return:
+            (list) component names
+        '''
+        components = FillerKeywordDetector.required_components() + VagueKeywordDetector.required_components()
+        components += UnigramAnalysisDetector.required_components(comparator=comparator)
+        if pos:
+            components += POS_COMPONENTS
+        return sorted(set(components))
+
+    @classmethod
+    def default(cls, nlp, llm_detector=None, silence_lens=None, speaker="Patient", doc_cache=None, batch_size=1000):
+        '''
+        Create the pipeline with the default filler, vague and unigram repetition detectors,
+        the keyword detectors sharing one keyword engine.
+
+        args:
+            nlp (spacy.lang) - spaCy language model
+            llm_detector (LLMDetector or None) - optional LLM stage (default = None)
+            silence_lens (list<int> or None) - optional minimum silence durations (ms) (default = None)
+            speaker (str or None) - speaker whose utterances are scored (default = "Patient")
+            doc_cache (DocCache or None) - shared parse cache (default = None)
+            batch_size (int) - nlp.pipe batch size (default = 1000)
+
+        return:
+            (Pipeline) pipeline
+        '''
+        engine = KeywordEngine(nlp)
+        return cls(
+            nlp,
+            filler_detector=FillerKeywordDetector(nlp, engine=engine),
+            vague_detector=VagueKeywordDetector(nlp, engine=engine),
+            repetition_detector=UnigramAnalysisDetector(nlp),
+            llm_detector=llm_detector,
+            silence_lens=silence_lens,
+            speaker=speaker,
+            doc_cache=doc_cache,
+            batch_size=batch_size
+        )
+
+    @staticmethod
+    def records_from_frame(transcripts, visit_levels=("split", "ID"), text_col="Transcript_clean"):
+        '''
+        Stream utterance records from a transcript frame, e.g. from data.adress.load_transcripts.
+
+        args:
+            transcripts (pd.DataFrame) - transcripts sorted by visit, with Speaker, T_start_ms and T_end_ms columns
+            visit_levels (tuple<str>) - index levels identifying a visit (default = ("split", "ID"))
+            text_col (str) - text column (default = "Transcript_clean")
+
+        return:
+            (generator<dict>) utterance records
+        '''
+        visit_pos = [transcripts.index.names.index(level) for level in visit_levels]
+        cols = [text_col, "Speaker", "T_start_ms", "T_end_ms"]
+        for index, text, speaker, start_ms, end_ms in transcripts[cols].itertuples(name=None):
+            index = index if isinstance(index, tuple) else (index,)
+            yield {
+                "visit": tuple(index[i] for i in visit_pos) if len(visit_pos) > 1 else index[visit_pos[0]],
+                "utt": index,
+                "text": text,
+                "speaker": speaker,
+                "start_ms": start_ms,
+                "end_ms": end_ms,
+            }
+
+    def _is_scored(self, record):
+        return self.speaker is None or record.get("speaker") == self.speaker
+
+    def _parse_many(self, texts):
+        if self.doc_cache is not None:
+            return self.doc_cache.pipe(texts, batch_size=self.batch_size)
+        return self.nlp.pipe(texts, batch_size=self.batch_size)
+
+    def _annotate(self, record, doc):
+        '''
+        Run the spaCy based detectors on the parsed doc of an utterance.
+
+        return:
+            (dict) utterance result
+        '''
+        result = dict(record)
+        result.pop("text", None)
+        if not self._is_scored(record):
+            return result
+
+        word_idxs = np.flatnonzero(doc_word_mask(doc))
+        result["n_words"] = len(word_idxs)
+
+        # Word position of each token start, for inter-filler distances and repetition parts of speech
+        word_pos = {doc[i].idx: (k, doc[i]) for k, i in enumerate(word_idxs)}
+
+        if self.filler_detector is not None:
+            output = self.filler_detector.detect_doc(doc)
+            result["filler"] = output
+            result["filler_word_pos"] = [word_pos[det["span"][0]][0] if det["span"][0] in word_pos else np.nan for det in output["detections"]]
+
+        if self.vague_detector is not None:
+            result["vague"] = self.vague_detector.detect_doc(doc)
+
+        if self.repetition_detector is not None:
+            output = self.repetition_detector.detect_doc(doc)
+            result["repetition"] = output
+            if self.tag_pos:
+                result["repetition_pos"] = [word_pos[det["span1"][0]][1].pos_ if det["span1"][0] in word_pos else None for det in output["detections"]]
+
+        return result
+
+    def _run_llm(self, results, texts):
+        scored = [i for i, result in enumerate(results) if self._is_scored(result)]
+        if not scored:
+            return
+        outputs = self.llm_detector.detect_batch([texts[i] for i in scored], ids=[str(results[i].get("utt", i)) for i in scored])
+        for i, output in zip(scored, outputs):
+            results[i]["llm"] = output
+
+    def _run_silences(self, results, silences):
+        '''
+        Assign the silences to the first scored utterance they overlap.
+        '''
+        silences = np.asarray(silences, dtype=float).reshape(-1, 2)
+        scored = [i for i, result in enumerate(results) if self._is_scored(result)]
+        if not scored:
+            return
+        starts = np.array([results[i]["start_ms"] for i in scored], dtype=float)
+        ends = np.array([results[i]["end_ms"] for i in scored], dtype=float)
+
+        first = assign_silences(np.zeros(len(scored)), starts, ends, np.zeros(len(silences)), silences[:, 0], silences[:, 1])
+        for k, i in enumerate(scored):
+            results[i]["silences"] = silences[first == k]
+
+    def _run_visits(self, records, silences=None):
+        '''
+        Run every stage, yielding the utterance results of one visit at a time.
+
+        args:
+            records (iterable<dict>) - utterance records sorted by visit
+            silences (dict or None) - silence intervals [start_ms, end_ms] of each visit (default = None)
+
+        return:
+            (generator<tuple>) visit and its utterance results
+        '''
+        records, parse_records = itertools.tee(records)
+        docs = self._parse_many(record["text"] if self._is_scored(record) else "" for record in parse_records)
+
+        annotated = ((record, self._annotate(record, doc)) for record, doc in zip(records, docs))
+        for visit, group in itertools.groupby(annotated, key=lambda pair: pair[1]["visit"]):
+            group = list(group)
+            results = [result for _, result in group]
+
+            if self.llm_detector is not None:
+                self._run_llm(results, [record["text"] for record, _ in group])
+
+            if self.silence_lens is not None and silences is not None and visit in silences:
+                self._run_silences(results, silences[visit])
+
+            yield visit, results
+
+    def run(self, records, silences=None):
+        '''
+        Score utterances.
+
+        args:
+            records (iterable<dict>) - utterance records sorted by visit, each with keys "visit", "text", and
+                optionally "utt", "speaker", "start_ms" and "end_ms" (needed by the silence stage)
+            silences (dict or None) - silence intervals [start_ms, end_ms] of each visit (default = None)
+
+        return:
+            (generator<dict>) utterance results in input order, the record fields plus
+                - "n_words" : number of words
+                - "filler", "vague", "repetition", "llm" : detect output of each stage that ran
+                - "filler_word_pos" : word position of each filler
+                - "repetition_pos" : part of speech of each repetition
+                - "silences" : silences [start_ms, end_ms] first overlapping the utterance
+        '''
+        for _, results in self._run_visits(records, silences):
+            yield from results
+
+    def _det_types(self):
+        stages = [("filler", self.filler_detector), ("vague", self.vague_detector), ("repetition", self.repetition_detector), ("llm", self.llm_detector)]
+        return [det_type for det_type, detector in stages if detector is not None]
+
+    def feature_frame(self, results):
+        '''
+        Fuse utterance results into the feature vectors of their visits, with the grouped operations of detectors.features.
+
+        args:
+            results (iterable<dict>) - utterance results from run
+
+        return:
+            (pd.DataFrame) features indexed by visit, see detectors.features.visit_features
+        '''
+        utts, dets, silences = F.flatten_results(results, speaker=self.speaker)
+        return F.visit_features(utts, dets, silences, silence_lens=self.silence_lens, det_types=self._det_types(), pos=self.tag_pos)
+
+    def visit_features(self, results):
+        '''
+        Fuse the utterance results of one visit into its feature vector.
+
+        args:
+            results (list<dict>) - utterance results of the visit
+
+        return:
+            (dict) features
+        '''
+        return self.feature_frame(results).to_dict("records")[0]
+
+    def features(self, records, silences=None):
+        '''
+        Score utterances and stream the feature vector of each visit, holding one visit in memory at a time.
+
+        args:
+            records (iterable<dict>) - utterance records sorted by visit, see run
+            silences (dict or None) - silence intervals [start_ms, end_ms] of each visit (default = None)
+
+        return:
+            (generator<tuple>) visit and its features
+        '''
+        for visit, results in self._run_visits(records, silences):
+            yield visit, self.visit_features(results)
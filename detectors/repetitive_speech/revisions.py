@@ -1,8 +1,86 @@
+import numpy as np
+from ..common_detectors.ngram_analysis import NgramAnalysis
+from ..common_detectors.embedding_backend import SBERTEmbeddingBackend, SpacyEmbeddingBackend
 # similarity modules
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
-   def _compare_ngrams_spaCy_sim(self, ng1, ng2, doc=None, sim_threshold=0.9):
+class RevisionAnalysisDetector(NgramAnalysis):
+    def __init__(self, nlp, max_N=3, window_size=5, comparator="SBERT_sim", sim_threshold=0.9, sbert_model="all-MiniLM-L6-v2", embedding_backend=None, doc_cache=None):
+        '''
+        Initialize the detector.
+
+        args:
+            nlp (spacy.lang) : spacy language model
+            max_N (int) : maximum N-gram size, default = 3
+            window_size (int) : window size for checking previous n-grams, default = 5
+            comparator (str) : similarity function for n-grams, "spaCy_sim" or "SBERT_sim", default = "SBERT_sim"
+            sim_threshold (float) : similarity threshold, default = 0.9
+            sbert_model (str) : Sentence BERT model name, default = "all-MiniLM-L6-v2"
+            embedding_backend (EmbeddingBackend) : shared embedding backend, created from the comparator if None, default = None
+            doc_cache (DocCache) : shared parse cache, default = None
+        '''
+        self.comparator = comparator
+        self.sim_threshold = sim_threshold
+        super().__init__(nlp, max_N=max_N, window_size=window_size, doc_cache=doc_cache)
+
+        if embedding_backend is None:
+            if self.comparator == "SBERT_sim":
+                embedding_backend = SBERTEmbeddingBackend(sbert_model)
+            elif self.comparator == "spaCy_sim":
+                embedding_backend = SpacyEmbeddingBackend(self.nlp)
+            else:
+                raise ValueError("Invalid comparator. Options are [\"spaCy_sim\", \"SBERT_sim\"]")
+        self.embedding_backend = embedding_backend
+        self.sbert = getattr(self.embedding_backend, "sbert", None)
+
+    def _ngram_text(self, ng, doc):
+        '''
+        Get the text embedded for an n-gram, matching the per-pair comparators.
+        '''
+        if self.comparator == "SBERT_sim":
+            return doc[ng[0].i:ng[-1].i+1].text
+        return " ".join(token.text for token in ng)
+
+    def _find_repeats(self, doc, word_idxs, tokens):
+        '''
+        Find similar n-grams by embedding all distinct n-grams of the doc in one batch
+        and computing the windowed similarities over normalized embeddings.
+
+        args:
+            doc (spacy.Doc) : spacy document
+            word_idxs (np.ndarray) : doc indices of the filtered tokens
+            tokens (list<spacy.Token>) : filtered tokens
+
+        return:
+            (list<tuple<int, int, int>>) : same as _find_repeats_pairwise
+        '''
+        repeats = []
+        for n in range(1, self.max_N+1):
+            ngs = self._ngrams(tokens, n)
+            if len(ngs) <= n:
+                continue
+
+            embs = self.embedding_backend.encode([self._ngram_text(ng, doc) for ng in ngs])
+
+            # sims[i, k] is the similarity of n-gram i with n-gram i - d, for offsets d = window_size, ..., n
+            offsets = np.arange(min(self.window_size, len(ngs) - 1), n - 1, -1)
+            sims = np.full((len(ngs), len(offsets)), -np.inf, dtype=np.float32)
+            for k, d in enumerate(offsets):
+                sims[d:, k] = np.einsum("ij,ij->i", embs[d:], embs[:-d])
+
+            # Row-major order gives i ascending, then j = i - d ascending
+            for i, k in zip(*np.nonzero(sims >= self.sim_threshold)):
+                repeats.append((n, int(i - offsets[k]), int(i)))
+
+        return repeats
+
+    def _compare_ngrams(self, ng1, ng2, doc):
+        if self.comparator == "spaCy_sim":
+            return self._compare_ngrams_spaCy_sim(ng1, ng2, doc, sim_threshold=self.sim_threshold)
+        elif self.comparator == "SBERT_sim":
+            return self._compare_ngrams_SBERT_sim(ng1, ng2, doc, sim_threshold=self.sim_threshold)
+
+    def _compare_ngrams_spaCy_sim(self, ng1, ng2, doc=None, sim_threshold=0.9):
         '''
         Compare two n-grams using spaCy embeddings and cosine similarity.
 
@@ -54,6 +132,9 @@ from sklearn.metrics.pairwise import cosine_similarity
         return:
             (list<tuple[tuple[int, int], tuple[int, int]]>) list of merged spans
         '''
+        if not repetitions:
+            return []
+
         # Sort the spans by start index
         sorted_reps = sorted(repetitions, key=lambda x: (x[1][0], -x[1][1]))
 
@@ -62,12 +143,12 @@ from sklearn.metrics.pairwise import cosine_similarity
         filtered_reps.append(sorted_reps[0])
 
         for curr_rep in sorted_reps[1:]:
-            last_kept_rep_span = filtered_results[-1][1]
+            last_kept_rep_span = filtered_reps[-1][1]
             curr_rep_span = curr_rep[1]
 
             if (curr_rep_span[0] >= last_kept_rep_span[0]) and (curr_rep_span[1] <= last_kept_rep_span[1]):
                 continue
             else:
-                filtered_results.append(current_pair)
+                filtered_reps.append(curr_rep)
 
-        return filtered_reps
\ No newline at end of file
+        return filtered_reps
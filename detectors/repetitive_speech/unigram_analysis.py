@@ -1,7 +1,20 @@
+from spacy.attrs import LEMMA, LOWER
+from utils import check_components
 from ..common_detectors.ngram_analysis import NgramAnalysis
 
 class UnigramAnalysisDetector(NgramAnalysis):
-    def __init__(self, nlp, window_size=2, comparator="exact"):
+    # Trained spaCy components needed by each comparator
+    comparator_components = {
+        "exact": [],
+        "lemma_exact": ["lemmatizer"],
+    }
+    # Token attribute compared by each exact comparator, enables the hashed search
+    comparator_attrs = {
+        "exact": LOWER,
+        "lemma_exact": LEMMA,
+    }
+
+    def __init__(self, nlp, window_size=2, comparator="exact", doc_cache=None):
         '''
         Initialize the detector.
 
@@ -9,9 +22,28 @@ class UnigramAnalysisDetector(NgramAnalysis):
             nlp (spacy.lang) : spacy language model
             window_size (int) : window size for checking previous unigrams, default = 2
             comparator (str) : comparison function for unigrams, default = "exact" match
+            doc_cache (DocCache) : shared parse cache, default = None
         '''
         self.comparator = comparator
-        super().__init__(nlp, max_N=1, window_size=window_size)
+        super().__init__(nlp, max_N=1, window_size=window_size, doc_cache=doc_cache)
+
+        check_components(self.nlp, self.required_components(comparator=comparator), f"Comparator \"{comparator}\"")
+
+    @classmethod
+    def required_components(cls, comparator="exact", **kwargs):
+        '''
+        Get the trained spaCy components the detector needs, for create_custom_nlp.
+
+        args:
+            comparator (str) : comparison function for unigrams, default = "exact" match
+
+        return:
+            (list) component names
+        '''
+        return list(cls.comparator_components[comparator])
+
+    def _ngram_key_attr(self):
+        return self.comparator_attrs.get(self.comparator)
 
     def _compare_ngrams_exact(self, ng1, ng2, doc=None):
         '''
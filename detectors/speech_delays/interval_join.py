@@ -0,0 +1,148 @@
+import ast
+import numpy as np
+import pandas as pd
+from ..features import threshold_counts
+
+class SilenceIntervals:
+    def __init__(self, visits, starts, ends):
+        '''
+        Detected silences of many visits stored as numeric columns.
+
+        args:
+            visits (array-like) - visit of each silence
+            starts (array-like) - start of each silence (ms)
+            ends (array-like) - end of each silence (ms)
+        '''
+        self.visits = pd.Series(list(visits), dtype=object).to_numpy()
+        self.starts = np.asarray(starts, dtype=float)
+        self.ends = np.asarray(ends, dtype=float)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_lists(cls, silences):
+        '''
+        Convert per-visit silence lists, parsing stringified lists once.
+
+        args:
+            silences (dict or pd.Series) - silences [[start_ms, end_ms], ...] of each visit, as lists,
+                arrays or strings like those written by notebook 06
+
+        return:
+            (SilenceIntervals) silences
+        '''
+        visits, spans = [], []
+        for visit, visit_silences in silences.items():
+            if isinstance(visit_silences, str):
+                visit_silences = ast.literal_eval(visit_silences)
+            visit_silences = np.asarray(visit_silences, dtype=float).reshape(-1, 2)
+            visits.extend([visit] * len(visit_silences))
+            spans.append(visit_silences)
+        spans = np.concatenate(spans + [np.zeros((0, 2))])
+        return cls(visits, spans[:, 0], spans[:, 1])
+
+    @classmethod
+    def from_frame(cls, df):
+        '''
+        Read silences from a frame with visit, start_ms and end_ms columns, e.g. from to_frame.
+        '''
+        return cls(df["visit"], df["start_ms"], df["end_ms"])
+
+    def to_frame(self):
+        '''
+        Get the silences as a frame with visit, start_ms and end_ms columns, which can be stored as Parquet.
+        '''
+        return pd.DataFrame({"visit": self.visits, "start_ms": self.starts, "end_ms": self.ends})
+
+    def durations(self):
+        return self.ends - self.starts
+
+def assign_silences(utt_codes, utt_starts, utt_ends, sil_codes, sil_starts, sil_ends):
+    '''
+    Assign each silence to the first utterance of its visit that it overlaps, closed intervals
+    overlapping like in notebook 06. Utterances are taken in start order within a visit, which is
+    transcript order for time-aligned transcripts.
+
+    args:
+        utt_codes (np.ndarray) - non-negative visit code of each utterance
+        utt_starts (np.ndarray) - start of each utterance (ms), NaN if unknown
+        utt_ends (np.ndarray) - end of each utterance (ms), NaN if unknown
+        sil_codes (np.ndarray) - visit code of each silence, negative for visits without utterances
+        sil_starts (np.ndarray) - start of each silence (ms)
+        sil_ends (np.ndarray) - end of each silence (ms)
+
+    return:
+        (np.ndarray) index of the utterance each silence is assigned to, -1 if it overlaps none
+    '''
+    utt_codes = np.asarray(utt_codes, dtype=np.int64)
+    sil_codes = np.asarray(sil_codes, dtype=np.int64)
+    utt_starts, utt_ends = np.asarray(utt_starts, dtype=float), np.asarray(utt_ends, dtype=float)
+    sil_starts, sil_ends = np.asarray(sil_starts, dtype=float), np.asarray(sil_ends, dtype=float)
+    assigned = np.full(len(sil_codes), -1, dtype=np.int64)
+
+    # Intervals without timestamps (e.g. NaN times of untimed transcripts) never overlap
+    utt_idxs = np.flatnonzero(np.isfinite(utt_starts) & np.isfinite(utt_ends))
+    sil_idxs = np.flatnonzero(np.isfinite(sil_starts) & np.isfinite(sil_ends) & (sil_codes >= 0))
+    if len(utt_idxs) == 0 or len(sil_idxs) == 0:
+        return assigned
+    utt_codes, utt_starts, utt_ends = utt_codes[utt_idxs], utt_starts[utt_idxs], utt_ends[utt_idxs]
+    sil_codes, sil_starts, sil_ends = sil_codes[sil_idxs], sil_starts[sil_idxs], sil_ends[sil_idxs]
+
+    # Offset every visit onto its own stretch of one time axis, so all visits are joined at once
+    lo_time = min(utt_starts.min(), utt_ends.min(), sil_starts.min(), sil_ends.min())
+    span = max(utt_starts.max(), utt_ends.max(), sil_starts.max(), sil_ends.max()) - lo_time + 1
+    utt_offset = utt_codes * span - lo_time
+    sil_offset = sil_codes * span - lo_time
+
+    order = np.lexsort((utt_starts, utt_codes))
+    starts = (utt_starts + utt_offset)[order]
+    max_ends = np.maximum.accumulate((utt_ends + utt_offset)[order])
+
+    # The first utterance in start order ending at or after the silence start is the first one it can overlap
+    first = np.searchsorted(max_ends, sil_starts + sil_offset, side="left")
+    in_range = first < len(order)
+    first = np.minimum(first, len(order) - 1)
+    overlaps = in_range & (utt_codes[order][first] == sil_codes) & (starts[first] <= sil_ends + sil_offset)
+    assigned[sil_idxs[overlaps]] = utt_idxs[order[first[overlaps]]]
+    return assigned
+
+def join_silences(transcripts, silences, thresholds, visit_levels=("split", "ID"), speaker=None):
+    '''
+    Count the silences at least each duration threshold that overlap each utterance, and sum their
+    durations, with one sorted join for every threshold at once. Each silence is counted for the first
+    utterance it overlaps.
+
+    args:
+        transcripts (pd.DataFrame) - transcripts with T_start_ms and T_end_ms columns, e.g. from data.adress.load_transcripts
+        silences (SilenceIntervals) - detected silences, keyed by the same visits as visit_levels
+        thresholds (list<int>) - minimum silence durations (ms)
+        visit_levels (tuple<str>) - index levels identifying a visit (default = ("split", "ID"))
+        speaker (str or None) - only join utterances of this speaker, e.g. "Patient", all if None (default = None)
+
+    return:
+        (tuple<pd.DataFrame>) silence counts and total silence durations (ms), indexed like the
+        joined utterances with one column per threshold
+    '''
+    if speaker is not None:
+        transcripts = transcripts[transcripts["Speaker"] == speaker]
+
+    index = transcripts.index
+    utt_visits = pd.MultiIndex.from_arrays([index.get_level_values(level) for level in visit_levels]) if len(visit_levels) > 1 else index.get_level_values(visit_levels[0])
+    visits = pd.Index(pd.unique(utt_visits))
+    utt_codes = visits.get_indexer(utt_visits)
+    sil_codes = visits.get_indexer(pd.Index(silences.visits, tupleize_cols=len(visit_levels) > 1)) if len(silences) else np.zeros(0, dtype=np.int64)
+
+    assigned = assign_silences(
+        utt_codes,
+        transcripts["T_start_ms"].to_numpy(dtype=float),
+        transcripts["T_end_ms"].to_numpy(dtype=float),
+        sil_codes,
+        silences.starts,
+        silences.ends
+    )
+    valid = assigned >= 0
+    counts, totals = threshold_counts(assigned[valid], len(transcripts), silences.durations()[valid], thresholds)
+
+    columns = pd.Index(list(thresholds), name="min_silence_len")
+    return pd.DataFrame(counts, index=index, columns=columns), pd.DataFrame(totals, index=index, columns=columns)
@@ -2,12 +2,16 @@ from ..common_detectors.keyword_detector import KeywordDetector
 from .keywords_config import keywords as default_keywords
 
 class VagueKeywordDetector(KeywordDetector):
-    def __init__(self, nlp, keywords=default_keywords):
+    category = "vague"
+
+    def __init__(self, nlp, keywords=default_keywords, doc_cache=None, engine=None):
         '''
         Initializes the FillerKeywordDetector class.
 
         args:
             nlp (spacy.lang) - spaCy language model
             keywords (list) - list of keywords to detect
+            doc_cache (DocCache) - shared parse cache (default = None)
+            engine (KeywordEngine) - keyword engine shared with other keyword detectors (default = None)
         '''
-        super().__init__(nlp, keywords)
+        super().__init__(nlp, keywords, doc_cache=doc_cache, engine=engine)
@@ -1,12 +1,19 @@
 import argparse
+import contextlib
+import csv
+import hashlib
+import io
 import json
+import numpy as np
 from pydub import AudioSegment
-from pydub.silence import detect_silence
+from pydub.utils import db_to_float
 from moviepy import VideoFileClip
 import ffmpeg
 import os
 import tempfile
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def process_transcript(transcript_file):
@@ -19,7 +26,561 @@ def process_transcript(transcript_file):
     return transcript
 
 
-def process_audio(audio_file, min_silence_len, silence_thresh):
+def _bin_edges(bins, frame_rate):
+    # First frame of each millisecond bin, computed like pydub slices segments
+    return (np.asarray(bins, dtype=np.int64) * (frame_rate / 1000.0)).astype(np.int64)
+
+
+def _window_starts(seg_len, min_silence_len, seek_step, first=0):
+    # Window starts tested by pydub, the last window is always tested even when it is off the grid
+    last = seg_len - min_silence_len
+    starts = np.arange(first, last + 1, seek_step)
+    if last % seek_step:
+        starts = np.append(starts, last)
+    return starts
+
+
+def _window_rms(cum_energy, starts, min_silence_len, frame_rate, channels, base=0):
+    # RMS of the windows starting at the given bins, computed like audioop.rms
+    energy = cum_energy[starts + min_silence_len - base] - cum_energy[starts - base]
+    n_samples = (_bin_edges(starts + min_silence_len, frame_rate) - _bin_edges(starts, frame_rate)) * channels
+    return np.floor(np.sqrt(energy.astype(np.float64) / np.maximum(n_samples, 1)))
+
+
+def _merge_silent_starts(silent_starts, min_silence_len, seek_step):
+    # Merge the starts of silent windows into silences like pydub's detect_silence
+    if len(silent_starts) == 0:
+        return []
+    prev, cur = silent_starts[:-1], silent_starts[1:]
+
+    # Windows that neither follow the previous one nor overlap it start a new silence
+    breaks = np.flatnonzero((cur != prev + seek_step) & (cur > prev + min_silence_len))
+    range_starts = np.concatenate([silent_starts[:1], cur[breaks]])
+    range_ends = np.concatenate([prev[breaks], silent_starts[-1:]]) + min_silence_len
+    return np.stack([range_starts, range_ends], axis=1).tolist()
+
+
+class EnergyBinner:
+    def __init__(self, frame_rate, channels, max_amplitude):
+        """
+        Reduce interleaved samples to per-millisecond energy bins as they arrive.
+
+        args:
+            frame_rate (int): Sample rate of the audio (Hz).
+            channels (int): Number of interleaved channels.
+            max_amplitude (float): Maximum possible sample amplitude, e.g. 32768 for 16-bit audio.
+        """
+        self.frame_rate = frame_rate
+        self.channels = channels
+
+        # Energies of 8 and 16-bit audio are summed exactly, the cumulative sums may wrap around
+        # since window sums stay far below 2 ** 64. 32-bit audio is summed in floating point like audioop
+        self.dtype = np.uint64 if max_amplitude <= 2 ** 15 else np.float64
+
+        self.n_frames = 0
+        self.pending = np.zeros(0, dtype=self.dtype)  # energy of the frames of the current incomplete bin
+        self.n_bins = 0
+
+    def seg_len(self):
+        # Length of the audio fed so far, computed like pydub's len
+        return round(1000 * (self.n_frames / self.frame_rate))
+
+    def _take_bins(self, n_bins):
+        edges = _bin_edges(np.arange(self.n_bins, self.n_bins + n_bins + 1), self.frame_rate)
+        offsets = np.minimum(edges - edges[0], len(self.pending))
+        pending_cum = np.concatenate([np.zeros(1, dtype=self.dtype), np.cumsum(self.pending)])
+
+        self.pending = self.pending[offsets[-1]:]
+        self.n_bins += n_bins
+        return pending_cum[offsets[1:]] - pending_cum[offsets[:-1]]
+
+    def feed(self, samples):
+        """
+        Add interleaved samples.
+
+        args:
+            samples (np.ndarray): Integer samples, a whole number of frames.
+
+        returns:
+            np.ndarray: Energy of the bins completed by these samples.
+        """
+        energy = np.square(samples.astype(np.int64).astype(self.dtype)).reshape(-1, self.channels).sum(axis=1)
+        self.pending = np.concatenate([self.pending, energy])
+        self.n_frames += len(energy)
+
+        # Bins whose last frame has arrived
+        upper = int(self.n_frames * 1000 / self.frame_rate) + 2
+        edges = _bin_edges(np.arange(self.n_bins + 1, upper + 1), self.frame_rate)
+        return self._take_bins(int(np.searchsorted(edges, self.n_frames, side="right")))
+
+    def finish(self):
+        """
+        Complete the bins up to the end of the audio, missing frames count as zeros like pydub pads slices.
+
+        returns:
+            np.ndarray: Energy of the remaining bins.
+        """
+        return self._take_bins(max(self.seg_len() - self.n_bins, 0))
+
+
+class SilenceScanner:
+    def __init__(self, frame_rate, channels, max_amplitude, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+        """
+        Incremental silence detector with the semantics of pydub's detect_silence. Samples are
+        reduced to per-millisecond energy bins as they arrive, so memory is bounded by the
+        window length rather than the recording length.
+
+        args:
+            frame_rate (int): Sample rate of the audio (Hz).
+            channels (int): Number of interleaved channels.
+            max_amplitude (float): Maximum possible sample amplitude, e.g. 32768 for 16-bit audio.
+            min_silence_len (int): Minimum duration of silence (miliseconds).
+            silence_thresh (float): Volume threshold for detecting silence (dBFS).
+            seek_step (int): Step between tested windows (miliseconds).
+        """
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.min_silence_len = min_silence_len
+        self.seek_step = seek_step
+        self.thresh = db_to_float(silence_thresh) * max_amplitude
+
+        self.binner = EnergyBinner(frame_rate, channels, max_amplitude)
+
+        # Cumulative bin energy, cum_energy[j] is the energy before bin cum_base + j (offset by a constant)
+        self.cum_energy = np.zeros(1, dtype=self.binner.dtype)
+        self.cum_base = 0
+
+        self.next_start = 0
+        self.prev_start = None
+        self.range_start = None
+
+    def _add_bins(self, energy):
+        self.cum_energy = np.concatenate([self.cum_energy, self.cum_energy[-1] + np.cumsum(energy)])
+
+    def _scan(self, starts):
+        if len(starts) == 0:
+            return []
+        L = self.min_silence_len
+        rms = _window_rms(self.cum_energy, starts, L, self.frame_rate, self.channels, self.cum_base)
+        silent_starts = starts[rms <= self.thresh]
+
+        # Drop the energies no later window needs, the last window may start before the next one on the grid
+        keep_from = min(self.next_start, self.binner.n_bins - L) - self.cum_base
+        if keep_from > 0:
+            self.cum_energy = self.cum_energy[keep_from:] - self.cum_energy[keep_from]
+            self.cum_base += keep_from
+
+        return self._merge(silent_starts)
+
+    def _merge(self, silent_starts):
+        if len(silent_starts) == 0:
+            return []
+        if self.prev_start is None:
+            self.range_start = int(silent_starts[0])
+            prev, cur = silent_starts[:-1], silent_starts[1:]
+        else:
+            prev, cur = np.concatenate([[self.prev_start], silent_starts[:-1]]), silent_starts
+        self.prev_start = int(silent_starts[-1])
+
+        # Windows that neither follow the previous one nor overlap it start a new silence
+        breaks = np.flatnonzero((cur != prev + self.seek_step) & (cur > prev + self.min_silence_len))
+        range_starts = [self.range_start] + cur[breaks].tolist()
+        range_ends = (prev[breaks] + self.min_silence_len).tolist()
+        self.range_start = range_starts[-1]
+        return [[s, e] for s, e in zip(range_starts[:-1], range_ends)]
+
+    def feed(self, samples):
+        """
+        Add interleaved samples.
+
+        args:
+            samples (np.ndarray): Integer samples, a whole number of frames.
+
+        returns:
+            list: Silences [start, end] (miliseconds) completed by these samples.
+        """
+        self._add_bins(self.binner.feed(samples))
+
+        # Windows well clear of the end of the audio, whose length is only known once it is complete
+        last = self.binner.n_bins - self.min_silence_len - 2
+        if last < self.next_start:
+            return []
+        starts = np.arange(self.next_start, last + 1, self.seek_step)
+        self.next_start = int(starts[-1]) + self.seek_step
+        return self._scan(starts)
+
+    def finish(self):
+        """
+        Flush the end of the audio.
+
+        returns:
+            list: Remaining silences [start, end] (miliseconds).
+        """
+        seg_len = self.binner.seg_len()
+        if seg_len < self.min_silence_len:
+            return []
+        self._add_bins(self.binner.finish())
+
+        starts = _window_starts(seg_len, self.min_silence_len, self.seek_step, self.next_start)
+        self.next_start = seg_len - self.min_silence_len + 1
+        silences = self._scan(starts)
+
+        if self.prev_start is not None:
+            silences.append([self.range_start, self.prev_start + self.min_silence_len])
+            self.prev_start = None
+        return silences
+
+
+class EnergyProfile:
+    def __init__(self, bin_energy, frame_rate, channels, max_amplitude):
+        """
+        Per-millisecond energy of a whole recording. Any window RMS is a difference of two
+        cumulative sums, so silences can be detected for many parameters without touching the samples again.
+
+        args:
+            bin_energy (np.ndarray): Energy of each millisecond bin, as produced by EnergyBinner.
+            frame_rate (int): Sample rate of the audio (Hz).
+            channels (int): Number of interleaved channels.
+            max_amplitude (float): Maximum possible sample amplitude, e.g. 32768 for 16-bit audio.
+        """
+        self.bin_energy = bin_energy
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.max_amplitude = max_amplitude
+        self.seg_len = len(bin_energy)
+        self.cum_energy = np.concatenate([np.zeros(1, dtype=bin_energy.dtype), np.cumsum(bin_energy)])
+
+    @classmethod
+    def from_samples(cls, samples, frame_rate, channels, max_amplitude):
+        """
+        Build the profile of interleaved samples.
+
+        args:
+            samples (iterable<np.ndarray>): Chunks of integer samples, each a whole number of frames.
+            frame_rate (int): Sample rate of the audio (Hz).
+            channels (int): Number of interleaved channels.
+            max_amplitude (float): Maximum possible sample amplitude.
+
+        returns:
+            EnergyProfile: Energy profile.
+        """
+        binner = EnergyBinner(frame_rate, channels, max_amplitude)
+        bins = [binner.feed(chunk) for chunk in samples]
+        bins.append(binner.finish())
+        return cls(np.concatenate(bins), frame_rate, channels, max_amplitude)
+
+    @classmethod
+    def from_audio_segment(cls, audio_segment):
+        """
+        Build the profile of an AudioSegment.
+
+        args:
+            audio_segment (AudioSegment): Audio.
+
+        returns:
+            EnergyProfile: Energy profile.
+        """
+        return cls.from_samples(
+            [audio_segment_samples(audio_segment)],
+            audio_segment.frame_rate,
+            audio_segment.channels,
+            audio_segment.max_possible_amplitude
+        )
+
+    def save(self, path):
+        """
+        Save the profile as a .npz file, written atomically.
+
+        args:
+            path (str): Output path.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            bin_energy=self.bin_energy,
+            frame_rate=self.frame_rate,
+            channels=self.channels,
+            max_amplitude=self.max_amplitude
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a profile saved with save.
+
+        args:
+            path (str): Path of the .npz file.
+
+        returns:
+            EnergyProfile: Energy profile.
+        """
+        with np.load(path) as data:
+            return cls(data["bin_energy"], int(data["frame_rate"]), int(data["channels"]), float(data["max_amplitude"]))
+
+    def window_rms(self, min_silence_len, seek_step=1):
+        """
+        RMS of every window pydub's detect_silence tests.
+
+        args:
+            min_silence_len (int): Window length (miliseconds).
+            seek_step (int): Step between tested windows (miliseconds).
+
+        returns:
+            tuple: Window starts (miliseconds) and their RMS.
+        """
+        if self.seg_len < min_silence_len:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        starts = _window_starts(self.seg_len, min_silence_len, seek_step)
+        return starts, _window_rms(self.cum_energy, starts, min_silence_len, self.frame_rate, self.channels)
+
+    def detect_silence(self, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+        """
+        Detect silences with the semantics of pydub's detect_silence.
+
+        args:
+            min_silence_len (int): Minimum duration of silence (miliseconds).
+            silence_thresh (float): Volume threshold for detecting silence (dBFS).
+            seek_step (int): Step between tested windows (miliseconds).
+
+        returns:
+            list: Silences [start, end] (miliseconds).
+        """
+        return self.sweep([min_silence_len], [silence_thresh], seek_step)[(min_silence_len, silence_thresh)]
+
+    def sweep(self, min_silence_lens, silence_threshs, seek_step=1):
+        """
+        Detect silences for every combination of parameters. Window RMS is computed once per
+        minimum length and shared by all thresholds.
+
+        args:
+            min_silence_lens (iterable<int>): Minimum durations of silence (miliseconds).
+            silence_threshs (iterable<float>): Volume thresholds for detecting silence (dBFS).
+            seek_step (int): Step between tested windows (miliseconds).
+
+        returns:
+            dict: Silences [start, end] (miliseconds) keyed by (min_silence_len, silence_thresh).
+        """
+        silence_threshs = list(silence_threshs)
+        silences = {}
+        for min_silence_len in min_silence_lens:
+            starts, rms = self.window_rms(min_silence_len, seek_step)
+            for silence_thresh in silence_threshs:
+                silent_starts = starts[rms <= db_to_float(silence_thresh) * self.max_amplitude]
+                silences[(min_silence_len, silence_thresh)] = _merge_silent_starts(silent_starts, min_silence_len, seek_step)
+        return silences
+
+
+def audio_segment_samples(audio_segment):
+    """
+    Get a view of the interleaved samples of an AudioSegment.
+
+    args:
+        audio_segment (AudioSegment): Audio, pydub stores 24-bit audio as 32-bit.
+
+    returns:
+        np.ndarray: Signed integer samples.
+    """
+    return np.frombuffer(audio_segment.raw_data, dtype={1: "i1", 2: "<i2", 4: "<i4"}[audio_segment.sample_width])
+
+
+def detect_silence(audio_segment, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Drop-in replacement for pydub's detect_silence. Every window RMS comes from a cumulative
+    sum of squares over the samples, so no window is sliced or measured in Python.
+
+    args:
+        audio_segment (AudioSegment): Audio.
+        min_silence_len (int): Minimum duration of silence (miliseconds).
+        silence_thresh (float): Volume threshold for detecting silence (dBFS).
+        seek_step (int): Step between tested windows (miliseconds).
+
+    returns:
+        list: Silences [start, end] (miliseconds).
+    """
+    scanner = SilenceScanner(
+        audio_segment.frame_rate,
+        audio_segment.channels,
+        audio_segment.max_possible_amplitude,
+        min_silence_len,
+        silence_thresh,
+        seek_step
+    )
+    return scanner.feed(audio_segment_samples(audio_segment)) + scanner.finish()
+
+
+def probe_audio(audio_file):
+    """
+    Get the sample rate and number of channels of the first audio stream of a file.
+
+    args:
+        audio_file (str): Path to the audio or video file.
+
+    returns:
+        tuple: Sample rate (Hz) and number of channels.
+    """
+    stream = next((s for s in ffmpeg.probe(audio_file)["streams"] if s["codec_type"] == "audio"), None)
+    if stream is None:
+        raise ValueError(f"No audio stream found in {audio_file}")
+    return int(stream["sample_rate"]), int(stream["channels"])
+
+
+def read_pcm(audio_file, frame_rate, channels, chunk_ms=10000):
+    """
+    Stream 16-bit PCM from ffmpeg, without decoding the whole file or writing a temp WAV.
+
+    args:
+        audio_file (str): Path to the audio or video file.
+        frame_rate (int): Sample rate to decode at (Hz).
+        channels (int): Number of channels to decode.
+        chunk_ms (int): Duration of audio read at a time (miliseconds).
+
+    yields:
+        np.ndarray: Interleaved samples, a whole number of frames.
+    """
+    frame_width = 2 * channels
+    chunk_size = max(frame_rate * chunk_ms // 1000, 1) * frame_width
+
+    process = (
+        ffmpeg
+        .input(audio_file)
+        .output("pipe:", format="s16le", acodec="pcm_s16le", ac=channels, ar=frame_rate)
+        .run_async(pipe_stdout=True, quiet=True)
+    )
+    try:
+        leftover = b""
+        while True:
+            data = process.stdout.read(chunk_size)
+            if not data:
+                break
+            data = leftover + data
+            n_bytes = len(data) - len(data) % frame_width
+            leftover = data[n_bytes:]
+            yield np.frombuffer(data[:n_bytes], dtype="<i2")
+        process.wait()
+        if process.returncode:
+            raise OSError(f"ffmpeg failed to decode {audio_file}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def stream_silences(audio_file, min_silence_len=2000, silence_thresh=-45, seek_step=1, chunk_ms=10000, frame_rate=None):
+    """
+    Detect silences by streaming 16-bit PCM from ffmpeg, without decoding the whole file or writing a temp WAV.
+
+    args:
+        audio_file (str): Path to the audio or video file.
+        min_silence_len (int): Minimum duration of silence (miliseconds).
+        silence_thresh (float): Volume threshold for detecting silence (dBFS).
+        seek_step (int): Step between tested windows (miliseconds).
+        chunk_ms (int): Duration of audio read at a time (miliseconds).
+        frame_rate (int): Sample rate to decode at, defaults to the source rate.
+
+    yields:
+        list: Silences [start, end] (miliseconds), as soon as they end.
+    """
+    source_rate, channels = probe_audio(audio_file)
+    frame_rate = frame_rate or source_rate
+
+    scanner = SilenceScanner(frame_rate, channels, 2 ** 15, min_silence_len, silence_thresh, seek_step)
+    for samples in read_pcm(audio_file, frame_rate, channels, chunk_ms):
+        yield from scanner.feed(samples)
+    yield from scanner.finish()
+
+
+def _decode_frame_rate(audio_file):
+    # Sample rate the non-streaming path decodes each file type at
+    if audio_file.lower().endswith(".wav"):
+        return None
+    elif audio_file.lower().endswith(".mp4"):
+        return 44100 # sample rate moviepy extracts soundtracks at
+    raise ValueError("Use a file type that contains audio.")
+
+
+def load_energy_profile(audio_file, frame_rate=None, cache_dir=None, chunk_ms=10000):
+    """
+    Decode a file once into its EnergyProfile. Profiles are cached per file in cache_dir, keyed
+    by the path, modification time, size and sample rate, so a changed file is decoded again.
+
+    args:
+        audio_file (str): Path to the audio or video file.
+        frame_rate (int): Sample rate to decode at, defaults to the source rate.
+        cache_dir (str): Directory of cached profiles, no caching if None.
+        chunk_ms (int): Duration of audio read at a time (miliseconds).
+
+    returns:
+        EnergyProfile: Energy profile of the file.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        stat = os.stat(audio_file)
+        key = f"{os.path.abspath(audio_file)}:{stat.st_mtime_ns}:{stat.st_size}:{frame_rate}"
+        cache_path = os.path.join(cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.npz")
+        if os.path.exists(cache_path):
+            return EnergyProfile.load(cache_path)
+
+    source_rate, channels = probe_audio(audio_file)
+    frame_rate = frame_rate or source_rate
+    profile = EnergyProfile.from_samples(read_pcm(audio_file, frame_rate, channels, chunk_ms), frame_rate, channels, 2 ** 15)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        profile.save(cache_path)
+    return profile
+
+
+def sweep_silences(audio_file, min_silence_lens, silence_threshs, seek_step=1, cache_dir=None):
+    """
+    Detect silences in a file for a grid of parameters, decoding it once.
+
+    args:
+        audio_file (str): Path to the audio or video file.
+        min_silence_lens (iterable<int>): Minimum durations of silence (miliseconds).
+        silence_threshs (iterable<float>): Volume thresholds for detecting silence (dBFS).
+        seek_step (int): Step between tested windows (miliseconds).
+        cache_dir (str): Directory of cached energy profiles, no caching if None.
+
+    returns:
+        dict: Silences [start, end] (seconds) keyed by (min_silence_len, silence_thresh).
+    """
+    profile = load_energy_profile(audio_file, _decode_frame_rate(audio_file), cache_dir)
+    return {
+        params: [[start / 1000, end / 1000] for start, end in silences]
+        for params, silences in profile.sweep(min_silence_lens, silence_threshs, seek_step).items()
+    }
+
+
+def silence_params(min_silence_len, silence_thresh):
+    """
+    Resolve the silence detection parameters, filling in the defaults.
+
+    args:
+        min_silence_len (int): Minimum duration of silence (miliseconds), 2 seconds if None.
+        silence_thresh (int): Volume threshold for detecting silence (dBFS), -45 if None.
+
+    returns:
+        dict: Parameters "min_silence_len" and "silence_thresh".
+    """
+    return {
+        "min_silence_len": min_silence_len if min_silence_len is not None else 2000, # 2 seconds
+        "silence_thresh": silence_thresh if silence_thresh is not None else -45, # default silence threshold
+    }
+
+
+def process_audio(audio_file, min_silence_len, silence_thresh, streaming=True):
+    params = silence_params(min_silence_len, silence_thresh)
+    min_silence_len, silence_thresh = params["min_silence_len"], params["silence_thresh"]
+
+    if streaming:
+        frame_rate = _decode_frame_rate(audio_file)
+
+        print("Detecting silences...")
+        silences = [[start / 1000, end / 1000] for start, end in stream_silences(audio_file, min_silence_len, silence_thresh, frame_rate=frame_rate)]
+        print(f"Silences detected at [start, end] timestamps: {silences}\nTotal number of silences: {len(silences)}")
+        return silences
+
     if audio_file.lower().endswith(".wav"):
         audio_segment = AudioSegment.from_file(audio_file, format="wav")
     elif audio_file.lower().endswith(".mp4"):
@@ -45,8 +606,8 @@ def process_audio(audio_file, min_silence_len, silence_thresh):
     print("Detecting silences...")
     silences = detect_silence(
         audio_segment,
-        min_silence_len=min_silence_len if min_silence_len is not None else 2000, # 2 seconds
-        silence_thresh=silence_thresh if silence_thresh is not None else -45 # default silence threshold
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_thresh
     )
 
     silences = [[start / 1000, end / 1000] for start, end in silences]
@@ -54,6 +615,21 @@ def process_audio(audio_file, min_silence_len, silence_thresh):
     return silences
 
 
+def annotated_transcript_path(transcript_file, output):
+    """
+    Get the path the annotated transcript of a transcript file is saved to.
+
+    args:
+        transcript_file (str): The path to the original transcript file.
+        output (str): The directory where the annotated transcript is saved.
+
+    returns:
+        str: Path of the annotated transcript.
+    """
+    file_name = os.path.splitext(os.path.basename(transcript_file))[0]
+    return os.path.join(output, f"{file_name}_annotated_silences.json")
+
+
 def save_transcript_to_file(transcript, transcript_file, output):
     """
     Save the annotated transcript to a file in the specified directory.
@@ -63,17 +639,90 @@ def save_transcript_to_file(transcript, transcript_file, output):
         transcript_file (str): The path to the original transcript file to extract the name.
         output (str): The directory where the annotated transcript will be saved.
     """
-    transcript_filename = os.path.basename(transcript_file)
-    file_name = os.path.splitext(transcript_filename)[0]
-    output_file = os.path.join(output, f"{file_name}_annotated_silences.json")
-    
+    output_file = annotated_transcript_path(transcript_file, output)
+
     with open(output_file, "w") as f:
         json.dump(transcript, f, indent=4)
 
     print(f"Annotated transcript saved to: {output_file}")
 
 
-def annotate_silences_crisperwhisper(transcript_file, audio_file, output, min_silence_len, silence_thresh):
+class SilenceIndex:
+    def __init__(self, silences):
+        """
+        Sorted index of disjoint silences, such as those returned by process_audio.
+
+        args:
+            silences (list): Silences [start, end] (seconds), duplicates are dropped.
+        """
+        self.silences = sorted(set(tuple(silence) for silence in silences))
+        self.starts = np.array([silence[0] for silence in self.silences], dtype=float)
+        self.ends = np.array([silence[1] for silence in self.silences], dtype=float)
+
+    def __len__(self):
+        return len(self.silences)
+
+    def count_before(self, timestamps):
+        """
+        Count the silences starting strictly before each timestamp.
+
+        args:
+            timestamps (array-like): Timestamps (seconds).
+
+        returns:
+            np.ndarray: Number of silences starting before each timestamp.
+        """
+        return np.searchsorted(self.starts, np.asarray(timestamps, dtype=float), side="left")
+
+    def overlapping(self, start, end):
+        """
+        Get the silences that overlap an interval.
+
+        args:
+            start (float): Start of the interval (seconds).
+            end (float): End of the interval (seconds).
+
+        returns:
+            list: Silences (start, end) overlapping the interval.
+        """
+        # Disjoint silences are sorted by their ends too
+        lo = np.searchsorted(self.ends, start, side="right")
+        hi = np.searchsorted(self.starts, end, side="left")
+        return self.silences[lo:hi]
+
+
+def insert_silences(segments, silences, segment_start, make_silence):
+    """
+    Insert each silence before the first segment that starts after it, in one pass. Silences
+    starting after the last segment are dropped.
+
+    args:
+        segments (list): Transcript segments.
+        silences (list or SilenceIndex): Silences [start, end] (seconds).
+        segment_start (callable): Get the start of a segment (seconds).
+        make_silence (callable): Build the segment of a silence from its start and end (seconds).
+
+    returns:
+        list: Segments with the silences inserted.
+    """
+    index = silences if isinstance(silences, SilenceIndex) else SilenceIndex(silences)
+    if not segments:
+        return []
+
+    # Silences inserted before a segment are never revisited, even if a later segment starts earlier
+    n_before = np.maximum.accumulate(index.count_before([segment_start(segment) for segment in segments]))
+
+    merged = []
+    n_inserted = 0
+    for segment, n in zip(segments, n_before):
+        for start, end in index.silences[n_inserted:n]:
+            merged.append(make_silence(start, end))
+        n_inserted = n
+        merged.append(segment)
+    return merged
+
+
+def annotate_silences_crisperwhisper(transcript_file, audio_file, output, min_silence_len, silence_thresh, silences=None):
     """
     Annotate CrisperWhisper transcript with silences in the audio.
 
@@ -82,36 +731,24 @@ def annotate_silences_crisperwhisper(transcript_file, audio_file, output, min_si
         audio_file (str): Path to the audio file.
         min_silence_len (int): Minimum duration of silence (miliseconds).
         silence_thresh (int): Volume threshold for detecting silence.
+        silences (list or SilenceIndex): Precomputed silences (seconds), detected in the audio if None.
     """
     transcript = process_transcript(transcript_file)
-    silences = process_audio(audio_file, min_silence_len, silence_thresh)
-
-    appended_silences = set()
-    i = 0
-
-    while i < len(transcript["chunks"]):
-        chunk = transcript["chunks"][i]
-        start_timestamp = chunk["timestamp"][0]
-
-        for silence in silences:
-            silence_tuple = tuple(silence)
-            if silence_tuple in appended_silences:
-                continue
-            if silence[0] < start_timestamp:
-                silence0 = round(silence[0], 2)
-                silence1 = round(silence[1], 2)
-                transcript["chunks"].insert(
-                    i, {"text": "[silence]", "timestamp": [silence0, silence1], "duration": silence1 - silence0}
-                )
-                appended_silences.add(silence_tuple)
-                break
-        else:
-            i += 1
+    if silences is None:
+        silences = process_audio(audio_file, min_silence_len, silence_thresh)
+
+    def make_silence(start, end):
+        silence0 = round(start, 2)
+        silence1 = round(end, 2)
+        return {"text": "[silence]", "timestamp": [silence0, silence1], "duration": silence1 - silence0}
+
+    transcript["chunks"] = insert_silences(transcript["chunks"], silences, lambda chunk: chunk["timestamp"][0], make_silence)
+    transcript["silence_params"] = silence_params(min_silence_len, silence_thresh)
 
     save_transcript_to_file(transcript, transcript_file, output)
 
 
-def annotate_silences_whisper(transcript_file, audio_file, output, min_silence_len, silence_thresh):
+def annotate_silences_whisper(transcript_file, audio_file, output, min_silence_len, silence_thresh, silences=None):
     """
     Annotate Whisper transcript with silences in the audio.
 
@@ -121,31 +758,19 @@ def annotate_silences_whisper(transcript_file, audio_file, output, min_silence_l
         min_silence_len (int): Minimum duration of silence (miliseconds).
         silence_thresh (int): Volume threshold for detecting silence.
         output (str): Directory where the annotated transcript will be saved.
+        silences (list or SilenceIndex): Precomputed silences (seconds), detected in the audio if None.
     """
     transcript = process_transcript(transcript_file)
-    silences = process_audio(audio_file, min_silence_len, silence_thresh)
-
-    appended_silences = set()
-    i = 0
-
-    while i < len(transcript["word_segments"]):
-        word = transcript["word_segments"][i]
-        start_timestamp = word["start"]
-
-        for silence in silences:
-            silence_tuple = tuple(silence)
-            if silence_tuple in appended_silences:
-                continue
-            if silence[0] < start_timestamp:
-                silence0 = round(silence[0], 2)
-                silence1 = round(silence[1], 2)
-                transcript["word_segments"].insert(
-                    i, {"word": "[silence]", "start": silence0, "end": silence1, "duration": silence1 - silence0}
-                )
-                appended_silences.add(silence_tuple)
-                break
-        else:
-            i += 1
+    if silences is None:
+        silences = process_audio(audio_file, min_silence_len, silence_thresh)
+
+    def make_silence(start, end):
+        silence0 = round(start, 2)
+        silence1 = round(end, 2)
+        return {"word": "[silence]", "start": silence0, "end": silence1, "duration": silence1 - silence0}
+
+    transcript["word_segments"] = insert_silences(transcript["word_segments"], silences, lambda word: word["start"], make_silence)
+    transcript["silence_params"] = silence_params(min_silence_len, silence_thresh)
 
     save_transcript_to_file(transcript, transcript_file, output)
 
@@ -161,22 +786,195 @@ def annotate_silences_datagain(transcript_file, audio_file):
     raise NotImplementedError("Method not implemented.")
 
 
+ANNOTATORS = {
+    "crisperwhisper": annotate_silences_crisperwhisper,
+    "whisper": annotate_silences_whisper,
+}
+AUDIO_EXTENSIONS = [".wav", ".mp4"]
+REPORT_COLUMNS = ["transcript", "audio", "output", "status", "seconds", "error"]
+
+
+def pair_transcripts_with_audio(transcript_dir, audio_dir=None):
+    """
+    Pair the JSON transcripts in a directory with the media file of the same name, preferring WAV over MP4.
+
+    args:
+        transcript_dir (str): Directory of the transcript files.
+        audio_dir (str): Directory of the audio and video files, defaults to transcript_dir.
+
+    returns:
+        list: (transcript_file, audio_file) pairs.
+    """
+    audio_dir = audio_dir or transcript_dir
+    media = {}
+    for f in os.listdir(audio_dir):
+        name, ext = os.path.splitext(f)
+        if ext.lower() in AUDIO_EXTENSIONS:
+            media.setdefault(name, []).append(f)
+
+    pairs = []
+    for f in sorted(os.listdir(transcript_dir)):
+        name, ext = os.path.splitext(f)
+        if ext.lower() != ".json" or name.endswith("_annotated_silences"):
+            continue
+        if name not in media:
+            print(f"No audio found for transcript {f}")
+            continue
+        audio_file = min(media[name], key=lambda m: AUDIO_EXTENSIONS.index(os.path.splitext(m)[1].lower()))
+        pairs.append((os.path.join(transcript_dir, f), os.path.join(audio_dir, audio_file)))
+    return pairs
+
+
+def read_manifest(manifest_file):
+    """
+    Read (transcript_file, audio_file) pairs from a CSV manifest with "transcript" and "audio" columns.
+    Relative paths are resolved against the directory of the manifest.
+
+    args:
+        manifest_file (str): Path to the manifest.
+
+    returns:
+        list: (transcript_file, audio_file) pairs.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, newline="") as f:
+        return [
+            (os.path.join(manifest_dir, row["transcript"]), os.path.join(manifest_dir, row["audio"]))
+            for row in csv.DictReader(f)
+        ]
+
+
+def is_up_to_date(output_file, *source_files, params=None):
+    """
+    Check whether an output exists, is newer than all of its sources and, if params is given, was
+    annotated with the same silence parameters.
+    """
+    if not os.path.exists(output_file):
+        return False
+    output_mtime = os.stat(output_file).st_mtime_ns
+    if not all(os.stat(f).st_mtime_ns <= output_mtime for f in source_files):
+        return False
+    if params is None:
+        return True
+    try:
+        with open(output_file, "r") as f:
+            output = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(output, dict) and output.get("silence_params") == params
+
+
+def _annotate_file(trans_type, transcript_file, audio_file, output, min_silence_len, silence_thresh):
+    # Runs in a worker process, progress is reported by the parent so the per-file output is dropped
+    start = time.perf_counter()
+    status, error = "done", ""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ANNOTATORS[trans_type](transcript_file, audio_file, output, min_silence_len, silence_thresh)
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    return {
+        "transcript": transcript_file,
+        "audio": audio_file,
+        "output": annotated_transcript_path(transcript_file, output),
+        "status": status,
+        "seconds": round(time.perf_counter() - start, 3),
+        "error": error,
+    }
+
+
+def annotate_batch(pairs, trans_type, output, min_silence_len=None, silence_thresh=None, n_workers=None, force=False, report_file=None):
+    """
+    Annotate many transcripts with silences across a process pool, so the imports are paid once per worker.
+    Transcripts whose annotated output is newer than both the transcript and the audio, and was annotated
+    with the same silence parameters, are skipped. Report rows are written as each file completes.
+
+    args:
+        pairs (list): (transcript_file, audio_file) pairs.
+        trans_type (str): Transcript type, one of ANNOTATORS.
+        output (str): Directory where the annotated transcripts will be saved.
+        min_silence_len (int): Minimum duration of silence (miliseconds).
+        silence_thresh (int): Volume threshold for detecting silence.
+        n_workers (int): Number of worker processes, defaults to the number of CPUs.
+        force (bool): Annotate transcripts even if their output is up to date.
+        report_file (str): Path of the per-file timing report (CSV), defaults to annotate_silences_report.csv in output.
+
+    returns:
+        list: Report row of each pair.
+    """
+    if trans_type not in ANNOTATORS:
+        raise ValueError(f"Batch mode supports the transcript types {list(ANNOTATORS)}")
+    os.makedirs(output, exist_ok=True)
+
+    params = silence_params(min_silence_len, silence_thresh)
+    skipped = []
+    jobs = []
+    for transcript_file, audio_file in pairs:
+        output_file = annotated_transcript_path(transcript_file, output)
+        if not force and is_up_to_date(output_file, transcript_file, audio_file, params=params):
+            skipped.append({"transcript": transcript_file, "audio": audio_file, "output": output_file, "status": "skipped", "seconds": 0, "error": ""})
+        else:
+            jobs.append((transcript_file, audio_file))
+    print(f"Annotating {len(jobs)} transcripts, skipping {len(skipped)} up to date")
+
+    report = []
+    report_file = report_file or os.path.join(output, "annotate_silences_report.csv")
+    with open(report_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+
+        # Flushed per row so the report survives a crash or a broken pool
+        def add_result(row):
+            report.append(row)
+            writer.writerow(row)
+            f.flush()
+            if row["status"] != "skipped":
+                print(f"[{len(report)}/{len(pairs)}] {row['status']} {row['transcript']} ({row['seconds']}s) {row['error']}".rstrip())
+
+        for row in skipped:
+            add_result(row)
+
+        job_args = [(trans_type, transcript_file, audio_file, output, min_silence_len, silence_thresh) for transcript_file, audio_file in jobs]
+        if n_workers == 1 or len(jobs) == 1:
+            for args in job_args:
+                add_result(_annotate_file(*args))
+        elif jobs:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                for future in as_completed([executor.submit(_annotate_file, *args) for args in job_args]):
+                    add_result(future.result())
+
+    n_failed = sum(row["status"] == "failed" for row in report)
+    print(f"Timing report saved to: {report_file}\nTotal failed: {n_failed}")
+    return report
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--transcript", type=str, help="Transcript file path.", required=True)
+    parser.add_argument("--transcript", type=str, help="Transcript file path.", required=False)
     parser.add_argument("--transcript_type", type=str, help="Transcript type. Options are [\"crisperwhisper\", \"whisper\", \"datagain\"]", required=True)
-    parser.add_argument("--audio", type=str, help="Audio file path.", required=True)
+    parser.add_argument("--audio", type=str, help="Audio file path.", required=False)
+    parser.add_argument("--transcript_dir", type=str, help="Batch mode, annotate every JSON transcript in this directory with the media file of the same name.", required=False)
+    parser.add_argument("--audio_dir", type=str, help="Directory of the media files in batch mode. Defaults to the transcript directory.", required=False)
+    parser.add_argument("--manifest", type=str, help="Batch mode, CSV file with \"transcript\" and \"audio\" columns.", required=False)
     parser.add_argument("--output", type=str, help="Directory to save the annotated transcript.", default=".", required=False)
-    parser.add_argument("--silence_thresh", type=int, help="Silence threshold. Defaults to 16 decibels below the average loudness of the audio segment.", required=False)
+    parser.add_argument("--silence_thresh", type=int, help="Silence threshold (dBFS). Defaults to -45.", required=False)
     parser.add_argument("--min_silence_len", type=int, help="Minimum duration of silence (miliseconds). Defaults to 2 seconds.", required=False)
+    parser.add_argument("--n_workers", type=int, help="Number of worker processes in batch mode. Defaults to the number of CPUs.", required=False)
+    parser.add_argument("--force", action="store_true", help="Annotate transcripts in batch mode even if their output is up to date.")
+    parser.add_argument("--report", type=str, help="Path of the batch mode timing report. Defaults to annotate_silences_report.csv in the output directory.", required=False)
 
     args = parser.parse_args()
 
     trans_type = args.transcript_type.lower()
-    if trans_type == "crisperwhisper":
-        annotate_silences_crisperwhisper(args.transcript, args.audio, args.output, args.silence_thresh, args.min_silence_len)
+    if args.manifest or args.transcript_dir:
+        pairs = read_manifest(args.manifest) if args.manifest else pair_transcripts_with_audio(args.transcript_dir, args.audio_dir)
+        annotate_batch(pairs, trans_type, args.output, args.min_silence_len, args.silence_thresh, args.n_workers, args.force, args.report)
+    elif not (args.transcript and args.audio):
+        parser.error("--transcript and --audio are required unless --manifest or --transcript_dir is given")
+    elif trans_type == "crisperwhisper":
+        annotate_silences_crisperwhisper(args.transcript, args.audio, args.output, args.min_silence_len, args.silence_thresh)
     elif trans_type == "whisper":
-        annotate_silences_whisper(args.transcript, args.audio, args.output, args.silence_thresh, args.min_silence_len)
+        annotate_silences_whisper(args.transcript, args.audio, args.output, args.min_silence_len, args.silence_thresh)
     elif trans_type == "datagain":
         annotate_silences_datagain(args.transcript, args.audio)
     else:
@@ -1,10 +1,15 @@
 import re
 import json
+import hashlib
+import sqlite3
+import time
+import numpy as np
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, balanced_accuracy_score
 # spaCy
 import spacy
 from spacy.language import Language
-from spacy.tokens import Token
+from spacy.tokens import Doc, Token
+from spacy.attrs import IS_PUNCT, IS_SPACE
 from spacy.tokenizer import Tokenizer
 # MLFlow
 import mlflow
@@ -33,62 +38,180 @@ llms = {
 }
 
 
-def create_custom_nlp(model="en_core_web_md"):
+# Trained components of the en_core_web_* pipelines and the components each one relies on
+PIPELINE_COMPONENTS = ["tok2vec", "tagger", "morphologizer", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+COMPONENT_DEPENDENCIES = {
+    "tok2vec": [],
+    "tagger": ["tok2vec"],
+    "morphologizer": ["tok2vec"],
+    "parser": ["tok2vec"],
+    "senter": ["tok2vec"],
+    "attribute_ruler": ["tagger"],
+    "lemmatizer": ["tagger", "attribute_ruler"],
+    "ner": [],
+}
+
+# Per-token transcript flags, stored once per doc as a uint8 bit array
+FLAG_PUNCT = 1
+FLAG_SPACE = 2
+FLAG_SILENCE = 4
+FLAG_INAUDIBLE = 8
+FLAG_EVENT = 16
+FLAG_FILLER = 32
+NON_WORD_FLAGS = FLAG_PUNCT | FLAG_SPACE | FLAG_SILENCE | FLAG_INAUDIBLE | FLAG_EVENT
+
+# Transcript tag classes in priority order, matched in a single scan of the doc text
+TRANSCRIPT_TAG_PATTERN = re.compile(
+    r"(?P<silence>\[silence(?: \d+s)?\])"
+    r"|(?P<inaudible>\[inaudible\])"
+    r"|(?P<filler>&[a-zA-Z_]+)"
+    r"|(?P<event>\[[^\]]+\])"
+)
+TRANSCRIPT_TAG_FLAGS = {
+    "silence": FLAG_SILENCE,
+    "inaudible": FLAG_INAUDIBLE,
+    "filler": FLAG_FILLER,
+    "event": FLAG_EVENT,
+}
+
+
+def _flag_getter(flag):
+    return lambda token: bool(get_transcript_flags(token.doc)[token.i] & flag)
+
+
+# Register custom attributes
+Doc.set_extension("transcript_flags", default=None, force=True)
+for tag_name, flag in [("is_silence_tag", FLAG_SILENCE), ("is_inaudible_tag", FLAG_INAUDIBLE), ("is_event_tag", FLAG_EVENT), ("is_filler", FLAG_FILLER)]:
+    Token.set_extension(tag_name, getter=_flag_getter(flag), force=True)
+
+# Customize the tokenizer to look for text brackets and & prefix
+SPECIAL_PATTERN = re.compile(r"(\[[^\]]+\]|&[a-zA-Z_]+)")
+
+
+@Language.component("merge_custom_tokens")
+def merge_custom_tokens_component(doc):
+    with doc.retokenize() as retokenizer:
+        for match in SPECIAL_PATTERN.finditer(doc.text):
+            # Get the span of the match in the doc
+            start, end = match.span()
+            span = doc.char_span(start, end)
+            # If a valid span is found (it aligns with token boundaries)
+            if span is not None:
+                retokenizer.merge(span)
+    return doc
+
+
+def compute_transcript_flags(doc):
+    '''
+    Compute the transcript flags of every token in a doc.
+
+    args:
+        doc (spacy.tokens.doc.Doc): spaCy doc object
+
+    return:
+        (np.ndarray): uint8 array of FLAG_* bits, one per token
+    '''
+    flags = np.zeros(len(doc), dtype=np.uint8)
+    if len(doc) == 0:
+        return flags
+
+    attrs = doc.to_array([IS_PUNCT, IS_SPACE])
+    flags[attrs[:, 0] == 1] |= FLAG_PUNCT
+    flags[attrs[:, 1] == 1] |= FLAG_SPACE
+
+    # Tags are only flagged when the match covers exactly one token
+    for match in TRANSCRIPT_TAG_PATTERN.finditer(doc.text):
+        span = doc.char_span(*match.span())
+        if span is not None and len(span) == 1:
+            flags[span.start] |= TRANSCRIPT_TAG_FLAGS[match.lastgroup]
+    return flags
+
+
+def get_transcript_flags(doc):
+    '''
+    Get the transcript flags of a doc, computing them if set_transcript_tags did not run.
+
+    args:
+        doc (spacy.tokens.doc.Doc): spaCy doc object
+
+    return:
+        (np.ndarray): uint8 array of FLAG_* bits, one per token
+    '''
+    flags = doc._.transcript_flags
+    if flags is None or len(flags) != len(doc):
+        flags = compute_transcript_flags(doc)
+        doc._.transcript_flags = flags
+    return flags
+
+
+# Custom pipeline component to set transcript special tags
+@Language.component("set_transcript_tags")
+def set_transcript_tags_component(doc):
+    flags = compute_transcript_flags(doc)
+    doc._.transcript_flags = flags
+
+    for i in np.flatnonzero(flags & (FLAG_SILENCE | FLAG_INAUDIBLE | FLAG_EVENT | FLAG_FILLER)):
+        doc[i].pos_ = "X"
+
+    return doc
+
+
+def resolve_components(components):
+    '''
+    Expand a list of required pipeline components with the components they depend on.
+
+    args:
+        components (list): names of required pipeline components
+
+    return:
+        (set): required components and their dependencies
+    '''
+    required = set()
+    stack = list(components)
+    while stack:
+        name = stack.pop()
+        if name not in COMPONENT_DEPENDENCIES:
+            raise ValueError(f"Unknown pipeline component: {name}. Options are {PIPELINE_COMPONENTS}")
+        if name not in required:
+            required.add(name)
+            stack.extend(COMPONENT_DEPENDENCIES[name])
+    return required
+
+
+def check_components(nlp, components, requester):
+    '''
+    Check that a pipeline has the components a detector needs, raising ValueError otherwise.
+
+    args:
+        nlp (spacy.lang): spaCy model
+        components (list): names of required pipeline components, e.g. from required_components()
+        requester (str): what needs the components, for the error message
+    '''
+    missing = [c for c in components if c not in nlp.pipe_names]
+    if missing:
+        raise ValueError(f"{requester} needs pipeline components {missing}, which are not in the pipeline {nlp.pipe_names}")
+
+
+def create_custom_nlp(model="en_core_web_md", components=None):
     '''
     Load spaCy model and customize with special tokens
     for transcripts. 
 
     args:
         model (str): spaCy mode name
+        components (list or None): pipeline components needed by the detectors, e.g. the union of
+            each detector's required_components(). All other trained components are excluded.
+            Loads the full pipeline if None (default = None)
 
     return:
         (spacy.lang): spaCy model
     '''
-    # Register custom attributes
-    for tag_name in ["is_silence_tag", "is_inaudible_tag", "is_event_tag", "is_filler"]:
-        if not Token.has_extension(tag_name):
-            Token.set_extension(tag_name, default=False)
-
-    # Customize the tokenizer to look for text brackets and & prefix
-    SPECIAL_PATTERN = re.compile(r"(\[[^\]]+\]|&[a-zA-Z_]+)")
-
-    @Language.component("merge_custom_tokens")
-    def merge_custom_tokens_component(doc):
-        with doc.retokenize() as retokenizer:
-            for match in SPECIAL_PATTERN.finditer(doc.text):
-                # Get the span of the match in the doc
-                start, end = match.span()
-                span = doc.char_span(start, end)
-                # If a valid span is found (it aligns with token boundaries)
-                if span is not None:
-                    retokenizer.merge(span)
-        return doc
-
-    # Custom pipeline component to set transcript special tags
-    @Language.component("set_transcript_tags")
-    def set_transcript_tags_component(doc):
-        for token in doc:
-            # Handle silence tags
-            if re.fullmatch(r'\[silence( \d+s)?\]', token.text):
-                token._.is_silence_tag = True
-                token.pos_ = "X"
-            # Handle inaudible tags
-            elif token.text == "[inaudible]":
-                token._.is_inaudible_tag = True
-                token.pos_ = "X"
-            # Handle filler words
-            elif re.fullmatch(r"&[a-zA-Z_]+", token.text):
-                token._.is_filler = True
-                token.pos_ = "X"
-            # Handle all other event tags
-            elif re.fullmatch(r"\[[^\]]+\]", token.text):
-                token._.is_event_tag = True
-                token.pos_ = "X"
-
-        return doc
-
     # Load the spaCy model
-    nlp = spacy.load(model)
+    if components is None:
+        nlp = spacy.load(model)
+    else:
+        required = resolve_components(components)
+        nlp = spacy.load(model, exclude=[c for c in PIPELINE_COMPONENTS if c not in required])
     # Add custom merger component to pipeline
     nlp.add_pipe("merge_custom_tokens", first=True)
     # Add custom tagging component to pipeline
@@ -97,6 +220,38 @@ def create_custom_nlp(model="en_core_web_md"):
     return nlp
 
 
+def create_tokenizer_nlp(lang="en"):
+    '''
+    Create a tokenizer-only spaCy pipeline customized with special
+    tokens for transcripts. Loads without a trained model or vectors,
+    for detectors that only need token text, e.g. the keyword detectors.
+
+    args:
+        lang (str): spaCy language code
+
+    return:
+        (spacy.lang): spaCy model
+    '''
+    nlp = spacy.blank(lang)
+    nlp.add_pipe("merge_custom_tokens", first=True)
+    nlp.add_pipe("set_transcript_tags", last=True)
+    return nlp
+
+
+def doc_word_mask(doc):
+    '''
+    Function to mark the word tokens in a spaCy doc object
+    using custom nlp above.
+
+    args:
+        doc (spacy.tokens.doc.Doc): spaCy doc object
+
+    return:
+        (np.ndarray): boolean array, True for tokens that are words
+    '''
+    return (get_transcript_flags(doc) & NON_WORD_FLAGS) == 0
+
+
 def doc_word_count(doc):
     '''
     Function to count words in a spaCy doc object
@@ -108,11 +263,146 @@ def doc_word_count(doc):
     return:
         (int): number of words in doc
     '''
-    return sum([1 for token in doc if not (token.is_punct or token.is_space or token._.is_silence_tag or token._.is_inaudible_tag or token._.is_event_tag)])
+    return int(np.count_nonzero(doc_word_mask(doc)))
     
 
+class LLMResponseCache:
+    def __init__(self, path="llm_cache.sqlite", ttl=None, max_entries=100000, allow_nondeterministic=False, enabled=True):
+        '''
+        Persistent content-addressed cache of LLM responses backed by SQLite.
+
+        args:
+            path (str): SQLite database file, default = "llm_cache.sqlite"
+            ttl (float or None): seconds before an entry expires, never if None, default = None
+            max_entries (int): maximum number of entries, least recently used are evicted, default = 100000
+            allow_nondeterministic (bool): also cache requests with temperature > 0, default = False
+            enabled (bool): set to False to bypass the cache, default = True
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.allow_nondeterministic = allow_nondeterministic
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+
+        # Estimated number of entries, recounted when it exceeds max_entries or every evict_check_interval puts,
+        # since other processes may share the database
+        self.evict_check_interval = 1000
+        self.n_entries = self._count()
+        self.puts_since_count = 0
+
+    def _count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, messages, response_fmt=None, temperature=None, top_p=None, max_tokens=None):
+        '''
+        Hash the request parameters that determine the response.
+
+        return:
+            (str): SHA-256 hex digest
+        '''
+        request = {
+            "model": model,
+            "messages": messages,
+            "response_format": response_fmt,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, temperature):
+        '''
+        Check whether a request should use the cache.
+
+        args:
+            temperature (float): sampling temperature of the request
+
+        return:
+            (bool): True if the cache is enabled and the request is deterministic or nondeterministic caching is allowed
+        '''
+        return self.enabled and (self.allow_nondeterministic or not temperature)
+
+    def get(self, key):
+        '''
+        Look up a response.
+
+        args:
+            key (str): request key from make_key
+
+        return:
+            (str or None): cached response, None on a miss
+        '''
+        now = time.time()
+        row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+            self.n_entries -= 1
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, response):
+        '''
+        Store a response, evicting the least recently used entries beyond max_entries. The table is
+        only sorted for eviction when it actually holds more than max_entries.
+
+        args:
+            key (str): request key from make_key
+            response (str): raw response content
+        '''
+        now = time.time()
+        self.conn.execute("INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)", (key, response, now, now))
+        self.n_entries += 1
+        self.puts_since_count += 1
+
+        if self.n_entries > self.max_entries or self.puts_since_count >= self.evict_check_interval:
+            self.n_entries = self._count()
+            self.puts_since_count = 0
+            if self.n_entries > self.max_entries:
+                self.conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                self.n_entries = self.max_entries
+        self.conn.commit()
+
+    def clear(self):
+        '''
+        Remove all entries and reset the counters.
+        '''
+        self.conn.execute("DELETE FROM responses")
+        self.conn.commit()
+        self.n_entries = 0
+        self.puts_since_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        '''
+        Get the fraction of lookups served from the cache.
+
+        return:
+            (float): cache hit rate
+        '''
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
 @mlflow.trace
-def llm_call(client, model: str, dev_prompt: str, usr_prompt: str, response_fmt: dict = {"type": "text"}, temperature: float = 0.0, top_p: float = 1.0):
+def llm_call(client, model: str, dev_prompt: str, usr_prompt: str, response_fmt: dict = {"type": "text"}, temperature: float = 0.0, top_p: float = 1.0, cache: LLMResponseCache = None):
     '''
     LLM call function with MLFlow tracing active.
 
@@ -124,6 +414,7 @@ def llm_call(client, model: str, dev_prompt: str, usr_prompt: str, response_fmt:
         response_fmt (dict or None) : response format, default = {"type": "text"}
         temperature (float) : temperature parameter, default = 0.0
         top_p (float) : top_p parameter, default = 1.0
+        cache (LLMResponseCache or None) : response cache, default = None
 
     return:
         (str or dict) : LLM response as string or JSON dict if response_fmt indicates JSON
@@ -133,19 +424,29 @@ def llm_call(client, model: str, dev_prompt: str, usr_prompt: str, response_fmt:
         messages.append({"role": "developer", "content": dev_prompt})
     if usr_prompt is not None:
         messages.append({"role": "user", "content": usr_prompt})
-    
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        response_format=response_fmt,
-        temperature=temperature,
-        top_p=top_p
-    )
+
+    content = None
+    use_cache = cache is not None and cache.is_cacheable(temperature)
+    if use_cache:
+        key = cache.make_key(model, messages, response_fmt, temperature, top_p)
+        content = cache.get(key)
+
+    if content is None:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format=response_fmt,
+            temperature=temperature,
+            top_p=top_p
+        )
+        content = response.choices[0].message.content
+        if use_cache and content is not None:
+            cache.put(key, content)
 
     if "json" in response_fmt["type"].lower():
-        return json.loads(response.choices[0].message.content)
+        return json.loads(content)
     else:
-        return response.choices[0].message.content
+        return content
 
 def evaluate(true, pred, return_latex=False):
     prec = precision_score(true, pred)